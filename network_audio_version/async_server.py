@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于asyncio的服务端核心
+屏幕、音频连接的收发、帧的分发、控制命令数据报和光标广播都运行在同一个事件循环中，
+客户端数量增加时不再为每个连接创建线程
+耗费CPU的采集和编码仍由FrameProducer线程完成，发布新帧时通知事件循环；
+麦克风读取、扬声器播放和鼠标操作会阻塞，各由一个固定的工作线程执行
+"""
+
+import asyncio
+import json
+import queue
+import threading
+import time
+
+from audio_codec import OpusEncoder, OpusDecoder, parse_audio_message, negotiate_audio
+from cursor_channel import CursorState
+from frame_hub import FrameHub
+from rate_control import socket_send_queue
+from resolution_tiers import DEFAULT_TIER
+from stream_protocol import (SIZE_HEADER, HELLO_TIMEOUT, MAX_MESSAGE_SIZE, MAX_JSON_MESSAGE_SIZE, LEGACY_PROTOCOL,
+                             MSG_FRAME, FLAG_KEYFRAME, ProtocolError, apply_socket_profile, message_header, encode_message,
+                             negotiate_hello)
+
+
+async def read_message(reader):
+    """从StreamReader读取一条带长度前缀的JSON消息，连接关闭时返回None"""
+    try:
+        size = SIZE_HEADER.unpack(await reader.readexactly(SIZE_HEADER.size))[0]
+        if size > MAX_JSON_MESSAGE_SIZE:
+            raise ProtocolError(f"JSON消息长度 {size} 超过上限 {MAX_JSON_MESSAGE_SIZE}")
+        data = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+class StreamFrameWriter:
+    """与FrameWriter接口相同，写入asyncio的StreamWriter，由调用方await drain()"""
+    def __init__(self, writer, version):
+        self.writer = writer
+        self.version = version
+
+    def send(self, payload, msg_type=MSG_FRAME, seq=0, captured=None, flags=0):
+        """写入一条消息，帧头和负载不拼接"""
+        header = message_header(self.version, memoryview(payload).nbytes, msg_type, seq, captured, flags)
+        self.writer.writelines((header, payload))
+
+
+class ControlProtocol(asyncio.DatagramProtocol):
+    """
+    控制端口的数据报：光标订阅直接登记，鼠标命令按到达顺序交给注入线程执行
+    同一轮事件循环中到达的数据报先攒在一起，再作为一批提交并确认，积压的移动在注入线程中合并
+    """
+    def __init__(self, server, expire_interval=0.1):
+        self.server = server
+        self.commands = []
+        self.flush_scheduled = False
+        self.transport = None
+        self.expire_interval = expire_interval  # 检查暂存超时的可靠事件的周期（秒）
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.loop.call_later(self.expire_interval, self.expire)
+
+    def datagram_received(self, data, addr):
+        desktop = self.server.desktop
+        try:
+            commands = desktop.parse_control_datagram(data, addr)
+        except Exception as e:
+            print(f"处理控制命令错误: {e}")
+            return
+        self.commands.extend(commands)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.server.loop.call_soon(self.flush)
+
+    def flush(self):
+        commands, self.commands = self.commands, []
+        self.flush_scheduled = False
+        desktop = self.server.desktop
+        desktop.send_control_acks(self.transport.sendto)
+        desktop.submit_control_commands(commands)
+
+    def expire(self):
+        """前面的可靠事件迟迟不到时放行暂存超时的事件"""
+        if self.transport is None or self.transport.is_closing():
+            return
+        self.server.desktop.submit_control_commands(self.server.desktop.control_receiver.expire())
+        self.server.loop.call_later(self.expire_interval, self.expire)
+
+    def error_received(self, exc):
+        # UDP发往已关闭端口的光标数据报会在这里报告，忽略即可
+        pass
+
+
+class UdpVideoProtocol(asyncio.DatagramProtocol):
+    """UDP屏幕传输端口：客户端的注册和NACK"""
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        try:
+            self.server.desktop.udp_video_server.handle_datagram(data, addr)
+        except Exception as e:
+            print(f"处理UDP屏幕传输数据报错误: {e}")
+
+    def error_received(self, exc):
+        pass
+
+
+class AsyncServer:
+    """
+    在一个事件循环线程中服务RemoteDesktop的所有连接
+    线程数固定：事件循环、采集编码、麦克风、播放和执行鼠标命令各一个，与客户端数量无关
+    """
+    def __init__(self, desktop, audio_buffer=64 * 1024, playback_queue=16):
+        self.desktop = desktop
+        self.loop = None
+        self.thread = None
+        self.stopping = None  # 事件循环中的停止信号
+        self.wakes = set()  # 各屏幕客户端的新帧通知
+        self.audio_writers = {}  # 音频客户端的writer -> 协商的编码
+        self.opus_writers = 0  # 使用Opus的音频客户端数，麦克风线程只在大于0时编码
+        self.opus_encoder = None  # 所有Opus客户端共用同一组编码参数，麦克风音频只编码一次
+        self.audio_buffer = audio_buffer  # 单个音频客户端写缓冲区的上限，超过后丢弃新的音频块
+        self.audio_dropped = 0
+        self.playback = queue.Queue(maxsize=playback_queue)  # 待播放的客户端音频，满时丢弃
+
+    def create_hub(self, merge):
+        """创建发布新帧时通知事件循环的FrameHub"""
+        return FrameHub(merge=merge, on_publish=self.notify_publish)
+
+    def start(self):
+        """在后台线程中启动事件循环，监听套接字已由RemoteDesktop创建"""
+        self.thread = threading.Thread(target=self.run, name='asyncio-server')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            print(f"异步服务端错误: {e}")
+
+    def stop(self, timeout=2.0):
+        """通知事件循环关闭所有连接并等待其退出"""
+        if self.loop is not None and self.stopping is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.stopping.set)
+            except RuntimeError:
+                pass  # 事件循环已经结束
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def notify_publish(self):
+        """FrameHub发布新帧后由采集线程调用，唤醒等待的屏幕客户端"""
+        loop = self.loop
+        if loop is None or not self.wakes:
+            return
+        try:
+            loop.call_soon_threadsafe(self.wake_sessions)
+        except RuntimeError:
+            pass  # 事件循环已经关闭
+
+    def wake_sessions(self):
+        for wake in self.wakes:
+            wake.set()
+
+    async def serve(self):
+        desktop = self.desktop
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+
+        screen_server = await asyncio.start_server(self.handle_screen_client, sock=desktop.screen_socket)
+        audio_server = await asyncio.start_server(self.handle_audio_client, sock=desktop.audio_socket)
+        control_transport, _ = await self.loop.create_datagram_endpoint(lambda: ControlProtocol(self),
+                                                                        sock=desktop.control_socket)
+        udp_video_transport = None
+        if desktop.udp_video_server:
+            udp_video_transport, _ = await self.loop.create_datagram_endpoint(lambda: UdpVideoProtocol(self),
+                                                                              sock=desktop.udp_video_socket)
+            desktop.set_udp_video_transport(udp_video_transport)
+        print("服务端核心: asyncio")
+        print("开始监听鼠标控制命令...")
+
+        tasks = []
+        if desktop.cursor_source:
+            tasks.append(asyncio.ensure_future(self.broadcast_cursor(control_transport)))
+        for target, name in ((self.read_microphone, 'microphone'), (self.play_audio, 'playback')):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+
+        # stop() 或 RemoteDesktop.running 变为False时退出
+        while desktop.running and not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+
+        for task in tasks:
+            task.cancel()
+        screen_server.close()
+        audio_server.close()
+        control_transport.close()
+        if udp_video_transport:
+            udp_video_transport.close()
+        for writer in list(self.audio_writers):
+            writer.close()
+        self.wake_sessions()
+        self.playback.put(None)
+
+    async def handle_screen_client(self, reader, writer):
+        """服务一个屏幕客户端：握手、等待新帧并发送，同时读取客户端的回报"""
+        desktop = self.desktop
+        peer = writer.get_extra_info('peername')
+        sock = writer.get_extra_info('socket')
+        print(f"新的屏幕传输客户端连接: {peer}")
+        print(f"屏幕连接套接字设置: {apply_socket_profile(sock, 'video', desktop.notsent_lowat)}")
+
+        session = None
+        feedback = None
+        wake = asyncio.Event()
+        try:
+            # 旧客户端不发送握手，超时后按JPEG和默认档位处理
+            try:
+                hello = await asyncio.wait_for(read_message(reader), HELLO_TIMEOUT)
+            except asyncio.TimeoutError:
+                hello = None
+            codec, tier, hello, reply = negotiate_hello(hello, desktop.screen_codec, desktop.available_codecs,
+                                                        desktop.tiers, DEFAULT_TIER, desktop.screen_reply_options())
+            if reply:
+                writer.write(encode_message(reply))
+            print(f"屏幕传输客户端使用编码: {codec} 档位: {tier}")
+
+            session = desktop.open_screen_session(codec, tier, hello, peer)
+            frames = StreamFrameWriter(writer, hello['protocol'])
+            self.wakes.add(wake)
+            feedback = asyncio.ensure_future(self.read_screen_feedback(reader, session, wake))
+
+            while desktop.running and not feedback.done() and not self.stopping.is_set():
+                # 光标形状变化时先发送形状，每种形状只发一次
+                desktop.send_cursor_shape(session, frames)
+
+                # 先清除通知再取帧，取帧之后发布的新帧会重新设置通知
+                wake.clear()
+                frame = session.subscriber.next_message(timeout=0)
+                if frame is None:
+                    try:
+                        await asyncio.wait_for(wake.wait(), 0.5)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                data, keyframe, frame_id, captured = frame
+
+                # 客户端已缓存的瓦片改为发送引用
+                if session.cache_mirror:
+                    data = session.cache_mirror.rewrite(data)
+
+                # 客户端已注册UDP地址时画面走UDP；TCP写缓冲区超过高水位时在drain中等待，期间的新帧在邮箱中合并或丢弃
+                send_start = time.time()
+                send_queue = None
+                if not desktop.send_frame_udp(session, data, frame_id, captured, keyframe):
+                    frames.send(data, seq=frame_id, captured=captured, flags=FLAG_KEYFRAME if keyframe else 0)
+                    await writer.drain()
+                    send_queue = socket_send_queue(sock)
+                desktop.screen_frame_sent(session, len(data), send_start, time.time() - send_start, send_queue)
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"屏幕传输错误: {e}")
+        finally:
+            self.wakes.discard(wake)
+            if feedback:
+                feedback.cancel()
+            if session:
+                desktop.close_screen_session(session)
+            writer.close()
+            print("屏幕传输客户端连接已关闭")
+
+    async def read_screen_feedback(self, reader, session, wake):
+        """读取客户端通过屏幕连接回报的消息，连接关闭时唤醒发送循环"""
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                self.desktop.apply_screen_feedback(session, message)
+        except ConnectionError:
+            pass
+        except Exception as e:
+            print(f"读取客户端回报错误: {e}")
+        finally:
+            wake.set()
+
+    async def broadcast_cursor(self, transport):
+        """以较高频率向订阅的客户端发送光标位置"""
+        desktop = self.desktop
+        state = CursorState()
+        while desktop.running:
+            await asyncio.sleep(desktop.cursor_interval)
+            data = desktop.poll_cursor(state)
+            if data is None:
+                continue
+            for addr in list(desktop.cursor_clients):
+                transport.sendto(data, addr)
+
+    async def audio_hello(self, reader, writer):
+        """
+        音频连接的编码协商，返回 (编码参数, 旧客户端发来的第一块PCM或None)
+        旧客户端不发送握手而直接发送PCM，第一条消息不是握手时按PCM处理
+        """
+        desktop = self.desktop
+        hello = first = None
+        try:
+            header = await asyncio.wait_for(reader.readexactly(SIZE_HEADER.size), HELLO_TIMEOUT)
+        except asyncio.TimeoutError:
+            header = None
+        if header is not None:
+            size = SIZE_HEADER.unpack(header)[0]
+            if size > MAX_MESSAGE_SIZE:
+                raise ProtocolError(f"消息长度 {size} 超过上限 {MAX_MESSAGE_SIZE}")
+            data = await reader.readexactly(size)
+            hello = parse_audio_message(data)
+            if hello is None:
+                first = data
+        params, reply = negotiate_audio(hello, desktop.audio_codec, desktop.audio_bitrate, desktop.audio_frame_ms)
+        if reply:
+            writer.write(encode_message(reply))
+        return params, first
+
+    async def handle_audio_client(self, reader, writer):
+        """服务一个音频客户端：协商编码后接收其音频放入播放队列，麦克风音频由fan_out_audio写入"""
+        desktop = self.desktop
+        print(f"新的音频客户端连接: {writer.get_extra_info('peername')}")
+        apply_socket_profile(writer.get_extra_info('socket'), 'audio')
+        codec = None
+        try:
+            params, first = await self.audio_hello(reader, writer)
+            codec = params['codec']
+            print(f"音频客户端编码: {desktop.describe_audio(params)}")
+            decoder = None
+            if codec == 'opus':
+                decoder = OpusDecoder()
+                if self.opus_encoder is None:
+                    self.opus_encoder = OpusEncoder(params['bitrate'], params['frame_ms'])
+                self.opus_writers += 1
+            self.audio_writers[writer] = codec
+            data = first
+            while desktop.running:
+                if data is None:
+                    size = SIZE_HEADER.unpack(await reader.readexactly(SIZE_HEADER.size))[0]
+                    if size > MAX_MESSAGE_SIZE:
+                        raise ProtocolError(f"消息长度 {size} 超过上限 {MAX_MESSAGE_SIZE}")
+                    data = await reader.readexactly(size)
+                try:
+                    self.playback.put_nowait((decoder, data))
+                except queue.Full:
+                    self.audio_dropped += 1
+                data = None
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"接收音频错误: {e}")
+        finally:
+            if self.audio_writers.pop(writer, None) == 'opus':
+                self.opus_writers -= 1
+            writer.close()
+
+    def read_microphone(self):
+        """麦克风线程：读取一块音频，有Opus客户端时编码一次，交给事件循环发给所有音频客户端"""
+        desktop = self.desktop
+        if desktop.input_stream is None:
+            return
+        header = None
+        try:
+            while desktop.running and not self.stopping.is_set():
+                data = desktop.input_stream.read(desktop.chunk_size, exception_on_overflow=False)
+                if header is None or SIZE_HEADER.unpack(header)[0] != len(data):
+                    header = message_header(LEGACY_PROTOCOL, len(data))
+                packets = []
+                if self.opus_writers:
+                    for packet in self.opus_encoder.encode(data):
+                        packets += [message_header(LEGACY_PROTOCOL, len(packet)), packet]
+                if self.audio_writers:
+                    self.loop.call_soon_threadsafe(self.fan_out_audio, header, data, packets)
+        except Exception as e:
+            print(f"发送音频错误: {e}")
+
+    def fan_out_audio(self, header, data, packets):
+        """把一块麦克风音频按各自的编码写给所有音频客户端，写缓冲区积压的客户端跳过这一块"""
+        for writer, codec in list(self.audio_writers.items()):
+            if writer.is_closing():
+                self.audio_writers.pop(writer)
+                if codec == 'opus':
+                    self.opus_writers -= 1
+            elif writer.transport.get_write_buffer_size() > self.audio_buffer:
+                self.audio_dropped += 1
+            elif codec == 'opus':
+                if packets:
+                    writer.writelines(packets)
+            else:
+                writer.writelines((header, data))
+
+    def play_audio(self):
+        """播放线程：按到达顺序播放各客户端发来的音频"""
+        output_stream = self.desktop.output_stream
+        while True:
+            item = self.playback.get()
+            if item is None:
+                return
+            if output_stream is None:
+                continue
+            decoder, data = item
+            try:
+                output_stream.write(decoder.decode(data) if decoder else data)
+            except Exception as e:
+                print(f"播放音频错误: {e}")
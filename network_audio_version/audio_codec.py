@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+音频编码
+通过PyAV(libopus)进行Opus编解码：48kHz、10或20ms一帧、码率可配置，单声道语音约24kbit/s，
+原始16位PCM（44.1kHz）约705kbit/s。声卡仍以44.1kHz采集和播放，编码前和解码后在这里重采样
+PyAV未安装或不带libopus时只能使用PCM
+
+音频连接建立后客户端先发送握手（带长度前缀的JSON），服务端选定编码后回复，之后双方按选定的编码发送音频；
+每条消息为一个Opus包或一块PCM。旧客户端不发送握手而直接发送PCM，旧服务端不回复而直接发送PCM，
+收到的第一条消息不是握手时按PCM处理
+"""
+
+import json
+from fractions import Fraction
+
+import numpy as np
+
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    av = None
+    AV_AVAILABLE = False
+
+OPUS_RATE = 48000
+OPUS_FRAME_MS = (10, 20)
+DEVICE_RATE = 44100  # 声卡采集和播放的采样率
+
+
+def available_audio_codecs():
+    """返回本机可用的音频编码列表（按偏好排序），PCM总是可用"""
+    if AV_AVAILABLE:
+        try:
+            av.codec.Codec('libopus', 'w')
+            av.codec.Codec('libopus', 'r')
+            return ['opus', 'pcm']
+        except Exception:
+            pass
+    return ['pcm']
+
+
+def audio_hello(codecs):
+    """客户端的音频握手消息"""
+    return {'type': 'audio_hello', 'codecs': list(codecs)}
+
+
+def parse_audio_message(payload):
+    """音频连接上的第一条消息是握手或回复时返回JSON字典，是PCM音频时返回None"""
+    if len(payload) > 4096 or bytes(payload[:1]) != b'{':
+        return None
+    try:
+        message = json.loads(bytes(payload).decode('utf-8'))
+    except ValueError:
+        return None
+    if not isinstance(message, dict) or message.get('type') not in ('audio_hello', 'audio_hello_ack'):
+        return None
+    return message
+
+
+def negotiate_audio(hello, preferred, bitrate, frame_ms):
+    """
+    服务端根据客户端的握手选定音频编码，返回 (编码参数, 回复)
+    编码参数为 {'codec', 'bitrate', 'frame_ms'}；旧客户端（hello为None）使用PCM且不回复
+    """
+    if hello is None:
+        return {'codec': 'pcm'}, None
+    codec = preferred if preferred in hello.get('codecs', ()) and preferred in available_audio_codecs() else 'pcm'
+    params = {'codec': codec}
+    if codec == 'opus':
+        params.update(bitrate=bitrate, frame_ms=frame_ms)
+    return params, dict(params, type='audio_hello_ack')
+
+
+class OpusEncoder:
+    """把声卡的16位PCM重采样到48kHz后编码为Opus包，不足一帧的样本留到下一次"""
+    def __init__(self, bitrate=24000, frame_ms=20, input_rate=DEVICE_RATE):
+        context = av.CodecContext.create('libopus', 'w')
+        context.sample_rate = OPUS_RATE
+        context.layout = 'mono'
+        context.format = 's16'
+        context.bit_rate = bitrate
+        context.time_base = Fraction(1, OPUS_RATE)
+        context.options = {'frame_duration': str(frame_ms), 'application': 'voip'}
+        context.open()
+        self.context = context
+        self.input_rate = input_rate
+        self.frame_samples = OPUS_RATE * frame_ms // 1000
+        self.resampler = av.AudioResampler(format='s16', layout='mono', rate=OPUS_RATE)
+        self.pending = np.zeros(0, dtype=np.int16)  # 重采样后尚未凑满一帧的样本
+        self.input_pts = 0
+        self.pts = 0
+
+    def encode(self, pcm):
+        """编码一块PCM，返回Opus包列表（可能为空）"""
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        frame = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format='s16', layout='mono')
+        frame.sample_rate = self.input_rate
+        frame.pts = self.input_pts
+        self.input_pts += len(samples)
+        resampled = [self.pending] + [r.to_ndarray().reshape(-1) for r in self.resampler.resample(frame)]
+        buffer = np.concatenate(resampled)
+
+        packets = []
+        size = self.frame_samples
+        offset = 0
+        while len(buffer) - offset >= size:
+            frame = av.AudioFrame.from_ndarray(buffer[offset:offset + size].reshape(1, -1), format='s16', layout='mono')
+            frame.sample_rate = OPUS_RATE
+            frame.pts = self.pts
+            self.pts += size
+            offset += size
+            packets.extend(bytes(packet) for packet in self.context.encode(frame))
+        self.pending = buffer[offset:]
+        return packets
+
+
+class OpusDecoder:
+    """把Opus包解码并重采样为声卡的16位PCM"""
+    def __init__(self, output_rate=DEVICE_RATE):
+        context = av.CodecContext.create('libopus', 'r')
+        context.sample_rate = OPUS_RATE
+        context.layout = 'mono'
+        self.context = context
+        self.resampler = av.AudioResampler(format='s16', layout='mono', rate=output_rate)
+
+    def decode(self, packet):
+        """解码一个Opus包，返回PCM字节串"""
+        chunks = []
+        for frame in self.context.decode(av.Packet(bytes(packet))):
+            chunks.extend(r.to_ndarray().reshape(-1) for r in self.resampler.resample(frame))
+        if not chunks:
+            return b''
+        return np.concatenate(chunks).tobytes()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+屏幕采集热路径内存分配基准测试
+比较 采集 -> 缩放 -> 颜色转换 -> JPEG编码 -> 发送缓冲 的每帧新分配字节数：
+- 优化前：每一步都返回新数组，编码结果再用tobytes()复制一次
+- 优化后：缩放和颜色转换写入FrameBufferPool中复用的缓冲区，编码结果直接发送
+使用合成画面，模拟mss返回的BGRA格式：与mss相同，每次采集都复制一份新的整屏数据，无需显示环境
+采集这一步的分配在两种模式下相同，单独统计
+
+用法: python capture_alloc_benchmark.py --width 3840 --height 2160 --frames 100
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from capture_backends import SyntheticCapture, FrameBufferPool
+
+
+class BGRASyntheticCapture(SyntheticCapture):
+    """与mss相同的BGRA格式的合成画面，每帧像mss的ScreenShot.raw一样复制到新的bytearray"""
+    color_conversion = cv2.COLOR_BGRA2BGR
+
+    def __init__(self, width, height):
+        super().__init__(width, height)
+        self.bgra = np.empty((height, width, 4), dtype=np.uint8)
+
+    def grab(self):
+        bgra = cv2.cvtColor(super().grab(), cv2.COLOR_BGR2BGRA, dst=self.bgra)
+        return np.frombuffer(bytearray(bgra.data), dtype=np.uint8).reshape(bgra.shape)
+
+
+def measure(step, *args):
+    """执行一步并返回 (结果, 该步骤新分配的字节数)"""
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    result = step(*args)
+    return result, tracemalloc.get_traced_memory()[1] - before
+
+
+def run(capture, size, frames, pooled):
+    """运行指定帧数，返回 (每帧采集分配的字节数, 每帧缩放、转换和编码分配的字节数, 每帧平均耗时)"""
+    pool = FrameBufferPool() if pooled else None
+    params = [cv2.IMWRITE_JPEG_QUALITY, 50]
+
+    def convert(raw):
+        return capture.to_bgr(raw, size, pool, 'bench')
+
+    def encode(frame):
+        _, buffer = cv2.imencode('.jpg', frame, params)
+        return buffer if pooled else buffer.tobytes()
+
+    # 预热：分配复用缓冲区，不计入统计
+    encode(convert(capture.grab()))
+
+    grab_bytes = total_bytes = 0
+    start = time.perf_counter()
+    for _ in range(frames):
+        raw, allocated = measure(capture.grab)
+        grab_bytes += allocated
+        frame, allocated = measure(convert, raw)
+        total_bytes += allocated
+        data, allocated = measure(encode, frame)
+        total_bytes += allocated
+    elapsed = time.perf_counter() - start
+    return grab_bytes / frames, total_bytes / frames, elapsed / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='屏幕采集热路径内存分配基准测试')
+    parser.add_argument('--width', type=int, default=3840, help='合成屏幕宽度')
+    parser.add_argument('--height', type=int, default=2160, help='合成屏幕高度')
+    parser.add_argument('--target-width', type=int, default=1024, help='缩放后的宽度')
+    parser.add_argument('--target-height', type=int, default=576, help='缩放后的高度')
+    parser.add_argument('--frames', type=int, default=100, help='每种模式的测试帧数')
+    args = parser.parse_args()
+
+    capture = BGRASyntheticCapture(args.width, args.height)
+    size = (args.target_width, args.target_height)
+    print(f"屏幕 {args.width}x{args.height} BGRA -> {size[0]}x{size[1]} BGR -> JPEG，{args.frames} 帧")
+
+    tracemalloc.start()
+    results = {}
+    for name, pooled in (('优化前', False), ('优化后', True)):
+        grabbed, per_frame, seconds = run(capture, size, args.frames, pooled)
+        results[name] = per_frame
+        print(f"{name}: 采集每帧分配 {grabbed / 1024:.1f} KiB，缩放、转换和编码每帧分配 {per_frame / 1024:.1f} KiB，"
+              f"20fps时合计 {(grabbed + per_frame) * 20 / 1024 / 1024:.1f} MiB/s，每帧耗时 {seconds * 1000:.2f} ms")
+    tracemalloc.stop()
+
+    if results['优化后']:
+        print(f"采集之后的分配量减少到原来的 {results['优化后'] / results['优化前'] * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+屏幕采集后端
+- pyautogui: 兼容性最好但速度最慢
+- mss: 通过显示服务器的共享内存（X11下为XShm）读取，mss每帧把BGRA数据复制到新的bytearray（ScreenShot.raw），
+  返回的numpy数组直接引用这份数据，不再额外复制；这一次整屏大小的分配无法避免
+- synthetic: 确定性的合成画面，用于无显示环境下的压测和基准测试
+缩放和颜色转换的结果可以写入FrameBufferPool中复用的缓冲区，避免每帧分配整帧大小的数组
+"""
+
+import cv2
+import numpy as np
+
+
+class FrameBufferPool:
+    """按名称复用的图像缓冲区，尺寸或类型变化时才重新分配"""
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, key, shape, dtype=np.uint8):
+        """返回名为key、指定形状的缓冲区，内容是上一次使用时留下的数据"""
+        buffer = self.buffers.get(key)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buffer
+        return buffer
+
+    def clear(self):
+        """释放所有缓冲区"""
+        self.buffers.clear()
+
+
+class CaptureBackend:
+    """采集后端基类，grab()返回原始格式的图像，color_conversion为转换到BGR的cv2颜色代码"""
+    name = 'base'
+    color_conversion = None  # None表示grab()已经是BGR
+
+    def size(self):
+        """返回屏幕尺寸 (width, height)"""
+        raise NotImplementedError
+
+    def grab(self):
+        """采集一帧原始图像"""
+        raise NotImplementedError
+
+    def grab_bgr(self, size=None, pool=None, key='bgr'):
+        """采集一帧并转换为BGR；指定size时先缩放再转换颜色，缩放后的图像更小，转换更快"""
+        return self.to_bgr(self.grab(), size, pool, key)
+
+    def to_bgr(self, frame, size=None, pool=None, key='bgr'):
+        """
+        把grab()返回的原始图像缩放到size并转换为BGR，同一帧可以转换出多种尺寸
+        提供pool时结果写入按key复用的缓冲区，下一次以相同key调用时会被覆盖
+        """
+        if size is not None and (frame.shape[1], frame.shape[0]) != tuple(size):
+            dst = None
+            if pool is not None:
+                dst = pool.get((key, 'resize'), (size[1], size[0]) + frame.shape[2:], frame.dtype)
+            frame = cv2.resize(frame, tuple(size), dst=dst, interpolation=cv2.INTER_AREA)
+        if self.color_conversion is not None:
+            dst = None
+            if pool is not None:
+                dst = pool.get(key, frame.shape[:2] + (3,), frame.dtype)
+            frame = cv2.cvtColor(frame, self.color_conversion, dst=dst)
+        return frame
+
+    def close(self):
+        """释放资源"""
+        pass
+
+
+class PyAutoGUICapture(CaptureBackend):
+    """通过pyautogui.screenshot()采集"""
+    name = 'pyautogui'
+    color_conversion = cv2.COLOR_RGB2BGR
+
+    def __init__(self):
+        import pyautogui
+        self.pyautogui = pyautogui
+
+    def size(self):
+        return tuple(self.pyautogui.size())
+
+    def grab(self):
+        # PIL图像转换为数组时不可避免要复制一次
+        return np.asarray(self.pyautogui.screenshot())
+
+
+class MSSCapture(CaptureBackend):
+    """通过mss采集（Linux下使用XShm共享内存），返回引用mss每帧新复制的BGRA数据的numpy数组"""
+    name = 'mss'
+    color_conversion = cv2.COLOR_BGRA2BGR
+
+    def __init__(self, monitor=1):
+        import mss
+        self.mss = mss
+        self.monitor_index = monitor
+        self.sct = None
+        # 先在当前线程探测一次屏幕尺寸
+        with mss.mss() as sct:
+            monitor_info = sct.monitors[monitor]
+            self.monitor = dict(monitor_info)
+
+    def size(self):
+        return self.monitor['width'], self.monitor['height']
+
+    def grab(self):
+        # mss实例不能跨线程使用，在采集线程中延迟创建
+        if self.sct is None:
+            self.sct = self.mss.mss()
+        shot = self.sct.grab(self.monitor)
+        # shot.raw已经是mss从共享内存复制出的bytearray，这里只包装不复制
+        return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+
+    def close(self):
+        if self.sct is not None:
+            self.sct.close()
+            self.sct = None
+
+
+class SyntheticCapture(CaptureBackend):
+    """
+    确定性的合成画面：渐变背景上的移动方块、滚动文字和类似视频的噪声区域
+    相同的参数和帧序号总是生成相同的图像
+    """
+    name = 'synthetic'
+
+    def __init__(self, width=1920, height=1080, seed=0):
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.index = 0
+
+        # 渐变背景
+        x = np.linspace(40, 200, width, dtype=np.float32)
+        y = np.linspace(30, 120, height, dtype=np.float32)
+        self.background = np.empty((height, width, 3), dtype=np.uint8)
+        self.background[:, :, 0] = (x[None, :] * 0.5 + y[:, None] * 0.5).astype(np.uint8)
+        self.background[:, :, 1] = y[:, None].astype(np.uint8)
+        self.background[:, :, 2] = x[None, :].astype(np.uint8)
+
+        # 滚动文字区域：预先渲染两倍高度的文字条，滚动时只做切片
+        self.text_width = width // 2
+        self.text_height = height // 2
+        strip = np.full((self.text_height * 2, self.text_width, 3), 255, dtype=np.uint8)
+        for line, y_pos in enumerate(range(24, self.text_height * 2, 24)):
+            cv2.putText(strip, f"{line:04d}  synthetic scrolling text line for capture benchmarks",
+                        (8, y_pos), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (20, 20, 20), 1, cv2.LINE_AA)
+        self.text_strip = strip
+
+        # 噪声区域：预先生成两倍大小的随机块，每帧取不同偏移的窗口，采集时不分配内存
+        self.noise_h, self.noise_w = height // 3, width // 3
+        rng = np.random.default_rng(seed)
+        self.noise = rng.integers(0, 256, (self.noise_h * 2, self.noise_w * 2, 3), dtype=np.uint8)
+
+        self.frame = np.empty_like(self.background)
+
+    def size(self):
+        return self.width, self.height
+
+    def grab(self):
+        index = self.index
+        self.index += 1
+        frame = self.frame
+        np.copyto(frame, self.background)
+
+        # 左半部分：逐行滚动的文字
+        offset = (index * 2) % self.text_height
+        frame[:self.text_height, :self.text_width] = self.text_strip[offset:offset + self.text_height]
+
+        # 右下部分：类似视频的噪声区域
+        noise_h, noise_w = self.noise_h, self.noise_w
+        ny = (index * 37) % noise_h
+        nx = (index * 53) % noise_w
+        frame[-noise_h:, -noise_w:] = self.noise[ny:ny + noise_h, nx:nx + noise_w]
+
+        # 沿对角线来回移动的方块
+        box = min(self.width, self.height) // 8
+        span_x = self.width - box
+        span_y = self.height - box
+        step = index * 7
+        x = abs(step % (2 * span_x) - span_x)
+        y = abs(step % (2 * span_y) - span_y)
+        frame[y:y + box, x:x + box] = (0, 160, 255)
+
+        return frame
+
+
+BACKENDS = {
+    'pyautogui': PyAutoGUICapture,
+    'mss': MSSCapture,
+    'synthetic': SyntheticCapture,
+}
+
+
+def create_capture_backend(name='auto', **kwargs):
+    """
+    创建采集后端
+    'auto' 优先使用mss，不可用时回退到pyautogui
+    """
+    if name == 'auto':
+        for candidate in ('mss', 'pyautogui'):
+            try:
+                return BACKENDS[candidate](**kwargs)
+            except Exception as e:
+                print(f"采集后端 {candidate} 不可用: {e}")
+        raise RuntimeError("没有可用的屏幕采集后端")
+
+    if name not in BACKENDS:
+        raise ValueError(f"未知的采集后端: {name}")
+    return BACKENDS[name](**kwargs)
@@ -8,12 +8,13 @@
 import socket
 import cv2
 import numpy as np
-import struct
 import time
 import argparse
 import threading
 import json
 
+from stream_protocol import FrameReader, LEGACY_PROTOCOL
+
 # 尝试导入GUI相关模块
 GUI_AVAILABLE = False
 try:
@@ -204,37 +205,15 @@ class RemoteDesktopClient:
         
     def receive_screen(self):
         """接收屏幕图像"""
-        data = b""
-        payload_size = struct.calcsize("!L")
+        reader = FrameReader(self.screen_socket, LEGACY_PROTOCOL)
         
         while self.running:
             try:
-                # 接收图像大小
-                while len(data) < payload_size:
-                    packet = self.screen_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < payload_size:
+                # 接收一条带长度前缀的消息，负载指向复用的接收缓冲区
+                message = reader.read()
+                if message is None:
                     break
-                    
-                packed_msg_size = data[:payload_size]
-                data = data[payload_size:]
-                msg_size = struct.unpack("!L", packed_msg_size)[0]
-                
-                # 接收图像数据
-                while len(data) < msg_size:
-                    packet = self.screen_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < msg_size:
-                    break
-                    
-                frame_data = data[:msg_size]
-                data = data[msg_size:]
+                frame_data = message.payload
                 
                 # 解码图像
                 frame = cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+控制通道丢包测试
+客户端以固定频率发送移动并穿插点击、拖拽和按下-移动-松开，两个方向都经过LossySocket按指定概率丢包，
+服务端用ControlReceiver解析并确认，统计执行的按键事件是否齐全、是否按顺序、有无重复，
+按下和松开是否成对、结束时有没有仍然按住的按键，以及重传次数
+无需显示环境
+
+用法: python control_loss_benchmark.py --loss 0 0.05 0.2 --burst 2 --events 300
+"""
+
+import argparse
+import socket
+import threading
+import time
+
+from control_protocol import ControlSender, ControlReceiver, InputSampler, is_ack
+from udp_transport import LossySocket
+
+
+def run(events, loss, burst, rate):
+    """发送全部事件并返回 (执行的可靠事件列表, 发送的可靠事件数, 接收统计, 发送统计)"""
+    server_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_sock.bind(('127.0.0.1', 0))
+    server_sock.settimeout(0.05)
+    server_addr = server_sock.getsockname()
+    server_out = LossySocket(server_sock, loss=loss, burst=burst, seed=2)
+    receiver = ControlReceiver()
+
+    client_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client_sock.bind(('127.0.0.1', 0))
+    client_sock.settimeout(0.05)
+    client_out = LossySocket(client_sock, loss=loss, burst=burst, seed=1)
+    sender = ControlSender()
+    sampler = InputSampler(rate, transitions=True)
+    running = True
+    executed = []  # 执行的可靠事件: (编号, 类型)，以x坐标作为编号
+
+    def serve():
+        while running:
+            try:
+                data, addr = server_sock.recvfrom(2048)
+                commands = receiver.receive(data, addr)
+            except socket.timeout:
+                commands = receiver.expire()
+            for ack, addr in receiver.take_acks():
+                server_out.sendto(ack, addr)
+            executed.extend((command['x'], command['type']) for command in commands if command['type'] != 'move')
+
+    def receive_acks():
+        while running:
+            try:
+                data, _ = client_sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            if is_ack(data):
+                sender.handle_ack(data)
+
+    threads = [threading.Thread(target=serve), threading.Thread(target=receive_acks)]
+    for thread in threads:
+        thread.start()
+
+    # 每个采样周期移动一次，每10个周期点击、双击、拖拽或按下一次；按下后按住移动3个周期再松开
+    view_size = (1024, 576)
+    buttons = 0
+    sent = 0
+    holding = None
+    for index in range(events):
+        sampler.motion(index % 1000, 100, dragging=holding is not None)
+        datagrams = sender.encode(sampler.tick(), view_size)
+        if holding is not None and index % 10 == 9:
+            datagrams += sender.encode(sampler.release(holding, 120), view_size)
+            holding = None
+            sent += 1
+        elif index % 10 == 5:
+            kind = ('click', 'double_click', 'drag', 'press')[buttons % 4]
+            if kind == 'press':
+                datagrams += sender.encode(sampler.press(buttons, 100), view_size)
+                holding = buttons
+            else:
+                command = {'type': kind, 'x': buttons, 'y': 100, 'end_x': buttons, 'end_y': 120}
+                datagrams += sender.encode(sampler.button(command), view_size)
+            buttons += 1
+            sent += 1
+        for data in datagrams + sender.retransmit():
+            client_out.sendto(data, server_addr)
+        time.sleep(1.0 / rate)
+
+    # 继续重传，直到全部确认或放弃
+    deadline = time.monotonic() + 2.0
+    while sender.unacked and time.monotonic() < deadline:
+        for data in sender.retransmit():
+            client_out.sendto(data, server_addr)
+        time.sleep(1.0 / rate)
+    time.sleep(0.2)
+    running = False
+    for thread in threads:
+        thread.join()
+    server_sock.close()
+    client_sock.close()
+    return executed, sent, receiver.stats, sender.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='控制通道丢包测试')
+    parser.add_argument('--loss', type=float, nargs='+', default=[0, 0.05, 0.2], help='丢包率（两个方向）')
+    parser.add_argument('--burst', type=float, default=1.0, help='平均连续丢包个数')
+    parser.add_argument('--events', type=int, default=300, help='采样周期数，每10个周期一次点击、拖拽或按下')
+    parser.add_argument('--rate', type=int, default=120, help='采样频率（Hz）')
+    args = parser.parse_args()
+
+    for loss in args.loss:
+        executed, sent, rx, tx = run(args.events, loss, args.burst, args.rate)
+        numbers = [number for number, _ in executed]
+        in_order = numbers == sorted(numbers)
+        duplicates = len(executed) - len(set(executed))
+        # 按服务端执行的顺序模拟按键状态：按下和松开应当交替出现，结束时没有按住的按键
+        held = set()
+        unpaired = 0
+        for number, kind in executed:
+            if kind == 'press':
+                unpaired += bool(held)
+                held.add(number)
+            elif kind == 'release':
+                unpaired += number not in held
+                held.discard(number)
+        print(f"丢包率 {loss * 100:.0f}%: 执行按键事件 {len(set(executed))}/{sent}，"
+              f"{'按顺序' if in_order else '顺序错误'}，重复执行 {duplicates}，"
+              f"未成对的按下/松开 {unpaired}，结束时仍按住 {len(held)}，"
+              f"重传 {tx['retransmits']}，放弃 {tx['given_up']}，服务端收到重复 {rx['duplicates']}，"
+              f"跳过 {rx['skipped']}，迟到的松开 {rx['late']}，丢弃的旧移动 {rx['stale_moves']}，往返 {tx['rtt_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鼠标控制命令的UDP消息格式
+新格式为定长二进制：一个数据报可以携带多个事件，每个事件带有序号和客户端时间戳，
+服务端据此发现丢失和乱序的数据报，并丢弃比已执行的位置更旧的移动
+点击、双击、拖拽、按下和松开是可靠事件：使用独立的连续序号，服务端逐个确认并按序号顺序执行，重复到达的只执行一次，
+客户端在短超时后重传未确认的事件；移动不重传，只取最新的。松开一直重传到确认为止，避免远端按键一直按住
+旧格式为每个数据报一条JSON命令，过渡期间两端都继续支持：
+服务端按数据报的魔数区分两种格式，客户端只在屏幕握手回复中列出binary时才使用二进制格式
+客户端用InputSampler按固定频率发送指针位置，按键事件立即发送；服务端列出buttons时按下和松开分开发送
+"""
+
+import json
+import struct
+import threading
+import time
+
+CONTROL_MAGIC = b'RC'
+CONTROL_VERSION = 1
+# 服务端在屏幕握手回复的control字段中列出支持的格式；buttons表示支持单独的按下和松开事件（按住期间的移动即拖拽）
+CONTROL_FORMATS = ['binary', 'json', 'buttons']
+
+# 数据报头: 魔数, 版本, 事件数, 客户端画面宽, 高（控制坐标以该尺寸为准）
+DATAGRAM_HEADER = struct.Struct("!2sBBHH")
+# 事件: 类型, 按键（最高位为可靠事件标志）, 序号, 客户端时间戳（毫秒，32位回绕）, x, y, 终点x, 终点y（拖拽）
+EVENT = struct.Struct("!BBIIhhhh")
+# 服务端的确认: 魔数, 序号个数，后跟各可靠事件的序号（uint32）
+ACK_MAGIC = b'RA'
+ACK_HEADER = struct.Struct("!2sH")
+ACK_SEQ = struct.Struct("!I")
+MAX_ACKS = 256
+MAX_BATCH = 64  # 单个数据报最多携带的事件数，约1.2KB，不超过常见路径的MTU
+
+EVENT_TYPES = {'move': 1, 'click': 2, 'double_click': 3, 'drag': 4, 'cursor': 5, 'press': 6, 'release': 7}
+EVENT_NAMES = {code: name for name, code in EVENT_TYPES.items()}
+BUTTONS = {'left': 1, 'middle': 2, 'right': 3}
+BUTTON_NAMES = {code: name for name, code in BUTTONS.items()}
+RELIABLE_FLAG = 0x80
+
+# 只有最新位置有意义的事件，乱序到达的旧事件直接丢弃
+POSITIONAL_EVENTS = ('move',)
+# 需要确认和重传、按顺序只执行一次的事件
+RELIABLE_EVENTS = ('click', 'double_click', 'drag', 'press', 'release')
+# 不会放弃重传、在服务端跳过空缺后迟到也执行的事件：丢失的松开会让远端按键一直按住（重复松开没有影响）
+PERSISTENT_EVENTS = ('release',)
+MAX_SKIPPED = 256  # 服务端为每个客户端记录的已跳过序号数
+
+
+def clamp16(value):
+    return max(-32768, min(int(value), 32767))
+
+
+def newer_seq(seq, last):
+    """序号seq是否比last新（考虑32位回绕）"""
+    return last is None or 0 < (seq - last) & 0xFFFFFFFF < 0x80000000
+
+
+def encode_events(commands, view_size):
+    """把已分配序号和时间戳的命令打包为一个二进制数据报"""
+    header = DATAGRAM_HEADER.pack(CONTROL_MAGIC, CONTROL_VERSION, len(commands), view_size[0], view_size[1])
+    events = []
+    for command in commands:
+        x, y = command.get('x', 0), command.get('y', 0)
+        button = BUTTONS.get(command.get('button', 'left'), 1) | (RELIABLE_FLAG if command.get('reliable') else 0)
+        events.append(EVENT.pack(EVENT_TYPES[command['type']], button,
+                                 command['seq'] & 0xFFFFFFFF, command['t'] & 0xFFFFFFFF, clamp16(x), clamp16(y),
+                                 clamp16(command.get('end_x', x)), clamp16(command.get('end_y', y))))
+    return header + b''.join(events)
+
+
+def decode_datagram(data):
+    """
+    解析一个控制数据报，返回命令字典列表，字段与JSON命令相同
+    二进制格式的命令另有 seq（序号）和 t（客户端时间戳，毫秒），可靠事件带有 reliable；无法识别的数据报返回空列表
+    """
+    if data[:2] != CONTROL_MAGIC:
+        command = json.loads(data.decode('utf-8'))
+        return [command] if isinstance(command, dict) else []
+    if len(data) < DATAGRAM_HEADER.size:
+        return []
+    _, version, count, width, height = DATAGRAM_HEADER.unpack_from(data)
+    if version != CONTROL_VERSION or len(data) != DATAGRAM_HEADER.size + count * EVENT.size:
+        return []
+    commands = []
+    for offset in range(DATAGRAM_HEADER.size, len(data), EVENT.size):
+        event_type, button, seq, t, x, y, end_x, end_y = EVENT.unpack_from(data, offset)
+        name = EVENT_NAMES.get(event_type)
+        if name is None:
+            continue
+        command = {'type': name, 'x': x, 'y': y, 'w': width, 'h': height, 'seq': seq, 't': t}
+        if button & RELIABLE_FLAG:
+            command['reliable'] = True
+            button &= ~RELIABLE_FLAG
+        if name == 'drag':
+            command['end_x'], command['end_y'] = end_x, end_y
+        elif name in ('click', 'press', 'release'):
+            command['button'] = BUTTON_NAMES.get(button, 'left')
+        commands.append(command)
+    return commands
+
+
+def pack_ack(seqs):
+    """打包确认数据报"""
+    return ACK_HEADER.pack(ACK_MAGIC, len(seqs)) + b''.join(ACK_SEQ.pack(seq) for seq in seqs)
+
+
+def unpack_ack(data):
+    """解析确认数据报，返回序号列表，不是确认数据报时返回None"""
+    if data[:2] != ACK_MAGIC or len(data) < ACK_HEADER.size:
+        return None
+    _, count = ACK_HEADER.unpack_from(data)
+    if len(data) != ACK_HEADER.size + count * ACK_SEQ.size:
+        return None
+    return [ACK_SEQ.unpack_from(data, ACK_HEADER.size + i * ACK_SEQ.size)[0] for i in range(count)]
+
+
+def is_ack(data):
+    return data[:2] == ACK_MAGIC
+
+
+class PendingEvent:
+    """客户端等待确认的可靠事件"""
+    def __init__(self, command, view_size, now):
+        self.command = command
+        self.view_size = view_size
+        self.first_sent = now
+        self.next_send = now
+        self.attempts = 1
+
+
+class ControlSender:
+    """
+    客户端的控制命令编码：为每个事件分配序号和时间戳
+    可靠事件另用连续的序号，在rto秒内未确认时重传，每次等待时间加倍（不超过max_rto），共发送max_attempts次；
+    松开不受次数限制，每max_rto秒重传一次直到确认
+    binary为False时（服务端不支持二进制格式）每条命令一个JSON数据报，不确认也不重传
+    encode/retransmit在界面线程中调用，handle_ack在接收线程中调用
+    """
+    def __init__(self, binary=True, rto=0.05, max_rto=0.2, max_attempts=6):
+        self.binary = binary
+        self.seq = 0
+        self.reliable_seq = 0
+        self.rto = rto
+        self.max_rto = max_rto
+        self.max_attempts = max_attempts
+        self.unacked = {}  # 可靠序号 -> PendingEvent
+        self.lock = threading.Lock()
+        self.stats = {'reliable': 0, 'acked': 0, 'retransmits': 0, 'given_up': 0, 'rtt_ms': 0.0}
+
+    def encode(self, commands, view_size, now=None):
+        """把一批命令编码为要发送的数据报列表"""
+        if not self.binary:
+            datagrams = []
+            for command in commands:
+                command = dict(command)
+                command['w'], command['h'] = view_size
+                datagrams.append(json.dumps(command).encode('utf-8'))
+            return datagrams
+
+        now = time.monotonic() if now is None else now
+        t = int(now * 1000) & 0xFFFFFFFF
+        stamped = []
+        with self.lock:
+            for command in commands:
+                if command['type'] in RELIABLE_EVENTS:
+                    self.reliable_seq = (self.reliable_seq + 1) & 0xFFFFFFFF
+                    command = dict(command, seq=self.reliable_seq, t=t, reliable=True)
+                    pending = PendingEvent(command, tuple(view_size), now)
+                    pending.next_send = now + self.rto
+                    self.unacked[self.reliable_seq] = pending
+                    self.stats['reliable'] += 1
+                else:
+                    self.seq = (self.seq + 1) & 0xFFFFFFFF
+                    command = dict(command, seq=self.seq, t=t)
+                stamped.append(command)
+        return [encode_events(stamped[i:i + MAX_BATCH], view_size) for i in range(0, len(stamped), MAX_BATCH)]
+
+    def retransmit(self, now=None):
+        """返回需要重传的数据报（按序号顺序），超过发送次数的事件放弃（松开除外）"""
+        if not self.unacked:
+            return []
+        now = time.monotonic() if now is None else now
+        batches = {}  # 画面尺寸 -> 命令列表
+        with self.lock:
+            for seq in sorted(self.unacked, key=lambda seq: (seq - self.reliable_seq - 1) & 0xFFFFFFFF):
+                pending = self.unacked[seq]
+                if now < pending.next_send:
+                    continue
+                if pending.attempts >= self.max_attempts and pending.command['type'] not in PERSISTENT_EVENTS:
+                    del self.unacked[seq]
+                    self.stats['given_up'] += 1
+                    continue
+                pending.attempts += 1
+                pending.next_send = now + min(self.rto * 2 ** (pending.attempts - 1), self.max_rto)
+                batches.setdefault(pending.view_size, []).append(pending.command)
+                self.stats['retransmits'] += 1
+        return [encode_events(commands[i:i + MAX_BATCH], view_size)
+                for view_size, commands in batches.items() for i in range(0, len(commands), MAX_BATCH)]
+
+    def handle_ack(self, data, now=None):
+        """处理服务端的确认数据报，不是确认数据报时返回False"""
+        seqs = unpack_ack(data)
+        if seqs is None:
+            return False
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for seq in seqs:
+                pending = self.unacked.pop(seq, None)
+                if pending is None:
+                    continue
+                self.stats['acked'] += 1
+                # 只用没有重传过的事件估计往返时间
+                if pending.attempts == 1:
+                    self.stats['rtt_ms'] = (now - pending.first_sent) * 1000
+        return True
+
+
+class ControlClientState:
+    """服务端为一个客户端地址记录的序号状态"""
+    def __init__(self):
+        self.last_seq = None  # 收到的最大序号
+        self.last_position_seq = None  # 已接受的最新移动的序号
+        self.min_offset = None  # 到达时间与客户端时间戳之差的最小值（毫秒）
+        self.next_reliable = 1  # 下一个应执行的可靠事件序号
+        self.held = {}  # 序号不连续时暂存的可靠事件: 序号 -> (命令, 到达时间)
+        self.skipped = {}  # 暂存超时后跳过的序号（按跳过顺序），迟到的松开仍然执行
+
+
+class ControlReceiver:
+    """
+    服务端的控制数据报解析：统计丢失、乱序和批量，丢弃比已接受的位置更旧的移动
+    可靠事件逐个确认（重复到达的也确认），按序号顺序只执行一次；前面的事件迟迟不到时，
+    暂存超过hold_timeout秒后跳过空缺（客户端已放弃重传）；跳过的松开迟到时仍然执行，避免按键一直按住
+    """
+    def __init__(self, max_clients=64, hold_timeout=1.0):
+        self.max_clients = max_clients
+        self.hold_timeout = hold_timeout
+        self.clients = {}  # 客户端地址 -> ControlClientState
+        self.acks = {}  # 客户端地址 -> 待确认的序号列表
+        self.stats = {'datagrams': 0, 'json': 0, 'events': 0, 'batched': 0, 'lost': 0, 'reordered': 0,
+                      'stale_moves': 0, 'jitter_ms': 0, 'reliable': 0, 'duplicates': 0, 'held': 0, 'skipped': 0, 'late': 0}
+
+    def receive(self, data, addr, now=None):
+        """解析一个数据报，返回应当执行的命令列表（按执行顺序）"""
+        commands = decode_datagram(data)
+        self.stats['datagrams'] += 1
+        if commands and 'seq' not in commands[0]:
+            self.stats['json'] += 1
+            return commands
+        if len(commands) > 1:
+            self.stats['batched'] += 1
+
+        state = self.clients.get(addr)
+        if state is None:
+            if len(self.clients) >= self.max_clients:
+                self.clients.pop(next(iter(self.clients)))
+            state = self.clients[addr] = ControlClientState()
+
+        now = time.monotonic() if now is None else now
+        now_ms = int(now * 1000)
+        accepted = self.release_expired(state, now)
+        for command in commands:
+            seq = command['seq']
+            self.stats['events'] += 1
+            if command.get('reliable'):
+                self.acks.setdefault(addr, []).append(seq)
+                accepted.extend(self.deliver_reliable(state, command, now))
+                continue
+
+            # 传输延迟的波动：两端时钟不同，只比较相对于最小值的差（重传的可靠事件不参与）
+            offset = (now_ms - command['t']) & 0xFFFFFFFF
+            if state.min_offset is None or offset < state.min_offset:
+                state.min_offset = offset
+            self.stats['jitter_ms'] = offset - state.min_offset
+
+            if newer_seq(seq, state.last_seq):
+                if state.last_seq is not None:
+                    self.stats['lost'] += (seq - state.last_seq - 1) & 0xFFFFFFFF
+                state.last_seq = seq
+            else:
+                # 迟到的事件补上了之前算作丢失的序号
+                self.stats['reordered'] += 1
+                self.stats['lost'] = max(0, self.stats['lost'] - 1)
+
+            if command['type'] in POSITIONAL_EVENTS:
+                if not newer_seq(seq, state.last_position_seq):
+                    self.stats['stale_moves'] += 1
+                    continue
+                state.last_position_seq = seq
+            accepted.append(command)
+        return accepted
+
+    def deliver_reliable(self, state, command, now):
+        """按序号顺序交付可靠事件，返回现在可以执行的事件"""
+        seq = command['seq']
+        ahead = (seq - state.next_reliable) & 0xFFFFFFFF
+        if ahead >= 0x80000000 or seq in state.held:
+            if state.skipped.pop(seq, None) is not None and command['type'] in PERSISTENT_EVENTS:
+                # 跳过空缺之后才到达的松开：顺序已经无法保证，但不执行会让按键一直按住
+                self.stats['reliable'] += 1
+                self.stats['late'] += 1
+                return [command]
+            # 已经执行过的重传
+            self.stats['duplicates'] += 1
+            return []
+        self.stats['reliable'] += 1
+        if ahead > 0:
+            state.held[seq] = (command, now)
+            self.stats['held'] += 1
+            return []
+        state.next_reliable = (seq + 1) & 0xFFFFFFFF
+        return [command] + self.release_held(state)
+
+    def release_held(self, state):
+        """交付暂存中已经连续的可靠事件"""
+        released = []
+        while state.next_reliable in state.held:
+            released.append(state.held.pop(state.next_reliable)[0])
+            state.next_reliable = (state.next_reliable + 1) & 0xFFFFFFFF
+        return released
+
+    def release_expired(self, state, now):
+        """暂存超时的可靠事件：跳过前面的空缺，返回可以执行的事件"""
+        released = []
+        while state.held:
+            first = min(state.held, key=lambda seq: (seq - state.next_reliable) & 0xFFFFFFFF)
+            if now - state.held[first][1] < self.hold_timeout:
+                break
+            gap = (first - state.next_reliable) & 0xFFFFFFFF
+            self.stats['skipped'] += gap
+            for offset in range(min(gap, MAX_SKIPPED), 0, -1):
+                state.skipped[(first - offset) & 0xFFFFFFFF] = True
+            while len(state.skipped) > MAX_SKIPPED:
+                state.skipped.pop(next(iter(state.skipped)))
+            state.next_reliable = first
+            released.extend(self.release_held(state))
+        return released
+
+    def expire(self, now=None):
+        """没有新数据报时定期调用，返回各客户端暂存超时后可以执行的事件"""
+        now = time.monotonic() if now is None else now
+        released = []
+        for state in list(self.clients.values()):
+            if state.held:
+                released.extend(self.release_expired(state, now))
+        return released
+
+    def take_acks(self):
+        """取出待发送的确认，返回 (数据报, 客户端地址) 列表"""
+        acks, self.acks = self.acks, {}
+        return [(pack_ack(seqs[i:i + MAX_ACKS]), addr)
+                for addr, seqs in acks.items() for i in range(0, len(seqs), MAX_ACKS)]
+
+
+class InputSampler:
+    """
+    客户端的鼠标采样：界面事件只记录最新的指针状态，由tick()按固定频率把位置变化作为一批命令取出
+    服务端支持buttons时（transitions为True），按下和松开作为单独的事件立即发出，按住期间的位置变化以移动发出，
+    由服务端保持按键按下；旧服务端仍按点击加拖拽段发送：按住左键时的位置变化以从上次发送的位置到当前位置的拖拽发出
+    按键事件立即与尚未发出的位置一起取出
+    """
+    def __init__(self, rate=120, transitions=False):
+        self.rate = rate
+        self.interval = 1.0 / rate  # 采样周期（秒）
+        self.transitions = transitions  # 是否发送单独的按下和松开事件
+        self.position = None  # 最新的指针位置
+        self.sent_position = None  # 最近一次发出的位置
+        self.dragging = False
+        self.pressed = None  # 已发出按下、尚未发出松开的按键
+        self.stats = {'samples': 0, 'ticks': 0, 'batches': 0, 'moves': 0, 'drags': 0, 'buttons': 0}
+
+    def motion(self, x, y, dragging=False):
+        """记录一次指针移动，dragging表示左键按住"""
+        self.position = (x, y)
+        self.dragging = dragging
+        self.stats['samples'] += 1
+
+    def pending(self):
+        """取出尚未发出的位置变化（0或1条命令）"""
+        if self.position is None or self.position == self.sent_position:
+            return []
+        x, y = self.position
+        if self.dragging and not self.transitions and self.sent_position is not None:
+            start_x, start_y = self.sent_position
+            command = {'type': 'drag', 'x': start_x, 'y': start_y, 'end_x': x, 'end_y': y}
+            self.stats['drags'] += 1
+        else:
+            command = {'type': 'move', 'x': x, 'y': y}
+            self.stats['moves'] += 1
+        self.sent_position = self.position
+        return [command]
+
+    def tick(self):
+        """每个采样周期调用一次，返回本周期要发送的命令"""
+        self.stats['ticks'] += 1
+        commands = self.pending()
+        if commands:
+            self.stats['batches'] += 1
+        return commands
+
+    def button(self, command):
+        """点击或双击：返回尚未发出的位置和该命令，应立即发送"""
+        commands = self.pending() + [command]
+        self.position = self.sent_position = (command['x'], command['y'])
+        self.stats['buttons'] += 1
+        self.stats['batches'] += 1
+        return commands
+
+    def press(self, x, y, button='left', double=False):
+        """
+        按下按键：返回尚未发出的位置和按下事件，应立即发送
+        旧服务端不支持单独的按下时发送点击（double为True时发送双击）；
+        新服务端收到两次快速的按下和松开后由系统自己识别为双击
+        """
+        if self.transitions:
+            self.pressed = button
+            return self.button({'type': 'press', 'x': x, 'y': y, 'button': button})
+        if double:
+            return self.button({'type': 'double_click', 'x': x, 'y': y})
+        return self.button({'type': 'click', 'x': x, 'y': y, 'button': button})
+
+    def release(self, x, y):
+        """松开按键：返回按住期间最后的位置变化和已按下按键的松开事件（旧服务端为拖拽的最后一段），应立即发送"""
+        self.motion(x, y, self.dragging)
+        commands = self.pending()
+        self.dragging = False
+        if self.transitions and self.pressed is not None:
+            commands.append({'type': 'release', 'x': x, 'y': y, 'button': self.pressed})
+            self.pressed = None
+            self.stats['buttons'] += 1
+        if commands:
+            self.stats['batches'] += 1
+        return commands
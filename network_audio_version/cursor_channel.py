@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+光标通道
+服务端以较高频率通过UDP发送光标位置，光标形状位图按ID缓存，只在客户端第一次遇到时通过屏幕连接发送一次
+客户端在画面上自行绘制光标，视频帧率降低时指针仍然跟手
+"""
+
+import struct
+import cv2
+import numpy as np
+
+POSITION_MAGIC = b'CPOS'
+SHAPE_MAGIC = b'CURS'
+
+# 位置数据报: 魔数, 序号, x, y, 屏幕宽, 屏幕高, 形状ID
+POSITION = struct.Struct("!4sIHHHHI")
+# 形状消息头: 魔数, 形状ID, 宽, 高, 热点x, 热点y，后跟 宽*高*4 字节的BGRA像素
+SHAPE_HEADER = struct.Struct("!4sIHHHH")
+
+DEFAULT_SHAPE_ID = 0  # 客户端内置的箭头，没有形状信息时使用
+
+
+def is_cursor_shape(data):
+    """判断屏幕连接上收到的数据是否为光标形状消息"""
+    return data[:4] == SHAPE_MAGIC
+
+
+def pack_position(seq, x, y, screen_size, shape_id):
+    """打包光标位置数据报，坐标为屏幕像素"""
+    width, height = screen_size
+    x = max(0, min(int(x), width - 1))
+    y = max(0, min(int(y), height - 1))
+    return POSITION.pack(POSITION_MAGIC, seq & 0xFFFFFFFF, x, y, width, height, shape_id)
+
+
+def unpack_position(data):
+    """解析光标位置数据报，返回 (序号, x, y, 屏幕宽, 屏幕高, 形状ID)，不是位置数据报时返回None"""
+    if len(data) != POSITION.size or data[:4] != POSITION_MAGIC:
+        return None
+    return POSITION.unpack(data)[1:]
+
+
+def pack_shape(shape_id, image, hotspot):
+    """打包光标形状消息，image为BGRA图像"""
+    height, width = image.shape[:2]
+    header = SHAPE_HEADER.pack(SHAPE_MAGIC, shape_id, width, height, hotspot[0], hotspot[1])
+    return header + np.ascontiguousarray(image, dtype=np.uint8).tobytes()
+
+
+def unpack_shape(data):
+    """解析光标形状消息，返回 (形状ID, BGRA图像, 热点)"""
+    _, shape_id, width, height, hot_x, hot_y = SHAPE_HEADER.unpack_from(data, 0)
+    pixels = np.frombuffer(data, dtype=np.uint8, count=width * height * 4, offset=SHAPE_HEADER.size)
+    return shape_id, pixels.reshape(height, width, 4), (hot_x, hot_y)
+
+
+def default_cursor_image():
+    """生成内置的箭头光标，返回 (BGRA图像, 热点)"""
+    image = np.zeros((20, 13, 4), dtype=np.uint8)
+    arrow = np.array([[0, 0], [0, 16], [4, 12], [7, 19], [9, 18], [6, 11], [11, 11]], dtype=np.int32)
+    cv2.fillPoly(image, [arrow], (255, 255, 255, 255))
+    cv2.polylines(image, [arrow], True, (0, 0, 0, 255), 1)
+    return image, (0, 0)
+
+
+def newer_sequence(seq, last):
+    """判断序号seq是否比last新（考虑32位回绕），用于丢弃乱序到达的旧位置"""
+    return last is None or 0 < (seq - last) & 0xFFFFFFFF < 0x80000000
+
+
+class CursorState:
+    """服务端光标广播的发送状态"""
+    def __init__(self):
+        self.seq = 0
+        self.last = None  # 最近一次发送的 (x, y, 形状ID)
+        self.last_send = 0
+        self.retry_at = 0  # 读取光标出错后暂停到该时间
+
+
+class PyAutoGUICursorSource:
+    """通过pyautogui读取光标位置，不提供形状，客户端使用内置箭头"""
+    name = 'pyautogui'
+
+    def __init__(self):
+        import pyautogui
+        self.pyautogui = pyautogui
+
+    def poll(self):
+        """返回 (x, y, 形状ID)"""
+        x, y = self.pyautogui.position()
+        return x, y, DEFAULT_SHAPE_ID
+
+    def shape(self, shape_id):
+        """返回形状ID对应的 (BGRA图像, 热点)，没有时返回None"""
+        return None
+
+
+class XFixesCursorSource:
+    """通过X11的XFixes扩展读取光标位置和形状（需要python-xlib），形状以光标序列号作为ID"""
+    name = 'xfixes'
+
+    def __init__(self, max_shapes=32):
+        from Xlib import display
+        self.display = display.Display()
+        if not self.display.has_extension('XFIXES'):
+            raise RuntimeError("X服务器不支持XFIXES扩展")
+        self.display.xfixes_query_version()
+        self.root = self.display.screen().root
+        self.shapes = {}  # 形状ID -> (BGRA图像, 热点)
+        self.max_shapes = max_shapes
+
+    def poll(self):
+        """返回 (x, y, 形状ID)，遇到新形状时缓存其位图"""
+        cursor = self.display.xfixes_get_cursor_image(self.root)
+        shape_id = cursor.cursor_serial & 0xFFFFFFFF or DEFAULT_SHAPE_ID
+        if shape_id not in self.shapes:
+            # 像素为ARGB的32位整数，按小端字节序即为BGRA
+            argb = np.array(cursor.cursor_image, dtype='<u4').reshape(cursor.height, cursor.width)
+            image = argb.view(np.uint8).reshape(cursor.height, cursor.width, 4).copy()
+            if len(self.shapes) >= self.max_shapes:
+                self.shapes.pop(next(iter(self.shapes)))
+            self.shapes[shape_id] = (image, (cursor.xhot, cursor.yhot))
+        return cursor.x, cursor.y, shape_id
+
+    def shape(self, shape_id):
+        """返回形状ID对应的 (BGRA图像, 热点)，没有时返回None"""
+        return self.shapes.get(shape_id)
+
+
+def create_cursor_source():
+    """创建光标来源，优先使用XFixes（带形状），其次pyautogui（只有位置），都不可用时返回None"""
+    for source in (XFixesCursorSource, PyAutoGUICursorSource):
+        try:
+            return source()
+        except Exception as e:
+            print(f"光标来源 {source.name} 不可用: {e}")
+    return None
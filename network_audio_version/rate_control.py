@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+屏幕发送码率控制
+根据每帧发送耗时、内核发送缓冲区中尚未发出的积压(SIOCOUTQNSD)和客户端回报的接收进度估计端到端延迟，
+在配置范围内调整JPEG质量、缩放比例和目标帧率，使延迟保持在目标以下
+"""
+
+import collections
+import struct
+import sys
+import time
+
+# SIOCOUTQNSD只在Linux上可用，其他平台只使用发送耗时和客户端回报
+# SIOCOUTQ还包括已经发出、等待确认的字节，链路上的在途数据会被误判为积压，因此不使用
+try:
+    import fcntl
+    SIOCOUTQNSD = 0x894B if sys.platform.startswith('linux') else None
+except ImportError:
+    fcntl = None
+    SIOCOUTQNSD = None
+
+
+def socket_send_queue(sock):
+    """返回套接字内核发送缓冲区中尚未发出的字节数，不支持的平台返回None"""
+    if SIOCOUTQNSD is None:
+        return None
+    try:
+        data = fcntl.ioctl(sock.fileno(), SIOCOUTQNSD, b"\0\0\0\0")
+        return struct.unpack("i", data)[0]
+    except OSError:
+        return None
+
+
+def build_ladder(min_quality=20, max_quality=60, min_scale=0.5, max_scale=1.0, min_fps=5, max_fps=20, steps=5):
+    """
+    在配置范围内生成质量阶梯，第0级最好，最后一级最省带宽
+    每一级为 (JPEG质量, 缩放比例, 帧率)
+    """
+    ladder = []
+    for i in range(steps):
+        t = i / (steps - 1) if steps > 1 else 0.0
+        quality = int(round(max_quality + (min_quality - max_quality) * t))
+        scale = round(max_scale + (min_scale - max_scale) * t, 2)
+        fps = int(round(max_fps + (min_fps - max_fps) * t))
+        ladder.append((quality, scale, fps))
+    return ladder
+
+
+class RateController:
+    """单个客户端的码率控制器"""
+    def __init__(self, ladder, target_latency=0.3, cooldown=1.0, probe_interval=3.0):
+        self.ladder = ladder
+        self.level = 0
+        self.target_latency = target_latency  # 端到端延迟目标（秒）
+        self.cooldown = cooldown  # 两次降级之间的最短间隔（秒）
+        self.probe_interval = probe_interval  # 持续畅通多久后尝试升级（秒）
+
+        self.sent_frames = 0
+        self.send_times = collections.deque(maxlen=256)  # (帧计数, 发送开始时间)
+        self.last_send_duration = 0.0
+        self.last_frame_size = 0
+        self.frame_sizes = collections.deque(maxlen=8)  # 最近几帧的大小，瓦片增量帧可能远小于之前的整帧
+        self.send_queue = None
+        self.latency = 0.0
+        self.last_change = time.time()
+        self.last_congestion = 0.0
+        self.downgrades = 0
+        self.upgrades = 0
+
+    def params(self):
+        """当前级别的 (JPEG质量, 缩放比例, 帧率)"""
+        return self.ladder[self.level]
+
+    def on_frame_sent(self, size, start_time, duration, send_queue):
+        """记录一帧的发送情况"""
+        self.sent_frames += 1
+        self.send_times.append((self.sent_frames, start_time))
+        self.last_frame_size = size
+        self.frame_sizes.append(size)
+        self.last_send_duration = duration
+        self.send_queue = send_queue
+
+    def on_client_ack(self, frames, captured=None):
+        """
+        客户端回报已接收的帧数，用服务端发送时间估计端到端延迟
+        客户端同时回报帧头中的采集时间（服务端单调时钟）时，直接得到从采集到客户端收到的延迟
+        """
+        if captured:
+            self.latency = time.monotonic() - captured
+            return
+        for count, start_time in self.send_times:
+            if count == frames:
+                self.latency = time.time() - start_time
+                break
+
+    def congested(self):
+        """根据最新测量判断链路是否拥塞"""
+        frame_interval = 1.0 / self.params()[2]
+        if self.latency > self.target_latency:
+            return True
+        if self.last_send_duration > frame_interval * 0.8:
+            return True
+        # 尚未发出的积压超过最近最大帧的两倍，说明发送速度超过了链路能力
+        largest = max(self.frame_sizes, default=0)
+        if self.send_queue is not None and largest and self.send_queue > 2 * largest:
+            return True
+        return False
+
+    def update(self):
+        """根据测量调整级别，级别变化时返回True"""
+        now = time.time()
+        if self.congested():
+            self.last_congestion = now
+            if self.level < len(self.ladder) - 1 and now - self.last_change >= self.cooldown:
+                self.level += 1
+                self.downgrades += 1
+                self.last_change = now
+                return True
+        elif (self.level > 0 and
+              now - self.last_congestion >= self.probe_interval and
+              now - self.last_change >= self.probe_interval and
+              self.latency < self.target_latency / 2):
+            self.level -= 1
+            self.upgrades += 1
+            self.last_change = now
+            return True
+        return False
+
+    def stats(self):
+        """返回控制器状态和决策统计"""
+        quality, scale, fps = self.params()
+        return {
+            'level': self.level,
+            'quality': quality,
+            'scale': scale,
+            'fps': fps,
+            'latency': round(self.latency, 3),
+            'send_time': round(self.last_send_duration, 4),
+            'send_queue': self.send_queue,
+            'frames': self.sent_frames,
+            'downgrades': self.downgrades,
+            'upgrades': self.upgrades,
+        }
@@ -10,31 +10,121 @@ import socket
 import cv2
 import numpy as np
 import pyaudio
-import pyautogui
 import threading
-import struct
 import json
 import time
 import argparse
+import select
 import sys
+import random
+
+from capture_backends import create_capture_backend, FrameBufferPool
+from frame_hub import FrameHub, FrameProducer
+from async_server import AsyncServer
+from tile_codec import TileEncoder, TileCanvas, TileCacheMirror, is_tile_message, merge_tile_messages
+from stripe_codec import StripedJpegEncoder, StripeDecoder, is_stripe_message
+from video_codec import VideoEncoder, VideoDecoder, VIDEO_CODECS, available_video_codecs, is_video_message
+from stream_protocol import (client_hello, server_accept_hello, send_message, recv_message, accepts_message,
+                             apply_socket_profile, message_header, HELLO_TIMEOUT,
+                             FrameWriter, FrameReader, MSG_FRAME, MSG_CURSOR_SHAPE, FLAG_KEYFRAME, LEGACY_PROTOCOL)
+from control_protocol import ControlSender, ControlReceiver, InputSampler, is_ack, CONTROL_FORMATS
+from input_backends import create_input_backend, InputQueue, INPUT_BACKENDS
+from audio_codec import (OpusEncoder, OpusDecoder, available_audio_codecs, audio_hello, parse_audio_message,
+                         negotiate_audio)
+from udp_transport import (UdpVideoServer, UdpVideoReceiver, LossySocket, pack_register, unpack_message,
+                           open_client_socket)
+from rate_control import RateController, build_ladder, socket_send_queue
+from resolution_tiers import TIERS, DEFAULT_TIER, tier_sizes, client_to_screen
+from cursor_channel import (create_cursor_source, pack_position, unpack_position, pack_shape, unpack_shape,
+                            is_cursor_shape, default_cursor_image, newer_sequence, CursorState, DEFAULT_SHAPE_ID)
+
+class ScreenSession:
+    """服务端为单个屏幕客户端保存的状态：协商结果、订阅、瓦片缓存镜像、码率控制和回报统计"""
+    def __init__(self, peer, codec, tier, hello):
+        self.peer = peer
+        self.codec = codec
+        self.tier = tier
+        self.hello = hello  # 客户端的握手消息，protocol为协商的协议版本
+        self.subscriber = None
+        self.cache_mirror = None
+        self.controller = None
+        self.report = {}  # 客户端回报的延迟和跳过的帧数
+        self.sent_shapes = set()  # 已发送的光标形状
+        self.udp_video = None  # UDP屏幕传输的发送状态，客户端注册UDP地址之前画面仍走TCP
+
 
 class RemoteDesktop:
-    def __init__(self, mode='server', host='0.0.0.0', screen_port=8485, control_port=8486, audio_port=8487):
+    def __init__(self, mode='server', host='0.0.0.0', screen_port=8485, control_port=8486, audio_port=8487,
+                 screen_codec='jpeg', tile_size=64, keyframe_interval=200, capture='auto',
+                 encode_stripes=None, encode_processes=False, adaptive_rate=False, target_latency=0.3,
+                 rate_bounds=None, tier=DEFAULT_TIER, tile_content_aware=True, tile_cache_mb=64,
+                 tile_refine_after=0, tile_refine_quality=90, notsent_lowat=0, server_core='threads',
+                 udp_video=False, udp_video_port=8488, udp_loss=0.0, input_backend='auto', input_rate=120,
+                 audio_codec='opus', audio_bitrate=24000, audio_frame_ms=20):
         self.mode = mode  # 'server' 或 'client'
         self.host = host
         self.screen_port = screen_port
         self.control_port = control_port
         self.audio_port = audio_port
         
+        # UDP屏幕传输：服务端开启UDP端口，客户端在握手中请求；画面通过UDP分片发送，TCP屏幕连接作为回退
+        self.udp_video = udp_video
+        self.udp_video_port = udp_video_port
+        self.udp_loss = udp_loss  # 服务端UDP发送的模拟丢包率，用于测试丢包恢复
+        self.udp_video_socket = None
+        self.udp_video_server = None
+        self.udp_receiver = None  # 客户端的分片重组状态
+        
         self.running = False
         self.screen_socket = None
         self.control_socket = None
         self.audio_socket = None
         self.clients = []
+        self.frame_hub = None
+        self.frame_producer = None
+        # 服务端核心：'threads' 每个连接一个线程，'asyncio' 所有连接在同一个事件循环中处理
+        self.server_core = server_core
+        self.async_server = None
+        
+        # 屏幕编码相关
+        # 服务端首选编码：'jpeg' 整帧编码，'tile' 瓦片增量编码，'stripe' 条带并行编码，'h264'/'vp8' 帧间视频编码
+        # 实际编码在连接时与客户端协商，客户端不支持时回退到JPEG
+        self.screen_codec = screen_codec
+        self.available_codecs = available_video_codecs() + ['tile', 'stripe', 'jpeg']
+        self.tile_size = tile_size
+        self.tile_content_aware = tile_content_aware  # 瓦片模式下文字/界面瓦片无损编码，照片区域JPEG编码
+        # 瓦片渐进模式：变化区域先发送低质量草稿，静止tile_refine_after帧后补发高质量版本，0为关闭
+        self.tile_refine_after = tile_refine_after
+        self.tile_refine_quality = tile_refine_quality
+        self.keyframe_interval = keyframe_interval
+        self.encode_stripes = encode_stripes
+        self.encode_processes = encode_processes
+        self.encoders = {}  # 每路编码流一个编码器，由采集线程按需创建
+        self.notsent_lowat = notsent_lowat  # 屏幕连接内核中未发出字节数的上限，0为不限制
+        
+        # 分辨率档位：服务端从同一次采集中为每个档位缩放，客户端在握手时选择并可以随时切换
+        self.tier = tier  # 客户端请求的档位
+        self.tiers = {}  # 各档位的画面尺寸，服务端按屏幕尺寸计算，客户端从握手回复中获得
+        self.tier_frames = {}  # 本次采集已缩放好的各档位画面，同一档位的多路流共用
+        self.frame_buffers = FrameBufferPool()  # 缩放和颜色转换复用的缓冲区，只在采集线程中使用
+        self.last_raw_frame = None
+        
+        # 码率控制：编码流由 (档位, 编码, JPEG质量, 缩放比例, 帧率) 确定，相同参数的客户端共享同一路流
+        self.fixed_stream_params = (50, 1.0, 20)
+        self.adaptive_rate = adaptive_rate
+        self.target_latency = target_latency
+        self.rate_ladder = build_ladder(**(rate_bounds or {}))
+        self.screen_stats = {}  # 每个屏幕客户端的码率控制统计
+        # 客户端瓦片缓存：服务端镜像客户端的缓存，重复出现的瓦片只发送引用
+        self.tile_cache_bytes = int(tile_cache_mb * 1024 * 1024)
+        self.tile_canvas = TileCanvas(cache_bytes=self.tile_cache_bytes)
+        self.stripe_decoder = StripeDecoder() if mode == 'client' else None
+        self.video_decoder = VideoDecoder()
         
         # GUI相关（仅客户端模式）
         self.root = None
-        self.video_label = None
+        self.video_canvas = None
+        self.video_item = None
         self.status_label = None
         self.fps_label = None
         self.mute_button = None
@@ -43,15 +133,47 @@ class RemoteDesktop:
         self.fps = 0
         self.frame_count = 0
         self.last_time = time.time()
+        self.view_size = (1024, 576)  # 客户端显示尺寸（当前档位的画面尺寸），控制坐标以此为准
+        self.ack_interval = 0.2  # 向服务端回报接收进度的间隔（秒）
+        self.screen_protocol = LEGACY_PROTOCOL  # 屏幕连接协商的协议版本
+        self.screen_pending = b''  # 旧服务端在握手时已读出的第一帧
+        self.frames_skipped = 0  # 按帧序号统计的未收到的帧数（被服务端合并或丢弃）
+        self.last_keyframe_request = 0  # 最近一次请求关键帧的时间（单调时钟）
+        self.screen_send_lock = threading.Lock()  # 接收线程的回报和界面线程的档位切换共用屏幕连接
+        self.screen_decode_lock = threading.Lock()  # TCP和UDP接收线程共用解码状态
+        self.frames_received = 0
+        self.last_ack_time = 0
+        self.last_frame_id = None
+        
+        # 光标通道：服务端通过控制端口以较高频率发送光标位置，客户端在画面上自行绘制光标
+        self.cursor_source = None
+        self.cursor_shape_id = DEFAULT_SHAPE_ID
+        self.cursor_clients = {}  # 订阅光标位置的客户端UDP地址 -> 最近一次订阅时间
+        self.cursor_interval = 1 / 60  # 光标位置轮询间隔（秒）
+        self.cursor_resend = 0.5  # 光标不动时重发位置的间隔，弥补UDP丢包（秒）
+        self.cursor_resubscribe = 2.0  # 客户端重新订阅的间隔（秒）
+        self.cursor_timeout = 10.0  # 超过该时间未重新订阅的客户端不再发送（秒）
+        self.cursor_shapes = {}  # 客户端缓存的光标形状 ID -> (PhotoImage, 热点)
+        self.cursor_item = None
+        # 接收线程只记录最新的光标位置和新收到的形状，由Tk线程绘制；Tkinter不是线程安全的
+        self.cursor_lock = threading.Lock()
+        self.cursor_position = None  # 待绘制的 (x, y, 形状ID)
+        self.cursor_new_shapes = []  # 待创建PhotoImage的 (形状ID, BGRA图像, 热点)
+        self.cursor_draw_scheduled = False
         
         # 控制相关
         self.control_enabled = True
-        self.mouse_pos = (0, 0)
-        self.last_mouse_pos = (0, 0)  # 上次鼠标位置
-        self.last_move_time = 0  # 上次移动命令发送时间
-        self.move_threshold = 3  # 鼠标移动阈值（像素）
-        self.move_interval = 0.05  # 移动命令发送间隔（秒）
-        self.is_dragging = False  # 是否正在拖拽
+        # 客户端按固定频率（input_rate，Hz）发送最新的指针位置，点击和松开按键时立即发送
+        self.input_sampler = InputSampler(input_rate)
+        # 控制命令格式：客户端在屏幕握手回复列出binary时使用带序号的二进制批量格式，否则每条命令一个JSON数据报
+        self.control_sender = ControlSender(binary=False)
+        self.control_receiver = ControlReceiver()  # 服务端解析两种格式，丢弃乱序的移动
+        # 服务端的鼠标注入在专用线程中按到达顺序进行，接收控制数据报的线程不等待注入完成
+        # 注入跟不上时积压的连续移动只执行最新的一个
+        self.input = None
+        self.input_queue = None
+        self.control_drain_limit = 256  # 每次从控制端口一起取出的数据报上限
+        self.input_stats = {'injected': 0, 'queue_ms': 0.0, 'inject_ms': 0.0, 'max_queue_ms': 0.0}
         
         # 音频相关
         self.chunk_size = 1024
@@ -62,12 +184,35 @@ class RemoteDesktop:
         self.input_stream = None
         self.output_stream = None
         self.muted = False
+        # 音频编码：服务端首选的编码和Opus参数，连接时与客户端协商，任一方不支持Opus时使用原始PCM
+        self.audio_codec = audio_codec
+        self.audio_bitrate = audio_bitrate
+        self.audio_frame_ms = audio_frame_ms
+        self.audio_params = {'codec': 'pcm'}  # 客户端协商得到的编码参数
+        self.audio_reader = None  # 客户端音频连接的读取器，握手时已开始使用，可能缓存了之后的数据
         
         # 服务端特有
         if self.mode == 'server':
-            self.screen_size = pyautogui.size()
+            self.capture = create_capture_backend(capture)
+            print(f"屏幕采集后端: {self.capture.name}")
+            # 控制坐标以注入后端的逻辑尺寸为准，高DPI屏幕上可能与采集尺寸不同
+            self.input = create_input_backend(input_backend, self.capture.size())
+            if self.input:
+                print(f"鼠标注入后端: {self.input.name}")
+                self.screen_size = self.input.size()
+                self.input_queue = InputQueue(self.execute_control_command)
+            else:
+                print("没有可用的鼠标注入后端，鼠标控制已禁用")
+                self.screen_size = self.capture.size()
             print(f"屏幕尺寸: {self.screen_size[0]}x{self.screen_size[1]}")
-            pyautogui.FAILSAFE = False
+            self.cursor_source = create_cursor_source()
+            if self.cursor_source:
+                print(f"光标来源: {self.cursor_source.name}")
+            self.tiers = tier_sizes(self.capture.size())
+            print("分辨率档位: " + ", ".join(f"{name} {w}x{h}" for name, (w, h) in self.tiers.items()))
+            if self.screen_codec not in self.available_codecs:
+                print(f"编码 {self.screen_codec} 不可用（需要安装PyAV），回退到JPEG")
+                self.screen_codec = 'jpeg'
             
     def start(self):
         """启动程序"""
@@ -95,27 +240,41 @@ class RemoteDesktop:
             self.audio_socket.bind((self.host, self.audio_port))
             self.audio_socket.listen(5)
             
+            # 初始化UDP屏幕传输 (UDP)
+            if self.udp_video:
+                self.udp_video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.udp_video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+                self.udp_video_socket.bind((self.host, self.udp_video_port))
+                self.udp_video_server = UdpVideoServer(self.udp_video_port)
+            
             self.running = True
             
             print(f"屏幕传输服务启动，监听 {self.host}:{self.screen_port}")
             print(f"控制命令服务启动，监听 {self.host}:{self.control_port}")
             print(f"音频传输服务启动，监听 {self.host}:{self.audio_port}")
+            if self.udp_video_server:
+                print(f"UDP屏幕传输启动，监听 {self.host}:{self.udp_video_port}")
             
             # 初始化音频流
             self.setup_audio_streams()
             
-            # 启动各个线程
-            screen_thread = threading.Thread(target=self.accept_screen_clients)
-            control_thread = threading.Thread(target=self.handle_control_commands)
-            audio_thread = threading.Thread(target=self.accept_audio_clients)
-            
-            screen_thread.daemon = True
-            control_thread.daemon = True
-            audio_thread.daemon = True
+            # 启动屏幕采集编码线程，所有客户端共享同一份编码帧
+            if self.server_core == 'asyncio':
+                self.async_server = AsyncServer(self)
+                self.frame_hub = self.async_server.create_hub(self.merge_frames)
+            else:
+                self.frame_hub = FrameHub(merge=self.merge_frames)
+            max_fps = max(fps for _, _, fps in self.rate_ladder) if self.adaptive_rate else self.fixed_stream_params[2]
+            self.frame_producer = FrameProducer(self.frame_hub, self.capture_screen, self.encode_frame,
+                                                fps=max_fps, stream_fps=lambda stream: stream[4],
+                                                release=self.release_encoder)
+            self.frame_producer.start()
             
-            screen_thread.start()
-            control_thread.start()
-            audio_thread.start()
+            if self.async_server:
+                # 连接的收发、控制命令和光标广播都由事件循环处理，线程数与客户端数量无关
+                self.async_server.start()
+            else:
+                self.start_server_threads()
             
             # 保持运行
             try:
@@ -128,6 +287,39 @@ class RemoteDesktop:
             print(f"启动服务器错误: {e}")
             self.stop()
             
+    def start_server_threads(self):
+        """启动线程模式的服务端：每个屏幕客户端一个线程，每个音频客户端两个线程"""
+        screen_thread = threading.Thread(target=self.accept_screen_clients)
+        control_thread = threading.Thread(target=self.handle_control_commands)
+        audio_thread = threading.Thread(target=self.accept_audio_clients)
+        
+        screen_thread.daemon = True
+        control_thread.daemon = True
+        audio_thread.daemon = True
+        
+        screen_thread.start()
+        control_thread.start()
+        audio_thread.start()
+        
+        # 光标位置独立于视频帧发送
+        if self.cursor_source:
+            cursor_thread = threading.Thread(target=self.broadcast_cursor)
+            cursor_thread.daemon = True
+            cursor_thread.start()
+            
+        if self.udp_video_server:
+            self.set_udp_video_transport(self.udp_video_socket)
+            udp_thread = threading.Thread(target=self.handle_udp_video_datagrams)
+            udp_thread.daemon = True
+            udp_thread.start()
+            
+    def set_udp_video_transport(self, transport):
+        """设置发送UDP画面分片的套接字或数据报传输，需要时套上模拟丢包（服务端模式）"""
+        if self.udp_loss > 0:
+            transport = LossySocket(transport, loss=self.udp_loss)
+            print(f"UDP屏幕传输模拟丢包率: {self.udp_loss}")
+        self.udp_video_server.sendto = transport.sendto
+        
     def start_client(self):
         """启动客户端"""
         # 设置GUI
@@ -137,33 +329,63 @@ class RemoteDesktop:
             # 连接屏幕传输服务器 (TCP)
             self.screen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.screen_socket.connect((self.host, self.screen_port))
+            # 客户端在屏幕连接上只发送小的回报消息，关闭Nagle算法避免被延迟
+            apply_socket_profile(self.screen_socket, 'control')
+            options = {'tile_cache': self.tile_cache_bytes}
+            if self.udp_video:
+                # 随机令牌用于在服务端把UDP地址和这条屏幕连接对应起来
+                options['udp_video'] = random.getrandbits(31) + 1
+            reply = client_hello(self.screen_socket, self.available_codecs, self.tier,
+                                 options, messages=('frame', 'cursor_shape'))
+            self.screen_protocol = reply['protocol']
+            self.screen_pending = reply.get('pending', b'')
+            self.control_sender = ControlSender(binary='binary' in reply.get('control', ()))
+            self.input_sampler.transitions = 'buttons' in reply.get('control', ())
+            print(f"屏幕编码: {reply['codec']} 协议版本: {self.screen_protocol} "
+                  f"控制格式: {'binary' if self.control_sender.binary else 'json'}")
+            self.tiers = reply.get('tiers', {})
+            self.apply_tier(reply.get('tier', DEFAULT_TIER))
             
-            # 初始化控制命令连接 (UDP)
+            # 初始化控制命令连接 (UDP)，同时用于接收光标位置
             self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             
             # 连接音频服务器 (TCP)
             self.audio_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.audio_socket.connect((self.host, self.audio_port))
+            apply_socket_profile(self.audio_socket, 'audio')
+            self.audio_params = self.audio_client_hello()
+            print(f"音频编码: {self.describe_audio(self.audio_params)}")
             
             self.running = True
             self.update_status(f"已连接到 {self.host}")
+            self.sample_input()
             
             # 初始化音频流
             self.setup_audio_streams()
             
             # 启动线程
             screen_thread = threading.Thread(target=self.receive_screen)
+            cursor_thread = threading.Thread(target=self.receive_cursor)
             audio_send_thread = threading.Thread(target=self.send_audio)
             audio_receive_thread = threading.Thread(target=self.receive_audio)
             
             screen_thread.daemon = True
+            cursor_thread.daemon = True
             audio_send_thread.daemon = True
             audio_receive_thread.daemon = True
             
             screen_thread.start()
+            cursor_thread.start()
             audio_send_thread.start()
             audio_receive_thread.start()
             
+            # 服务端支持UDP屏幕传输时改用UDP接收画面，UDP不通时画面继续走TCP
+            if self.udp_video and 'udp_video' in reply and self.screen_protocol != LEGACY_PROTOCOL:
+                udp_thread = threading.Thread(target=self.receive_screen_udp,
+                                              args=(reply['udp_video'], options['udp_video']))
+                udp_thread.daemon = True
+                udp_thread.start()
+            
         except Exception as e:
             self.update_status(f"连接失败: {e}")
             
@@ -193,20 +415,22 @@ class RemoteDesktop:
         main_frame = self.ttk.Frame(self.root)
         main_frame.pack(fill=self.tk.BOTH, expand=True, padx=10, pady=10)
         
-        # 视频显示区域
-        self.video_label = self.tk.Label(main_frame, bg="black")
-        self.video_label.pack(fill=self.tk.BOTH, expand=True)
+        # 视频显示区域，使用Canvas以便在画面上叠加本地绘制的远程光标
+        self.video_canvas = self.tk.Canvas(main_frame, bg="black", highlightthickness=0)
+        self.video_canvas.pack(fill=self.tk.BOTH, expand=True)
+        self.video_item = self.video_canvas.create_image(0, 0, anchor=self.tk.NW)
+        self.add_cursor_shape(DEFAULT_SHAPE_ID, *default_cursor_image())
         
         # 绑定鼠标事件
         # 只在按下鼠标时才跟踪移动，避免无意义的移动命令
-        self.video_label.bind('<Button-1>', self.on_mouse_press)
-        self.video_label.bind('<ButtonRelease-1>', self.on_mouse_release)
-        self.video_label.bind('<Double-Button-1>', self.on_mouse_double_click)
-        self.video_label.bind('<Button-3>', lambda e: self.on_mouse_click(e, 'right'))
-        self.video_label.bind('<B1-Motion>', self.on_mouse_drag)
+        self.video_canvas.bind('<Button-1>', self.on_mouse_press)
+        self.video_canvas.bind('<ButtonRelease-1>', self.on_mouse_release)
+        self.video_canvas.bind('<Double-Button-1>', self.on_mouse_double_click)
+        self.video_canvas.bind('<Button-3>', lambda e: self.on_mouse_click(e, 'right'))
+        self.video_canvas.bind('<B1-Motion>', self.on_mouse_drag)
         # 只在需要时处理移动事件
-        self.video_label.bind('<Enter>', self.on_mouse_enter)
-        self.video_label.bind('<Leave>', self.on_mouse_leave)
+        self.video_canvas.bind('<Enter>', self.on_mouse_enter)
+        self.video_canvas.bind('<Leave>', self.on_mouse_leave)
         
         # 控制面板
         control_frame = self.ttk.Frame(self.root)
@@ -232,6 +456,14 @@ class RemoteDesktop:
         )
         self.mute_button.pack(side=self.tk.LEFT, padx=5)
         
+        # 分辨率档位
+        self.ttk.Label(control_frame, text="分辨率:").pack(side=self.tk.LEFT, padx=(15, 2))
+        self.tier_var = self.tk.StringVar(value=self.tier)
+        tier_box = self.ttk.Combobox(control_frame, textvariable=self.tier_var, values=list(TIERS),
+                                     state='readonly', width=8)
+        tier_box.bind('<<ComboboxSelected>>', lambda e: self.request_tier(self.tier_var.get()))
+        tier_box.pack(side=self.tk.LEFT, padx=5)
+        
         # 状态栏
         status_frame = self.ttk.Frame(self.root)
         status_frame.pack(fill=self.tk.X, padx=10, pady=5)
@@ -272,6 +504,20 @@ class RemoteDesktop:
         """停止程序"""
         self.running = False
         
+        if self.async_server:
+            self.async_server.stop()
+            
+        if self.frame_producer:
+            self.frame_producer.stop()
+            self.capture.close()
+            
+        if self.input_queue:
+            self.input_queue.shutdown(finish=self.input.close if self.input else None)
+            
+        for encoder in list(self.encoders.values()):
+            if hasattr(encoder, 'close'):
+                encoder.close()
+        
         # 关闭网络连接
         if self.screen_socket:
             self.screen_socket.close()
@@ -282,6 +528,9 @@ class RemoteDesktop:
         if self.audio_socket:
             self.audio_socket.close()
             
+        if self.udp_video_socket:
+            self.udp_video_socket.close()
+            
         for client in self.clients:
             try:
                 client.close()
@@ -308,6 +557,7 @@ class RemoteDesktop:
             try:
                 client_socket, addr = self.screen_socket.accept()
                 print(f"新的屏幕传输客户端连接: {addr}")
+                print(f"屏幕连接套接字设置: {apply_socket_profile(client_socket, 'video', self.notsent_lowat)}")
                 
                 client_thread = threading.Thread(
                     target=self.handle_screen_client,
@@ -329,21 +579,14 @@ class RemoteDesktop:
             try:
                 client_socket, addr = self.audio_socket.accept()
                 print(f"新的音频客户端连接: {addr}")
+                apply_socket_profile(client_socket, 'audio')
                 
-                # 为每个客户端创建两个线程
-                send_thread = threading.Thread(
-                    target=self.send_audio_to_client,
-                    args=(client_socket,)
-                )
+                # 接收线程完成编码协商后再启动发送线程
                 receive_thread = threading.Thread(
                     target=self.receive_audio_from_client,
                     args=(client_socket,)
                 )
-                
-                send_thread.daemon = True
                 receive_thread.daemon = True
-                
-                send_thread.start()
                 receive_thread.start()
                 
                 self.clients.append(client_socket)
@@ -353,45 +596,237 @@ class RemoteDesktop:
                 if not self.running:
                     break
                     
+    def capture_screen(self):
+        """捕获一帧原始屏幕图像（服务端模式，由采集线程调用），各档位的缩放在编码时按需进行"""
+        self.tier_frames = {}
+        self.last_raw_frame = self.capture.grab()
+        return self.last_raw_frame
+        
+    def tier_frame(self, tier, raw):
+        """把本次采集的原始图像缩放到档位尺寸并转换为BGR，每次采集每个档位只缩放一次"""
+        frame = self.tier_frames.get(tier)
+        if frame is None:
+            frame = self.capture.to_bgr(raw, self.tiers[tier], self.frame_buffers, tier)
+            self.tier_frames[tier] = frame
+        return frame
+        
+    def create_encoder(self, codec, quality, fps):
+        """创建指定编码方式的编码器（服务端模式）"""
+        if codec == 'tile':
+            return TileEncoder(tile_size=self.tile_size, quality=quality, keyframe_interval=self.keyframe_interval,
+                               content_aware=self.tile_content_aware, refine_after=self.tile_refine_after,
+                               refine_quality=self.tile_refine_quality)
+        if codec == 'stripe':
+            return StripedJpegEncoder(stripes=self.encode_stripes, quality=quality, use_processes=self.encode_processes)
+        if codec in VIDEO_CODECS:
+            # 按JPEG质量等比例换算视频码率，质量50对应1Mbit/s
+            return VideoEncoder(codec, fps=fps, bitrate=20000 * quality, keyframe_interval=self.keyframe_interval)
+        return None
+        
+    def encode_frame(self, stream, raw, keyframe):
+        """编码一路流的一帧（服务端模式，由采集线程调用），返回 (编码数据, 是否关键帧)"""
+        tier, codec, quality, scale, fps = stream
+        if stream not in self.encoders:
+            self.encoders[stream] = self.create_encoder(codec, quality, fps)
+        encoder = self.encoders[stream]
+        frame = self.tier_frame(tier, raw)
+        
+        # 按码率控制的缩放比例缩小画面
+        if scale != 1.0:
+            height, width = frame.shape[:2]
+            size = (int(width * scale) // 2 * 2, int(height * scale) // 2 * 2)
+            dst = self.frame_buffers.get((tier, scale), (size[1], size[0], 3))
+            frame = cv2.resize(frame, size, dst=dst, interpolation=cv2.INTER_AREA)
+        
+        # 瓦片增量模式只发送变化的区域
+        if codec == 'tile':
+            if keyframe:
+                encoder.request_keyframe()
+            return encoder.encode(frame)
+        
+        # 条带模式在多个CPU核心上并行编码
+        if codec == 'stripe':
+            return encoder.encode(frame), True
+        
+        # 帧间视频编码，新客户端加入或丢帧时强制输出关键帧
+        if codec in VIDEO_CODECS:
+            return encoder.encode(frame, keyframe)
+        
+        # 压缩质量，编码结果直接作为发送缓冲区，不再复制为bytes
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer, True
+        
+    def release_encoder(self, stream):
+        """释放已没有订阅者的编码流的编码器，如码率调整或切换档位之后的旧流（服务端模式，由采集线程调用）"""
+        encoder = self.encoders.pop(stream, None)
+        if hasattr(encoder, 'close'):
+            encoder.close()
+        
+    def merge_frames(self, stream, older, newer):
+        """合并客户端邮箱中两条未发送的增量帧，只有瓦片增量帧可以合并（服务端模式）"""
+        if stream[1] == 'tile':
+            return merge_tile_messages(older, newer)
+        return None
+        
+    def open_screen_session(self, codec, tier, hello, peer):
+        """根据握手结果创建一个屏幕客户端的发送状态并订阅对应的编码流（服务端模式）"""
+        session = ScreenSession(peer, codec, tier, hello)
+        
+        # 客户端有瓦片缓存时，按其容量维护镜像
+        if codec == 'tile' and hello.get('tile_cache', 0) > 0:
+            session.cache_mirror = TileCacheMirror(hello['tile_cache'])
+        
+        # 每个客户端独立的码率控制器，根据链路状况选择编码参数
+        params = self.fixed_stream_params
+        if self.adaptive_rate:
+            session.controller = RateController(self.rate_ladder, target_latency=self.target_latency)
+            params = session.controller.params()
+        session.subscriber = self.frame_hub.subscribe((tier, codec) + params)
+        
+        # 请求UDP传输的客户端以握手中的令牌登记，注册UDP地址后画面改走UDP
+        if self.udp_video_server and hello.get('udp_video') and hello['protocol'] != LEGACY_PROTOCOL:
+            session.udp_video = self.udp_video_server.open(int(hello['udp_video']))
+        return session
+        
+    def screen_reply_options(self):
+        """握手回复中附加的服务端参数：支持的控制命令格式和UDP屏幕传输参数（服务端模式）"""
+        options = {'control': CONTROL_FORMATS}
+        if self.udp_video_server:
+            options['udp_video'] = self.udp_video_server.offer()
+        return options
+        
+    def apply_screen_feedback(self, session, message):
+        """
+        处理客户端通过屏幕连接回报的一条消息（服务端模式）
+        回报的采集时间戳换算为端到端延迟，与跳过的帧数一起记入统计；请求切换档位时从新档位的关键帧开始接收
+        """
+        if message.get('type') == 'ack':
+            captured = message.get('captured')
+            if captured:
+                session.report['frame_latency'] = round(time.monotonic() - captured, 3)
+            if 'skipped' in message:
+                session.report['client_skipped'] = message['skipped']
+            if 'udp' in message:
+                session.report['udp_received'] = message['udp']
+            if session.controller:
+                session.controller.on_client_ack(message.get('frames', 0), captured)
+        elif message.get('type') == 'tier' and message.get('tier') in self.tiers and message['tier'] != session.tier:
+            session.tier = message['tier']
+            print(f"{session.peer} 切换分辨率档位: {session.tier}")
+            session.subscriber.switch((session.tier, session.codec) + session.subscriber.stream[2:])
+        elif message.get('type') == 'keyframe':
+            # UDP传输中放弃了无法恢复的帧，客户端需要关键帧才能继续显示增量编码的画面
+            # 没有送达的帧中可能有新缓存的瓦片，瓦片缓存随这个关键帧一起重新同步
+            if session.cache_mirror:
+                session.cache_mirror.reset()
+            self.frame_hub.request_keyframe(session.subscriber.stream)
+            
+    def poll_screen_feedback(self, client_socket, session):
+        """不阻塞地读取并处理客户端通过屏幕连接回报的消息（服务端模式）"""
+        while select.select([client_socket], [], [], 0)[0]:
+            message = recv_message(client_socket)
+            if message is None:
+                raise ConnectionError("客户端已断开")
+            self.apply_screen_feedback(session, message)
+            
+    def screen_frame_sent(self, session, size, send_start, duration, send_queue):
+        """记录一帧的发送情况，更新统计并按码率控制的决定切换编码参数（服务端模式）"""
+        stats = session.subscriber.stats()
+        stats.update(session.report)
+        if session.cache_mirror:
+            stats.update(session.cache_mirror.stats())
+        if session.udp_video:
+            stats['udp_sent'] = dict(session.udp_video.stats)
+        controller = session.controller
+        if controller:
+            controller.on_frame_sent(size, send_start, duration, send_queue)
+            if controller.update():
+                quality, scale, fps = controller.params()
+                print(f"{session.peer} 码率调整: 质量 {quality} 缩放 {scale} 帧率 {fps}")
+                session.subscriber.switch((session.tier, session.codec, quality, scale, fps))
+            stats.update(controller.stats())
+        self.screen_stats[session.peer] = stats
+        
+    def send_frame_udp(self, session, data, frame_id, captured, keyframe):
+        """客户端已注册UDP地址时把一帧分片通过UDP发送并返回True，否则返回False由调用方通过TCP发送（服务端模式）"""
+        sender = session.udp_video
+        if sender is None or not sender.ready():
+            return False
+        flags = FLAG_KEYFRAME if keyframe else 0
+        header = message_header(session.hello['protocol'], memoryview(data).nbytes, MSG_FRAME, frame_id, captured, flags)
+        sender.send(b''.join((header, data)))
+        return True
+        
+    def handle_udp_video_datagrams(self):
+        """接收客户端的UDP注册和NACK（服务端线程模式）"""
+        self.udp_video_socket.settimeout(0.5)
+        while self.running:
+            try:
+                data, addr = self.udp_video_socket.recvfrom(2048)
+                self.udp_video_server.handle_datagram(data, addr)
+            except socket.timeout:
+                continue
+            except Exception as e:
+                print(f"处理UDP屏幕传输数据报错误: {e}")
+                if not self.running:
+                    break
+        
+    def close_screen_session(self, session):
+        """注销订阅并清除统计（服务端模式）"""
+        if session.udp_video:
+            self.udp_video_server.close(session.udp_video)
+        session.subscriber.close()
+        print(f"{session.peer} 发送统计: {session.subscriber.stats()}")
+        self.screen_stats.pop(session.peer, None)
+                
+    def get_screen_stats(self):
+        """返回每个屏幕客户端的发送、丢帧和码率控制统计（服务端模式）"""
+        return dict(self.screen_stats)
+        
     def handle_screen_client(self, client_socket):
-        """处理屏幕传输客户端（服务端模式）"""
+        """处理屏幕传输客户端（服务端模式），只负责发送共享的编码帧"""
+        session = None
+        peer = client_socket.getpeername()
         try:
-            frame_interval = 1.0 / 20  # 约20FPS
-            last_frame_time = 0
+            # 协商编码方式和分辨率档位，订阅对应的编码流
+            codec, tier, hello = server_accept_hello(client_socket, self.screen_codec, self.available_codecs,
+                                                     tiers=self.tiers, default_tier=DEFAULT_TIER,
+                                                     reply_options=self.screen_reply_options())
+            print(f"屏幕传输客户端使用编码: {codec} 档位: {tier}")
+            session = self.open_screen_session(codec, tier, hello, peer)
+            # 新客户端的消息带帧头（类型、帧序号、采集时间），旧客户端只有长度前缀
+            writer = FrameWriter(client_socket, hello['protocol'])
             
             while self.running:
-                current_time = time.time()
+                # 处理客户端的回报，其中可能包括切换分辨率档位
+                self.poll_screen_feedback(client_socket, session)
                 
-                # 控制帧率
-                if current_time - last_frame_time < frame_interval:
-                    time.sleep(0.001)
-                    continue
-                    
-                # 捕获屏幕
-                screen = pyautogui.screenshot()
-                frame = np.array(screen)
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                
-                # 缩放到较小尺寸
-                frame = cv2.resize(frame, (1024, 576))
+                # 光标形状变化时先发送形状，每种形状只发一次
+                self.send_cursor_shape(session, writer)
                 
-                # 压缩质量
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 50])
-                data = buffer.tobytes()
-                
-                # 发送大小
-                size = len(data)
-                size_data = struct.pack("!L", size)
-                client_socket.sendall(size_data)
+                # 等待采集线程发布新帧
+                frame = session.subscriber.next_message()
+                if frame is None:
+                    continue
+                data, keyframe, frame_id, captured = frame
                 
-                # 发送数据
-                client_socket.sendall(data)
+                # 客户端已缓存的瓦片改为发送引用
+                if session.cache_mirror:
+                    data = session.cache_mirror.rewrite(data)
                 
-                last_frame_time = current_time
+                # 客户端已注册UDP地址时画面走UDP，否则通过TCP连接发送
+                send_start = time.time()
+                send_queue = None
+                if not self.send_frame_udp(session, data, frame_id, captured, keyframe):
+                    writer.send(data, seq=frame_id, captured=captured, flags=FLAG_KEYFRAME if keyframe else 0)
+                    send_queue = socket_send_queue(client_socket)
+                self.screen_frame_sent(session, len(data), send_start, time.time() - send_start, send_queue)
                 
         except Exception as e:
             print(f"屏幕传输错误: {e}")
         finally:
+            if session:
+                self.close_screen_session(session)
             if client_socket in self.clients:
                 self.clients.remove(client_socket)
             try:
@@ -400,98 +835,245 @@ class RemoteDesktop:
                 pass
             print("屏幕传输客户端连接已关闭")
             
+    def broadcast_cursor(self):
+        """以较高频率向订阅的客户端发送光标位置（服务端模式）"""
+        state = CursorState()
+        while self.running:
+            time.sleep(self.cursor_interval)
+            data = self.poll_cursor(state)
+            if data is None:
+                continue
+            for addr in list(self.cursor_clients):
+                try:
+                    self.control_socket.sendto(data, addr)
+                except OSError:
+                    pass
+                    
+    def poll_cursor(self, state):
+        """读取光标状态，需要发送时返回位置数据报，否则返回None（服务端模式）"""
+        now = time.time()
+        
+        # 超时未重新订阅的客户端视为已断开
+        for addr, seen in list(self.cursor_clients.items()):
+            if now - seen > self.cursor_timeout:
+                self.cursor_clients.pop(addr, None)
+        if not self.cursor_clients or now < state.retry_at:
+            return None
+        
+        try:
+            cursor = self.cursor_source.poll()
+        except Exception as e:
+            print(f"读取光标错误: {e}")
+            state.retry_at = now + 1
+            return None
+        self.cursor_shape_id = cursor[2]
+        
+        # 光标不动时只定期重发
+        if cursor == state.last and now - state.last_send < self.cursor_resend:
+            return None
+        state.seq += 1
+        state.last = cursor
+        state.last_send = now
+        return pack_position(state.seq, cursor[0], cursor[1], self.screen_size, cursor[2])
+            
+    def send_cursor_shape(self, session, writer):
+        """当前光标形状尚未发给该客户端时，通过屏幕连接发送一次（服务端模式）"""
+        shape_id = self.cursor_shape_id
+        if self.cursor_source is None or shape_id in session.sent_shapes:
+            return
+        # 只发给能处理光标形状消息的客户端：新协议看握手中声明的消息类型，旧协议看是否订阅了光标位置
+        if writer.version == LEGACY_PROTOCOL:
+            if not any(addr[0] == session.peer[0] for addr in self.cursor_clients):
+                return
+        elif not accepts_message(session.hello, 'cursor_shape'):
+            return
+        session.sent_shapes.add(shape_id)
+        shape = self.cursor_source.shape(shape_id)
+        if shape is None:
+            return
+        writer.send(pack_shape(shape_id, *shape), MSG_CURSOR_SHAPE)
+        
     def handle_control_commands(self):
         """处理控制命令（服务端模式）"""
         self.control_socket.settimeout(0.1)  # 减少超时时间，提高响应性
-        buffer_size = 1024
-        last_move_time = 0
-        last_move_pos = (0, 0)
-        move_smoothing = 0.02  # 移动平滑间隔
+        buffer_size = 2048  # 二进制格式一个数据报最多约1KB
         
         print("开始监听鼠标控制命令...")
         
         while self.running:
             try:
-                data, addr = self.control_socket.recvfrom(buffer_size)
-                command = json.loads(data.decode('utf-8'))
-                
-                command_type = command.get('type')
-                x = command.get('x', 0)
-                y = command.get('y', 0)
-                
-                # 从客户端坐标转换到实际屏幕坐标
-                screen_x = int(x * self.screen_size[0] / 1024)
-                screen_y = int(y * self.screen_size[1] / 576)
-                
-                # 限制坐标范围
-                screen_x = max(0, min(screen_x, self.screen_size[0] - 1))
-                screen_y = max(0, min(screen_y, self.screen_size[1] - 1))
-                
-                current_time = time.time()
-                
-                # 执行鼠标操作
-                try:
-                    if command_type == 'move':
-                        # 对移动命令进行平滑处理，避免过于频繁的移动
-                        if (current_time - last_move_time >= move_smoothing or
-                            abs(screen_x - last_move_pos[0]) > 10 or
-                            abs(screen_y - last_move_pos[1]) > 10):
-                            
-                            pyautogui.moveTo(screen_x, screen_y, duration=0)
-                            last_move_time = current_time
-                            last_move_pos = (screen_x, screen_y)
-                            
-                    elif command_type == 'click':
-                        button = command.get('button', 'left')
-                        # 确保鼠标在正确位置后再点击
-                        pyautogui.moveTo(screen_x, screen_y, duration=0)
-                        time.sleep(0.01)  # 短暂延迟确保移动完成
-                        pyautogui.click(screen_x, screen_y, button=button)
-                        print(f"点击: ({screen_x}, {screen_y}) 按钮: {button}")
-                        
-                    elif command_type == 'double_click':
-                        pyautogui.moveTo(screen_x, screen_y, duration=0)
-                        time.sleep(0.01)
-                        pyautogui.doubleClick(screen_x, screen_y)
-                        print(f"双击: ({screen_x}, {screen_y})")
-                        
-                    elif command_type == 'drag':
-                        end_x = command.get('end_x', x)
-                        end_y = command.get('end_y', y)
-                        screen_end_x = int(end_x * self.screen_size[0] / 1024)
-                        screen_end_y = int(end_y * self.screen_size[1] / 576)
-                        
-                        # 限制坐标范围
-                        screen_end_x = max(0, min(screen_end_x, self.screen_size[0] - 1))
-                        screen_end_y = max(0, min(screen_end_y, self.screen_size[1] - 1))
-                        
-                        pyautogui.dragTo(screen_end_x, screen_end_y, duration=0.05)
-                        print(f"拖拽: ({screen_x}, {screen_y}) -> ({screen_end_x}, {screen_end_y})")
-                        
-                except Exception as e:
-                    print(f"执行控制命令错误: {e}")
-                
+                datagrams = [self.control_socket.recvfrom(buffer_size)]
+                # 不等待地取出已经到达的全部数据报，命令一起交给注入线程合并
+                while (len(datagrams) < self.control_drain_limit and
+                       select.select([self.control_socket], [], [], 0)[0]):
+                    datagrams.append(self.control_socket.recvfrom(buffer_size))
             except socket.timeout:
+                # 前面的可靠事件迟迟不到时，暂存超时的事件在这里放行
+                self.submit_control_commands(self.control_receiver.expire())
                 continue
             except Exception as e:
                 print(f"处理控制命令错误: {e}")
                 if not self.running:
                     break
+                continue
+                
+            commands = []
+            for data, addr in datagrams:
+                try:
+                    commands.extend(self.parse_control_datagram(data, addr))
+                except Exception as e:
+                    print(f"处理控制命令错误: {e}")
+            self.send_control_acks(self.control_socket.sendto)
+            self.submit_control_commands(commands)
                     
-    def send_audio_to_client(self, client_socket):
+    def parse_control_datagram(self, data, addr):
+        """
+        解析一个控制数据报（服务端模式），二进制格式的数据报可能携带多条命令
+        光标订阅在这里直接登记，返回需要按顺序执行的鼠标命令列表
+        """
+        commands = []
+        for command in self.control_receiver.receive(data, addr):
+            # 客户端订阅光标位置，定期重新订阅作为保活
+            if command.get('type') == 'cursor':
+                self.cursor_clients[addr] = time.time()
+            else:
+                commands.append(command)
+        return commands
+        
+    def send_control_acks(self, sendto):
+        """确认收到的点击和拖拽等可靠事件（服务端模式）"""
+        for data, addr in self.control_receiver.take_acks():
+            try:
+                sendto(data, addr)
+            except OSError as e:
+                print(f"发送控制确认错误: {e}")
+                
+    def get_control_stats(self):
+        """
+        返回控制命令的接收统计（数据报和事件数、批量、丢失、乱序和丢弃的旧移动）、
+        注入线程的合并统计（coalesced_moves/coalesced_drags）和注入延迟（服务端模式）
+        """
+        stats = dict(self.control_receiver.stats)
+        if self.input_queue:
+            stats.update(self.input_queue.stats)
+        stats.update(self.input_stats)
+        return stats
+        
+    def submit_control_commands(self, commands):
+        """把一批鼠标命令交给注入线程，按提交顺序执行（服务端模式）"""
+        if self.input_queue is not None:
+            self.input_queue.submit(commands)
+            
+    def execute_control_command(self, command, received=None):
+        """在注入线程中执行一条鼠标命令（服务端模式），received为收到命令的单调时钟时间"""
+        command_type = command.get('type')
+        x = command.get('x', 0)
+        y = command.get('y', 0)
+        
+        # 从客户端坐标转换到实际屏幕坐标，坐标以客户端当前档位的画面尺寸为准
+        # 旧客户端不携带画面尺寸，使用默认档位的1024x576
+        view_size = (command.get('w', 1024), command.get('h', 576))
+        screen_x, screen_y = client_to_screen(x, y, view_size, self.screen_size)
+        
+        if self.input is None:
+            return
+        
+        # 执行鼠标操作，后端不在调用中等待
+        start = time.monotonic()
+        try:
+            if command_type == 'move':
+                self.input.move_to(screen_x, screen_y)
+                
+            elif command_type == 'click':
+                button = command.get('button', 'left')
+                self.input.click(screen_x, screen_y, button)
+                print(f"点击: ({screen_x}, {screen_y}) 按钮: {button}")
+                
+            elif command_type == 'double_click':
+                self.input.double_click(screen_x, screen_y)
+                print(f"双击: ({screen_x}, {screen_y})")
+                
+            # 按下和松开之间的移动就是拖拽，按键状态由后端记录
+            elif command_type == 'press':
+                self.input.button_down(screen_x, screen_y, command.get('button', 'left'))
+                
+            elif command_type == 'release':
+                self.input.button_up(screen_x, screen_y, command.get('button', 'left'))
+                
+            elif command_type == 'drag':
+                end_x = command.get('end_x', x)
+                end_y = command.get('end_y', y)
+                screen_end_x, screen_end_y = client_to_screen(end_x, end_y, view_size, self.screen_size)
+                
+                self.input.drag(screen_x, screen_y, screen_end_x, screen_end_y)
+                print(f"拖拽: ({screen_x}, {screen_y}) -> ({screen_end_x}, {screen_end_y})")
+                
+        except Exception as e:
+            print(f"执行控制命令错误: {e}")
+            
+        done = time.monotonic()
+        stats = self.input_stats
+        stats['injected'] += 1
+        stats['inject_ms'] = (done - start) * 1000
+        if received is not None:
+            stats['queue_ms'] = (start - received) * 1000
+            stats['max_queue_ms'] = max(stats['max_queue_ms'], stats['queue_ms'])
+            
+    def describe_audio(self, params):
+        """音频编码参数的说明文字"""
+        if params['codec'] != 'opus':
+            return 'PCM'
+        return f"Opus {params['bitrate'] // 1000}kbit/s {params['frame_ms']}ms"
+        
+    def audio_server_hello(self, client_socket, reader):
+        """
+        音频连接的编码协商（服务端模式），返回 (编码参数, 旧客户端发来的第一块PCM或None)，连接关闭时编码参数为None
+        旧客户端不发送握手而直接发送PCM，第一条消息不是握手时按PCM处理
+        """
+        hello = first = None
+        readable, _, _ = select.select([client_socket], [], [], HELLO_TIMEOUT)
+        if readable:
+            message = reader.read()
+            if message is None:
+                return None, None
+            hello = parse_audio_message(message.payload)
+            if hello is None:
+                first = bytes(message.payload)
+        params, reply = negotiate_audio(hello, self.audio_codec, self.audio_bitrate, self.audio_frame_ms)
+        if reply:
+            send_message(client_socket, reply)
+        return params, first
+        
+    def audio_client_hello(self):
+        """音频连接的编码协商（客户端模式），返回编码参数；旧服务端不回复而直接发送PCM"""
+        self.audio_reader = FrameReader(self.audio_socket, LEGACY_PROTOCOL)
+        codecs = available_audio_codecs() if self.audio_codec == 'opus' else ['pcm']
+        send_message(self.audio_socket, audio_hello(codecs))
+        readable, _, _ = select.select([self.audio_socket], [], [], HELLO_TIMEOUT)
+        if not readable:
+            return {'codec': 'pcm'}
+        message = self.audio_reader.read()
+        reply = parse_audio_message(message.payload) if message is not None else None
+        # 旧服务端的第一块PCM在播放流就绪之前到达，直接丢弃
+        if reply is None or reply.get('codec') not in codecs:
+            return {'codec': 'pcm'}
+        return reply
+        
+    def send_audio_to_client(self, client_socket, params):
         """发送麦克风音频到客户端（服务端模式）"""
+        writer = FrameWriter(client_socket, LEGACY_PROTOCOL)
+        encoder = OpusEncoder(params['bitrate'], params['frame_ms']) if params['codec'] == 'opus' else None
         try:
             while self.running:
                 # 从麦克风读取数据
                 data = self.input_stream.read(self.chunk_size, exception_on_overflow=False)
                 
-                # 发送数据大小
-                size = len(data)
-                size_data = struct.pack("!L", size)
-                client_socket.sendall(size_data)
-                
-                # 发送音频数据
-                client_socket.sendall(data)
+                # 长度前缀和音频数据一次发出，Opus每个包一条消息
+                if encoder is None:
+                    writer.send(data)
+                else:
+                    for packet in encoder.encode(data):
+                        writer.send(packet)
                 
         except Exception as e:
             print(f"发送音频错误: {e}")
@@ -504,38 +1086,30 @@ class RemoteDesktop:
                 pass
             
     def receive_audio_from_client(self, client_socket):
-        """从客户端接收音频并播放（服务端模式）"""
-        data = b""
-        payload_size = struct.calcsize("!L")
+        """完成编码协商后从客户端接收音频并播放（服务端模式）"""
+        reader = FrameReader(client_socket, LEGACY_PROTOCOL)
         
         try:
+            params, first = self.audio_server_hello(client_socket, reader)
+            if params is None:
+                return
+            print(f"音频客户端编码: {self.describe_audio(params)}")
+            send_thread = threading.Thread(target=self.send_audio_to_client, args=(client_socket, params))
+            send_thread.daemon = True
+            send_thread.start()
+            
+            decoder = OpusDecoder() if params['codec'] == 'opus' else None
+            if first is not None:
+                self.output_stream.write(first)
             while self.running:
-                # 接收数据大小
-                while len(data) < payload_size:
-                    packet = client_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < payload_size:
+                # 接收一条带长度前缀的消息，负载指向复用的接收缓冲区
+                message = reader.read()
+                if message is None:
                     break
-                    
-                packed_msg_size = data[:payload_size]
-                data = data[payload_size:]
-                msg_size = struct.unpack("!L", packed_msg_size)[0]
-                
-                # 接收音频数据
-                while len(data) < msg_size:
-                    packet = client_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < msg_size:
-                    break
-                    
-                audio_data = data[:msg_size]
-                data = data[msg_size:]
+                if decoder is None:
+                    audio_data = bytes(message.payload)  # PyAudio的write不接受可写的缓冲区
+                else:
+                    audio_data = decoder.decode(message.payload)
                 
                 # 播放音频
                 self.output_stream.write(audio_data)
@@ -561,6 +1135,27 @@ class RemoteDesktop:
             if self.fps_label:
                 self.fps_label.config(text=f"FPS: {self.fps}")
                 
+    def apply_tier(self, tier):
+        """使用指定档位的画面尺寸作为显示尺寸（客户端模式）"""
+        self.tier = tier
+        if tier in self.tiers:
+            self.view_size = tuple(self.tiers[tier])
+            if self.root:
+                width, height = self.view_size
+                self.root.geometry(f"{width}x{height+100}")
+        print(f"分辨率档位: {tier} {self.view_size[0]}x{self.view_size[1]}")
+        
+    def request_tier(self, tier):
+        """请求服务端切换分辨率档位（客户端模式）"""
+        if tier == self.tier or tier not in self.tiers or not self.screen_socket:
+            return
+        try:
+            with self.screen_send_lock:
+                send_message(self.screen_socket, {'type': 'tier', 'tier': tier})
+            self.apply_tier(tier)
+        except Exception as e:
+            print(f"切换分辨率档位错误: {e}")
+            
     def toggle_control(self):
         """切换鼠标控制开关（客户端模式）"""
         self.control_enabled = self.control_var.get()
@@ -572,183 +1167,104 @@ class RemoteDesktop:
         print(f"麦克风: {status}")
         
     def send_command(self, command):
-        """发送控制命令（客户端模式）"""
+        """发送一条控制命令（客户端模式）"""
+        self.send_commands([command])
+        
+    def send_commands(self, commands):
+        """发送一批控制命令（客户端模式），二进制格式下同一批命令放在一个数据报中按顺序执行"""
         if not self.control_enabled or not self.control_socket:
             return
             
+        # 附带当前画面尺寸，服务端据此把坐标换算到屏幕
+        self.send_control_datagrams(self.control_sender.encode(commands, self.view_size))
+        
+    def send_control_datagrams(self, datagrams):
+        """发送已编码的控制数据报（客户端模式）"""
         try:
-            data = json.dumps(command).encode('utf-8')
-            # 使用非阻塞发送，避免网络延迟影响界面响应
-            self.control_socket.sendto(data, (self.host, self.control_port))
+            for data in datagrams:
+                # 使用非阻塞发送，避免网络延迟影响界面响应
+                self.control_socket.sendto(data, (self.host, self.control_port))
         except Exception as e:
             print(f"发送控制命令错误: {e}")
             # 如果发送失败，更新状态
             if hasattr(self, 'update_status'):
                 self.update_status(f"控制命令发送失败: {e}")
             
-    def on_mouse_move(self, event):
-        """处理鼠标移动事件（客户端模式）"""
-        current_time = time.time()
-        current_pos = (event.x, event.y)
-        
-        # 计算移动距离
-        dx = abs(current_pos[0] - self.last_mouse_pos[0])
-        dy = abs(current_pos[1] - self.last_mouse_pos[1])
-        distance = (dx * dx + dy * dy) ** 0.5
+    def sample_input(self):
+        """按采样频率发送指针位置的变化，并重传未确认的点击和拖拽（客户端模式，在界面线程中定时运行）"""
+        if not self.running:
+            return
+        commands = self.input_sampler.tick()
+        if commands:
+            self.send_commands(commands)
+        if self.control_enabled:
+            self.send_control_datagrams(self.control_sender.retransmit())
+        self.root.after(max(1, round(self.input_sampler.interval * 1000)), self.sample_input)
         
-        # 只有移动距离超过阈值且时间间隔足够时才发送命令
-        if (distance >= self.move_threshold and 
-            current_time - self.last_move_time >= self.move_interval):
-            
-            self.mouse_pos = current_pos
-            self.last_mouse_pos = current_pos
-            self.last_move_time = current_time
-            
-            command = {
-                'type': 'move',
-                'x': event.x,
-                'y': event.y
-            }
-            self.send_command(command)
+    def on_mouse_move(self, event):
+        """处理鼠标移动事件（客户端模式），只记录位置，由sample_input定时发送"""
+        self.input_sampler.motion(event.x, event.y)
         
     def on_mouse_press(self, event):
         """处理鼠标按下事件（客户端模式）"""
-        self.is_dragging = False
-        self.mouse_pos = (event.x, event.y)
-        self.last_mouse_pos = (event.x, event.y)
-        
-        # 先移动到点击位置，然后点击
-        move_command = {
-            'type': 'move',
-            'x': event.x,
-            'y': event.y
-        }
-        self.send_command(move_command)
-        
-        # 稍微延迟后发送点击命令
-        self.root.after(10, lambda: self.send_click_command(event.x, event.y))
+        # 尚未发送的移动和按下（旧服务端为点击）一起立即发送，服务端按顺序执行
+        self.send_commands(self.input_sampler.press(event.x, event.y))
         
     def on_mouse_release(self, event):
-        """处理鼠标释放事件（客户端模式）"""
-        if not self.is_dragging:
-            # 如果不是拖拽，这是一个普通点击的释放
-            pass
-        self.is_dragging = False
-        
-    def send_click_command(self, x, y):
-        """发送点击命令"""
-        command = {
+        """处理鼠标释放事件（客户端模式），立即发送最后的位置和松开（旧服务端为拖拽的最后一段）"""
+        self.send_commands(self.input_sampler.release(event.x, event.y))
+        
+    def click_command(self, x, y, button='left'):
+        """生成点击命令"""
+        return {
             'type': 'click',
             'x': x,
             'y': y,
-            'button': 'left'
+            'button': button
         }
-        self.send_command(command)
         
     def on_mouse_click(self, event, button='left'):
         """处理鼠标点击事件（客户端模式）"""
-        # 先移动到点击位置
-        move_command = {
-            'type': 'move',
-            'x': event.x,
-            'y': event.y
-        }
-        self.send_command(move_command)
-        
-        # 稍微延迟后发送点击命令
-        self.root.after(10, lambda: self.send_command({
-            'type': 'click',
-            'x': event.x,
-            'y': event.y,
-            'button': button
-        }))
+        self.send_commands(self.input_sampler.button(self.click_command(event.x, event.y, button)))
         
     def on_mouse_double_click(self, event):
-        """处理鼠标双击事件（客户端模式）"""
-        # 先移动到双击位置
-        move_command = {
-            'type': 'move',
-            'x': event.x,
-            'y': event.y
-        }
-        self.send_command(move_command)
-        
-        # 稍微延迟后发送双击命令
-        self.root.after(10, lambda: self.send_command({
-            'type': 'double_click',
-            'x': event.x,
-            'y': event.y
-        }))
+        """处理鼠标双击事件（客户端模式），第二次按下；旧服务端发送双击命令"""
+        self.send_commands(self.input_sampler.press(event.x, event.y, double=True))
         
     def on_mouse_drag(self, event):
-        """处理鼠标拖动事件（客户端模式）"""
-        self.is_dragging = True
-        current_time = time.time()
-        
-        # 限制拖拽命令的发送频率
-        if current_time - self.last_move_time >= self.move_interval:
-            command = {
-                'type': 'drag',
-                'x': self.mouse_pos[0],
-                'y': self.mouse_pos[1],
-                'end_x': event.x,
-                'end_y': event.y
-            }
-            self.send_command(command)
-            self.mouse_pos = (event.x, event.y)
-            self.last_move_time = current_time
+        """处理鼠标拖动事件（客户端模式），由sample_input定时发送（旧服务端为拖拽命令）"""
+        self.input_sampler.motion(event.x, event.y, dragging=True)
             
     def on_mouse_enter(self, event):
         """鼠标进入窗口事件"""
         # 绑定移动事件
-        self.video_label.bind('<Motion>', self.on_mouse_move)
+        self.video_canvas.bind('<Motion>', self.on_mouse_move)
         
     def on_mouse_leave(self, event):
         """鼠标离开窗口事件"""
         # 解绑移动事件，避免不必要的命令
-        self.video_label.unbind('<Motion>')
+        self.video_canvas.unbind('<Motion>')
         
     def receive_screen(self):
-        """接收屏幕图像（客户端模式）"""
-        data = b""
-        payload_size = struct.calcsize("!L")
+        """接收屏幕图像（客户端模式），使用UDP传输时这里只收到光标形状和注册UDP地址之前的画面"""
+        reader = FrameReader(self.screen_socket, self.screen_protocol, pending=self.screen_pending)
+        legacy = self.screen_protocol == LEGACY_PROTOCOL
         
         while self.running:
             try:
-                # 接收图像大小
-                while len(data) < payload_size:
-                    packet = self.screen_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < payload_size:
-                    break
-                    
-                packed_msg_size = data[:payload_size]
-                data = data[payload_size:]
-                msg_size = struct.unpack("!L", packed_msg_size)[0]
-                
-                # 接收图像数据
-                while len(data) < msg_size:
-                    packet = self.screen_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < msg_size:
+                message = reader.read()
+                if message is None:
                     break
-                    
-                frame_data = data[:msg_size]
-                data = data[msg_size:]
                 
-                # 解码图像
-                frame = cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                # 光标形状不是画面帧，缓存后继续；旧服务端的消息没有类型，按内容识别
+                if message.type == MSG_CURSOR_SHAPE or (legacy and is_cursor_shape(message.payload)):
+                    self.queue_cursor(shape=unpack_shape(message.payload))
+                    continue
+                if message.type != MSG_FRAME:
+                    continue
                 
-                # 更新显示
-                if frame is not None:
-                    self.update_display(frame)
-                    self.update_fps()
+                with self.screen_decode_lock:
+                    self.handle_screen_frame(message)
                     
             except Exception as e:
                 print(f"接收屏幕错误: {e}")
@@ -757,11 +1273,198 @@ class RemoteDesktop:
                 
         self.update_status("连接断开")
         
+    def receive_screen_udp(self, options, token):
+        """通过UDP接收画面分片，重组后按顺序显示，对丢失的分片发送NACK（客户端模式）"""
+        server = (self.host, options['port'])
+        sock = open_client_socket()
+        sock.settimeout(0.005)
+        receiver = UdpVideoReceiver(token, deadline=options.get('deadline', 0.25))
+        self.udp_receiver = receiver
+        register = pack_register(token)
+        last_register = 0
+        print(f"UDP屏幕传输: {server[0]}:{server[1]}")
+        
+        try:
+            while self.running:
+                # 定期注册，同时作为保活维持NAT映射
+                now = time.monotonic()
+                if now - last_register >= 1.0:
+                    sock.sendto(register, server)
+                    last_register = now
+                    
+                try:
+                    messages = receiver.feed(sock.recv(65536))
+                except socket.timeout:
+                    messages = []
+                ready, nacks = receiver.poll()
+                for nack in nacks:
+                    sock.sendto(nack, server)
+                    
+                # 放弃了无法恢复的帧时，通过TCP连接请求关键帧
+                if receiver.take_keyframe_request():
+                    self.request_keyframe()
+                        
+                for data in messages + ready:
+                    with self.screen_decode_lock:
+                        self.handle_screen_frame(unpack_message(data))
+                        
+        except Exception as e:
+            print(f"UDP接收屏幕错误: {e}")
+        finally:
+            sock.close()
+            
+    def request_keyframe(self):
+        """通过屏幕连接请求关键帧，同一请求至少间隔0.5秒（客户端模式）"""
+        now = time.monotonic()
+        if now - self.last_keyframe_request < 0.5:
+            return
+        self.last_keyframe_request = now
+        with self.screen_send_lock:
+            send_message(self.screen_socket, {'type': 'keyframe'})
+            
+    def handle_screen_frame(self, message):
+        """统计、回报并解码显示一条画面消息（客户端模式，调用时已持有解码锁）"""
+        frame_data = message.payload
+        legacy = self.screen_protocol == LEGACY_PROTOCOL
+        
+        # 增量帧的序号不连续说明中间的帧被服务端合并或丢弃，关键帧可能来自新的流，重新开始计数
+        if not legacy:
+            if self.last_frame_id is not None and not message.flags & FLAG_KEYFRAME:
+                gap = (message.seq - self.last_frame_id - 1) & 0xFFFFFFFF
+                if gap < 0x80000000:
+                    self.frames_skipped += gap
+            self.last_frame_id = message.seq
+        
+        # 定期回报已接收的帧数和最新帧的采集时间，服务端据此测量延迟并调整码率
+        self.frames_received += 1
+        current_time = time.time()
+        if current_time - self.last_ack_time >= self.ack_interval:
+            ack = {'type': 'ack', 'frames': self.frames_received, 'time': current_time}
+            if not legacy:
+                ack['captured'] = message.captured
+                ack['skipped'] = self.frames_skipped
+            if self.udp_receiver:
+                ack['udp'] = dict(self.udp_receiver.stats)
+            with self.screen_send_lock:
+                send_message(self.screen_socket, ack)
+            self.last_ack_time = current_time
+        
+        # 解码图像，瓦片增量消息合成到持久画布上
+        if is_tile_message(frame_data):
+            misses = self.tile_canvas.cache_misses
+            frame = self.tile_canvas.apply(frame_data)
+            # 引用了本地缓存中没有的瓦片，说明与服务端的镜像不一致，请求关键帧重新同步
+            if self.tile_canvas.cache_misses > misses and not legacy:
+                self.request_keyframe()
+        elif is_stripe_message(frame_data):
+            frame = self.stripe_decoder.decode(frame_data)
+        elif is_video_message(frame_data):
+            frame = self.video_decoder.decode(frame_data)
+        else:
+            frame = cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        
+        # 更新显示
+        if frame is not None:
+            self.update_display(frame)
+            self.update_fps()
+            
+    def receive_cursor(self):
+        """订阅并接收服务端的光标位置，在画面上绘制光标，同时处理控制命令的确认（客户端模式）"""
+        subscribe = json.dumps({'type': 'cursor'}).encode('utf-8')
+        last_subscribe = 0
+        last_seq = None
+        self.control_socket.settimeout(0.5)
+        
+        while self.running:
+            # 定期重新订阅，服务端据此得知客户端的UDP地址
+            current_time = time.time()
+            if current_time - last_subscribe >= self.cursor_resubscribe:
+                try:
+                    self.control_socket.sendto(subscribe, (self.host, self.control_port))
+                except OSError as e:
+                    print(f"订阅光标位置错误: {e}")
+                last_subscribe = current_time
+                
+            try:
+                data, _ = self.control_socket.recvfrom(2048)
+            except (socket.timeout, ConnectionResetError):
+                continue
+            except OSError:
+                break
+                
+            # 控制端口上也会收到服务端对点击和拖拽的确认
+            if is_ack(data):
+                self.control_sender.handle_ack(data)
+                continue
+                
+            position = unpack_position(data)
+            if position is None:
+                continue
+            seq, x, y, screen_width, screen_height, shape_id = position
+            # 丢弃乱序到达的旧位置
+            if not newer_sequence(seq, last_seq):
+                continue
+            last_seq = seq
+            
+            # 屏幕坐标换算到当前画面
+            self.queue_cursor(position=(x * self.view_size[0] / screen_width, y * self.view_size[1] / screen_height,
+                                        shape_id))
+            
+    def queue_cursor(self, position=None, shape=None):
+        """
+        记录接收线程收到的光标位置或形状，交给Tk线程绘制（客户端模式）
+        位置只保留最新的一个，Tk线程尚未处理时不重复调度
+        """
+        with self.cursor_lock:
+            if position is not None:
+                self.cursor_position = position
+            if shape is not None:
+                self.cursor_new_shapes.append(shape)
+            if self.cursor_draw_scheduled:
+                return
+            self.cursor_draw_scheduled = True
+        self.root.after(0, self.flush_cursor)
+        
+    def flush_cursor(self):
+        """在Tk线程中创建新收到的光标形状并绘制最新的位置（客户端模式）"""
+        with self.cursor_lock:
+            shapes, self.cursor_new_shapes = self.cursor_new_shapes, []
+            position = self.cursor_position
+            self.cursor_draw_scheduled = False
+        for shape in shapes:
+            self.add_cursor_shape(*shape)
+        if position is not None:
+            self.draw_cursor(*position)
+            
+    def add_cursor_shape(self, shape_id, image, hotspot):
+        """缓存一种光标形状，image为BGRA图像（客户端模式，在Tk线程中调用）"""
+        from PIL import Image
+        photo = self.ImageTk.PhotoImage(image=Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)))
+        self.cursor_shapes[shape_id] = (photo, hotspot)
+        
+    def draw_cursor(self, x, y, shape_id):
+        """在画面上绘制光标，形状尚未收到时使用内置箭头（客户端模式，在Tk线程中调用）"""
+        if not self.video_canvas:
+            return
+        photo, (hot_x, hot_y) = self.cursor_shapes.get(shape_id, self.cursor_shapes[DEFAULT_SHAPE_ID])
+        try:
+            if self.cursor_item is None:
+                self.cursor_item = self.video_canvas.create_image(0, 0, anchor=self.tk.NW, image=photo)
+            else:
+                self.video_canvas.itemconfig(self.cursor_item, image=photo)
+            self.video_canvas.coords(self.cursor_item, x - hot_x, y - hot_y)
+        except Exception as e:
+            print(f"绘制光标错误: {e}")
+            
     def update_display(self, frame):
         """更新显示的图像（客户端模式）"""
         try:
             from PIL import Image
             
+            # 码率控制降低了分辨率时放大到显示尺寸，保持控制坐标不变
+            if (frame.shape[1], frame.shape[0]) != self.view_size:
+                frame = cv2.resize(frame, self.view_size)
+            
             # 转换颜色空间
             frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             
@@ -769,16 +1472,19 @@ class RemoteDesktop:
             image = Image.fromarray(frame)
             photo = self.ImageTk.PhotoImage(image=image)
             
-            # 更新标签
-            if self.video_label:
-                self.video_label.config(image=photo)
-                self.video_label.image = photo  # 保持引用
+            # 更新画面，光标图层在画面之上
+            if self.video_canvas:
+                self.video_canvas.itemconfig(self.video_item, image=photo)
+                self.video_canvas.image = photo  # 保持引用
                 
         except Exception as e:
             print(f"显示错误: {e}")
             
     def send_audio(self):
         """发送麦克风音频到服务器（客户端模式）"""
+        writer = FrameWriter(self.audio_socket, LEGACY_PROTOCOL)
+        params = self.audio_params
+        encoder = OpusEncoder(params['bitrate'], params['frame_ms']) if params['codec'] == 'opus' else None
         try:
             while self.running:
                 # 从麦克风读取数据
@@ -788,50 +1494,31 @@ class RemoteDesktop:
                 if self.muted:
                     data = b'\x00' * len(data)
                 
-                # 发送数据大小
-                size = len(data)
-                size_data = struct.pack("!L", size)
-                self.audio_socket.sendall(size_data)
-                
-                # 发送音频数据
-                self.audio_socket.sendall(data)
+                # 长度前缀和音频数据一次发出，Opus每个包一条消息
+                if encoder is None:
+                    writer.send(data)
+                else:
+                    for packet in encoder.encode(data):
+                        writer.send(packet)
                 
         except Exception as e:
             print(f"发送音频错误: {e}")
             
     def receive_audio(self):
         """从服务器接收音频并播放（客户端模式）"""
-        data = b""
-        payload_size = struct.calcsize("!L")
+        reader = self.audio_reader or FrameReader(self.audio_socket, LEGACY_PROTOCOL)
+        decoder = OpusDecoder() if self.audio_params['codec'] == 'opus' else None
         
         try:
             while self.running:
-                # 接收数据大小
-                while len(data) < payload_size:
-                    packet = self.audio_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < payload_size:
-                    break
-                    
-                packed_msg_size = data[:payload_size]
-                data = data[payload_size:]
-                msg_size = struct.unpack("!L", packed_msg_size)[0]
-                
-                # 接收音频数据
-                while len(data) < msg_size:
-                    packet = self.audio_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < msg_size:
+                # 接收一条带长度前缀的消息，负载指向复用的接收缓冲区
+                message = reader.read()
+                if message is None:
                     break
-                    
-                audio_data = data[:msg_size]
-                data = data[msg_size:]
+                if decoder is None:
+                    audio_data = bytes(message.payload)  # PyAudio的write不接受可写的缓冲区
+                else:
+                    audio_data = decoder.decode(message.payload)
                 
                 # 播放音频
                 self.output_stream.write(audio_data)
@@ -853,6 +1540,50 @@ def parse_arguments():
     parser.add_argument('--screen-port', type=int, default=8485, help='屏幕传输端口')
     parser.add_argument('--control-port', type=int, default=8486, help='控制命令端口')
     parser.add_argument('--audio-port', type=int, default=8487, help='音频传输端口')
+    parser.add_argument('--capture', choices=['auto', 'mss', 'pyautogui', 'synthetic'], default='auto',
+                        help='屏幕采集后端（服务端模式），synthetic为无显示环境下的合成画面')
+    parser.add_argument('--input', choices=INPUT_BACKENDS, default='auto',
+                        help='鼠标注入后端（服务端模式）：auto依次尝试xtest和pyautogui，uinput需要evdev和/dev/uinput写权限，'
+                             'recording只记录不注入')
+    parser.add_argument('--input-rate', type=int, default=120,
+                        help='客户端发送鼠标位置的采样频率（Hz），点击和松开按键时立即发送')
+    parser.add_argument('--audio-codec', choices=['opus', 'pcm'], default='opus',
+                        help='音频编码：opus需要带libopus的PyAV，任一方不支持时回退到pcm（原始16位PCM），连接时协商')
+    parser.add_argument('--audio-bitrate', type=int, default=24, help='Opus码率（kbit/s，服务端模式）')
+    parser.add_argument('--audio-frame-ms', type=int, choices=[10, 20], default=20, help='Opus帧长（毫秒，服务端模式）')
+    parser.add_argument('--screen-codec', choices=['jpeg', 'tile', 'stripe', 'h264', 'vp8'], default='jpeg',
+                        help='服务端首选的屏幕编码：jpeg整帧编码，tile只发送变化的瓦片，stripe多核并行条带编码，'
+                             'h264/vp8帧间视频编码（需要PyAV），连接时与客户端协商，不支持时回退到jpeg')
+    parser.add_argument('--tile-size', type=int, default=64, help='瓦片边长（像素）')
+    parser.add_argument('--tile-cache-mb', type=float, default=64,
+                        help='客户端瓦片缓存的内存上限（MB），重复出现的瓦片（如切换窗口）只接收引用，0为禁用')
+    parser.add_argument('--tile-content', choices=['auto', 'jpeg'], default='auto',
+                        help='瓦片模式下的瓦片编码：auto按内容选择（文字/界面无损，照片JPEG），jpeg全部使用JPEG（编码更快）')
+    parser.add_argument('--refine-after', type=int, default=0,
+                        help='瓦片模式下变化区域先发送缩小的低质量草稿，静止该帧数后补发高质量版本，0为关闭')
+    parser.add_argument('--refine-quality', type=int, default=90, help='渐进模式下补发瓦片的JPEG质量')
+    parser.add_argument('--notsent-lowat', type=int, default=0,
+                        help='屏幕连接内核发送队列中未发出数据的上限（KB，Linux/macOS），让积压留在应用层被合并或丢弃，0为不限制')
+    parser.add_argument('--udp-video', action='store_true',
+                        help='屏幕画面通过UDP分片传输（带前向纠错和丢包重传），服务端开启UDP端口，客户端请求使用；UDP不通时仍走TCP')
+    parser.add_argument('--udp-video-port', type=int, default=8488, help='UDP屏幕传输端口')
+    parser.add_argument('--udp-loss', type=float, default=0.0, help='服务端UDP画面发送的模拟丢包率，用于测试丢包恢复')
+    parser.add_argument('--server-core', choices=['threads', 'asyncio'], default='threads',
+                        help='服务端核心：threads每个连接一个线程，asyncio所有连接共用一个事件循环（适合大量观看端）')
+    parser.add_argument('--encode-stripes', type=int, default=None, help='条带模式下的条带数，默认等于CPU核心数')
+    parser.add_argument('--encode-processes', action='store_true', help='条带模式下使用进程池代替线程池编码')
+    parser.add_argument('--adaptive-rate', action='store_true',
+                        help='根据发送积压和客户端回报的延迟自动调整质量、分辨率和帧率（服务端模式）')
+    parser.add_argument('--target-latency', type=float, default=0.3, help='码率控制的端到端延迟目标（秒）')
+    parser.add_argument('--min-quality', type=int, default=20, help='码率控制的最低JPEG质量')
+    parser.add_argument('--max-quality', type=int, default=60, help='码率控制的最高JPEG质量')
+    parser.add_argument('--min-scale', type=float, default=0.5, help='码率控制的最小缩放比例')
+    parser.add_argument('--min-fps', type=int, default=5, help='码率控制的最低帧率')
+    parser.add_argument('--max-fps', type=int, default=20, help='码率控制的最高帧率')
+    parser.add_argument('--keyframe-interval', type=int, default=200, help='瓦片模式下关键帧间隔（帧数）')
+    parser.add_argument('--tier', choices=list(TIERS), default=DEFAULT_TIER,
+                        help='客户端请求的分辨率档位：full原始分辨率，720p，default为1024x576，thumb为缩略图；'
+                             '连接后可在界面中切换')
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -863,7 +1594,6 @@ if __name__ == "__main__":
         import cv2
         import numpy
         import pyaudio
-        import pyautogui
         
         # 只在客户端模式下检查GUI依赖
         if args.mode == 'client':
@@ -878,7 +1608,7 @@ if __name__ == "__main__":
             print("  brew install python-tk  # 用于GUI支持")
         else:
             print("请安装所需的依赖:")
-            print("  pip install opencv-python numpy pyaudio pyautogui")
+            print("  pip install opencv-python numpy pyaudio pyautogui mss")
         sys.exit(1)
     
     if args.mode == 'server':
@@ -892,7 +1622,37 @@ if __name__ == "__main__":
         host=args.host,
         screen_port=args.screen_port,
         control_port=args.control_port,
-        audio_port=args.audio_port
+        audio_port=args.audio_port,
+        screen_codec=args.screen_codec,
+        tile_size=args.tile_size,
+        keyframe_interval=args.keyframe_interval,
+        capture=args.capture,
+        encode_stripes=args.encode_stripes,
+        encode_processes=args.encode_processes,
+        adaptive_rate=args.adaptive_rate,
+        target_latency=args.target_latency,
+        rate_bounds={
+            'min_quality': args.min_quality,
+            'max_quality': args.max_quality,
+            'min_scale': args.min_scale,
+            'min_fps': args.min_fps,
+            'max_fps': args.max_fps,
+        },
+        tier=args.tier,
+        tile_content_aware=args.tile_content == 'auto',
+        tile_cache_mb=args.tile_cache_mb,
+        tile_refine_after=args.refine_after,
+        tile_refine_quality=args.refine_quality,
+        notsent_lowat=args.notsent_lowat * 1024,
+        server_core=args.server_core,
+        udp_video=args.udp_video,
+        udp_video_port=args.udp_video_port,
+        udp_loss=args.udp_loss,
+        input_backend=args.input,
+        input_rate=args.input_rate,
+        audio_codec=args.audio_codec,
+        audio_bitrate=args.audio_bitrate * 1000,
+        audio_frame_ms=args.audio_frame_ms
     )
     
     remote.start() 
\ No newline at end of file
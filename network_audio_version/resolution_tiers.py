@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分辨率档位
+服务端从同一次采集中为每个档位缩放并编码，客户端在握手时选择档位并可以在会话中切换
+控制命令的坐标按客户端当前档位的画面尺寸换算到屏幕坐标
+"""
+
+# 档位: (宽, 高, 是否保持屏幕宽高比)，None表示屏幕原始尺寸
+TIERS = {
+    'full': None,
+    '720p': (1280, 720, True),
+    'default': (1024, 576, False),  # 与旧客户端一致的固定尺寸
+    'thumb': (320, 180, True),
+}
+DEFAULT_TIER = 'default'
+
+
+def tier_size(tier, screen_size):
+    """计算档位在给定屏幕尺寸下的画面尺寸 (宽, 高)，宽高取偶数以便视频编码"""
+    spec = TIERS.get(tier, TIERS[DEFAULT_TIER])
+    screen_width, screen_height = screen_size
+    if spec is None:
+        return screen_width // 2 * 2, screen_height // 2 * 2
+
+    width, height, keep_aspect = spec
+    if keep_aspect:
+        # 在档位边界内按屏幕宽高比缩放，且不放大
+        ratio = min(width / screen_width, height / screen_height, 1.0)
+        width = int(screen_width * ratio)
+        height = int(screen_height * ratio)
+    return width // 2 * 2, height // 2 * 2
+
+
+def tier_sizes(screen_size):
+    """返回所有档位的画面尺寸，握手时告知客户端"""
+    return {tier: list(tier_size(tier, screen_size)) for tier in TIERS}
+
+
+def client_to_screen(x, y, view_size, screen_size):
+    """把客户端画面坐标换算为屏幕坐标，并限制在屏幕范围内"""
+    view_width, view_height = view_size
+    screen_width, screen_height = screen_size
+    screen_x = int(x * screen_width / view_width)
+    screen_y = int(y * screen_height / view_height)
+    screen_x = max(0, min(screen_x, screen_width - 1))
+    screen_y = max(0, min(screen_y, screen_height - 1))
+    return screen_x, screen_y
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+条带并行JPEG编码
+把一帧切成若干水平条带，在线程池（OpenCV编码时会释放GIL）或进程池中并行编码
+客户端按条带位置重新拼接
+"""
+
+import struct
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import os
+import cv2
+import numpy as np
+
+STRIPE_MAGIC = b'STRP'
+
+# 帧头: 魔数, 宽, 高, 条带数
+FRAME_HEADER = struct.Struct("!4sHHH")
+# 条带: 起始行, 数据长度
+STRIPE_HEADER = struct.Struct("!HI")
+
+# 条带边界按JPEG宏块(16行)对齐，避免拼接处出现色度采样错位
+STRIPE_ALIGN = 16
+
+
+def is_stripe_message(data):
+    """判断收到的数据是否为条带消息"""
+    return data[:4] == STRIPE_MAGIC
+
+
+def stripe_bounds(height, count):
+    """计算每个条带的 (起始行, 结束行)"""
+    rows = -(-height // count)
+    rows = -(-rows // STRIPE_ALIGN) * STRIPE_ALIGN
+    return [(y, min(y + rows, height)) for y in range(0, height, rows)]
+
+
+def encode_stripe(stripe, quality):
+    """编码单个条带，返回JPEG数据（一维uint8数组，拼接时直接按缓冲区读取，不再复制为bytes）"""
+    _, buffer = cv2.imencode('.jpg', stripe, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer
+
+
+class StripedJpegEncoder:
+    """条带并行JPEG编码器（服务端）"""
+    def __init__(self, stripes=None, quality=50, use_processes=False):
+        self.stripes = stripes or os.cpu_count() or 4
+        self.quality = quality
+        self.use_processes = use_processes
+        if use_processes:
+            # 进程池需要复制条带数据，只有编码远比复制耗时时才划算
+            self.pool = ProcessPoolExecutor(max_workers=self.stripes)
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=self.stripes)
+
+    def encode(self, frame):
+        """并行编码一帧，返回条带消息"""
+        height, width = frame.shape[:2]
+        bounds = stripe_bounds(height, self.stripes)
+        futures = [self.pool.submit(encode_stripe, frame[y0:y1], self.quality) for y0, y1 in bounds]
+
+        parts = [FRAME_HEADER.pack(STRIPE_MAGIC, width, height, len(bounds))]
+        for (y0, _), future in zip(bounds, futures):
+            data = future.result()
+            parts.append(STRIPE_HEADER.pack(y0, len(data)))
+            parts.append(data)
+        return b"".join(parts)
+
+    def close(self):
+        """关闭编码线程池"""
+        self.pool.shutdown(wait=False)
+
+
+class StripeDecoder:
+    """条带解码器（客户端），条带同样并行解码后写入复用的画面缓冲"""
+    def __init__(self, workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4)
+        self.frame = None
+
+    def decode(self, data):
+        """解码一条条带消息，返回拼接后的BGR图像"""
+        magic, width, height, count = FRAME_HEADER.unpack_from(data, 0)
+        if self.frame is None or self.frame.shape[:2] != (height, width):
+            self.frame = np.zeros((height, width, 3), dtype=np.uint8)
+
+        view = memoryview(data)
+        offset = FRAME_HEADER.size
+        jobs = []
+        for _ in range(count):
+            y0, length = STRIPE_HEADER.unpack_from(data, offset)
+            offset += STRIPE_HEADER.size
+            payload = np.frombuffer(view[offset:offset + length], dtype=np.uint8)
+            offset += length
+            jobs.append((y0, self.pool.submit(cv2.imdecode, payload, cv2.IMREAD_COLOR)))
+
+        for y0, future in jobs:
+            stripe = future.result()
+            if stripe is None:
+                continue
+            rows = min(stripe.shape[0], height - y0)
+            self.frame[y0:y0 + rows] = stripe[:rows, :width]
+        return self.frame
@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+瓦片增量编码
+把画面划分为固定大小的瓦片，只对与上一帧不同的瓦片进行编码
+颜色少的文字和界面瓦片用调色板+zlib无损编码，颜色丰富的照片和视频瓦片用JPEG编码
+滚动或移动的大块区域用区域复制命令表示，只发送新露出的部分
+渐进模式下变化的瓦片先以缩小的低质量草稿发送，静止若干帧后再补发高质量版本
+客户端将收到的瓦片合成到持久画布上
+"""
+
+import collections
+import hashlib
+import struct
+import zlib
+import cv2
+import numpy as np
+
+TILE_MAGIC = b'TILE'
+FLAG_KEYFRAME = 0x01
+FLAG_CACHE_RESET = 0x02  # 客户端先清空瓦片缓存再处理这条消息，只出现在关键帧上
+
+# 帧头: 魔数, 标志, 宽, 高, 瓦片边长, 条目数
+FRAME_HEADER = struct.Struct("!4sBHHHH")
+# 条目: 类型, 起始瓦片列, 起始瓦片行, 瓦片列数, 瓦片行数, 数据长度
+ENTRY_HEADER = struct.Struct("!BHHHHI")
+
+ENTRY_JPEG = 0
+ENTRY_PALETTE = 1
+ENTRY_CACHED = 2  # 引用客户端缓存中的瓦片，数据为8字节的内容ID
+ENTRY_COPY = 3  # 把画布上的一块区域复制到另一位置，数据为COPY_RECT
+ENTRY_DRAFT = 4  # 缩小后编码的JPEG草稿，客户端放大到条目覆盖的区域
+ENTRY_STORE = 0x80  # 类型的最高位：客户端解码后以数据的内容ID存入缓存
+
+# 复制条目: 源x, 源y, 目标x, 目标y, 宽, 高（像素）
+COPY_RECT = struct.Struct("!HHHHHH")
+
+# 调色板条目: 像素宽, 像素高, 颜色数，后跟 颜色数*3 字节的BGR调色板和zlib压缩的索引
+PALETTE_HEADER = struct.Struct("!HHH")
+
+
+def is_tile_message(data):
+    """判断收到的数据是否为瓦片增量消息"""
+    return data[:4] == TILE_MAGIC
+
+
+def dirty_tile_mask(frame, previous, tile_size):
+    """
+    向量化比较两帧，返回每个瓦片是否有变化的布尔矩阵 (rows, cols)
+    """
+    height, width = frame.shape[:2]
+    rows = (height + tile_size - 1) // tile_size
+    cols = (width + tile_size - 1) // tile_size
+
+    # 把颜色通道并入行内比较，避免在长度为3的轴上归约
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    changed = (frame != previous).reshape(height, width * channels)
+    pad_h = rows * tile_size - height
+    pad_w = (cols * tile_size - width) * channels
+    if pad_h or pad_w:
+        changed = np.pad(changed, ((0, pad_h), (0, pad_w)))
+    return changed.reshape(rows, tile_size, cols, tile_size * channels).any(axis=(1, 3))
+
+
+def dirty_runs(mask):
+    """把每一行中相邻的变化瓦片合并为一段，返回 (row, col, length) 列表"""
+    runs = []
+    for row in np.flatnonzero(mask.any(axis=1)):
+        line = mask[row]
+        # 找出每段连续True的起止位置
+        edges = np.diff(np.concatenate(([0], line.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        for start, end in zip(starts, ends):
+            runs.append((int(row), int(start), int(end - start)))
+    return runs
+
+
+def edge_density(region):
+    """水平相邻像素在各颜色通道上差异明显的比例，文字和界面边缘多，平滑过渡的画面边缘少"""
+    diff = cv2.absdiff(region[:, 1:], region[:, :-1])
+    return np.count_nonzero(diff > 32) / max(diff.size, 1)
+
+
+def color_keys(region):
+    """把BGR像素打包为24位整数，便于统计颜色"""
+    pixels = region.astype(np.uint32)
+    return pixels[:, :, 0] | (pixels[:, :, 1] << 8) | (pixels[:, :, 2] << 16)
+
+
+def palettize(region, max_colors=256, keys=None):
+    """把区域转换为 (BGR调色板, 索引图)，颜色数超过max_colors时返回None"""
+    if keys is None:
+        keys = color_keys(region)
+    colors, indices = np.unique(keys, return_inverse=True)
+    if len(colors) > max_colors:
+        return None
+    palette = np.stack([colors & 0xFF, (colors >> 8) & 0xFF, colors >> 16], axis=1).astype(np.uint8)
+    return palette, indices.reshape(keys.shape).astype(np.uint8)
+
+
+def encode_palette(palette, indices, level=3):
+    """把调色板和索引图打包为调色板条目的数据"""
+    height, width = indices.shape
+    return (PALETTE_HEADER.pack(width, height, len(palette)) + palette.tobytes() +
+            zlib.compress(np.ascontiguousarray(indices).tobytes(), level))
+
+
+def decode_palette(payload):
+    """解码调色板条目，返回BGR图像"""
+    width, height, count = PALETTE_HEADER.unpack_from(payload, 0)
+    offset = PALETTE_HEADER.size
+    palette = np.frombuffer(payload, dtype=np.uint8, count=count * 3, offset=offset).reshape(count, 3)
+    indices = np.frombuffer(zlib.decompress(payload[offset + count * 3:]), dtype=np.uint8)
+    return palette[indices.reshape(height, width)]
+
+
+_HASH_MULTIPLIERS = {}
+
+
+def strip_hashes(frame, tile_size):
+    """
+    计算每个完整瓦片列中每一行像素的哈希，返回 (高, 完整瓦片列数) 的uint64数组
+    每行按8字节一组与固定的随机奇数相乘后求和；行或瓦片的字节数不是8的倍数时返回None
+    """
+    height, width = frame.shape[:2]
+    row_bytes = width * 3
+    strip_words = tile_size * 3 // 8
+    if row_bytes % 8 or tile_size * 3 % 8 or not frame.flags.c_contiguous:
+        return None
+    if strip_words not in _HASH_MULTIPLIERS:
+        rng = np.random.default_rng(strip_words)
+        _HASH_MULTIPLIERS[strip_words] = rng.integers(1, 2 ** 63, strip_words, dtype=np.uint64) | np.uint64(1)
+    cols = width // tile_size
+    words = frame.reshape(height, row_bytes).view(np.uint64)[:, :cols * strip_words]
+    return (words.reshape(height, cols, strip_words) * _HASH_MULTIPLIERS[strip_words]).sum(axis=2)
+
+
+def find_shift(current, previous, max_shift, min_votes):
+    """
+    比较一列的行哈希，找出大多数内容整体移动的行数
+    只有在上一帧中唯一出现的行参与投票，空白行等重复内容不影响结果；找不到时返回None
+    """
+    order = np.argsort(previous, kind='stable')
+    ordered = previous[order]
+    unique = np.ones(len(ordered), dtype=bool)
+    same = ordered[1:] == ordered[:-1]
+    unique[1:] &= ~same
+    unique[:-1] &= ~same
+
+    positions = np.minimum(np.searchsorted(ordered, current), len(ordered) - 1)
+    valid = (ordered[positions] == current) & unique[positions]
+    shifts = np.flatnonzero(valid) - order[positions[valid]]
+    shifts = shifts[(shifts != 0) & (np.abs(shifts) <= max_shift)]
+    if len(shifts) == 0:
+        return None
+    values, counts = np.unique(shifts, return_counts=True)
+    best = np.argmax(counts)
+    return int(values[best]) if counts[best] >= min_votes else None
+
+
+def matching_band(current, previous, shift):
+    """返回移动shift后各列都与上一帧一致的最长连续行范围 (start, end)，行号为目标位置"""
+    if shift > 0:
+        matched = np.all(current[shift:] == previous[:-shift], axis=1)
+    else:
+        matched = np.all(current[:shift] == previous[-shift:], axis=1)
+    edges = np.diff(np.concatenate(([0], matched.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return 0, 0
+    best = np.argmax(ends - starts)
+    offset = max(shift, 0)
+    return int(starts[best]) + offset, int(ends[best]) + offset
+
+
+def vertical_shifts(frame, previous, columns, tile_size, min_lines):
+    """在指定的瓦片列中检测垂直滚动，相邻且滚动距离相同的列合并为一块，返回复制区域列表"""
+    current_hashes = strip_hashes(frame, tile_size)
+    previous_hashes = strip_hashes(previous, tile_size)
+    if current_hashes is None or previous_hashes is None:
+        return []
+    height = frame.shape[0]
+    shifts = {}
+    for col in columns:
+        if col < current_hashes.shape[1]:
+            shifts[col] = find_shift(current_hashes[:, col], previous_hashes[:, col], height // 2,
+                                     max(min_lines // 4, height // 16))
+
+    rects = []
+    col = 0
+    cols = current_hashes.shape[1]
+    while col < cols:
+        shift = shifts.get(col)
+        end = col + 1
+        while shift is not None and end < cols and shifts.get(end) == shift:
+            end += 1
+        if shift is not None:
+            start_row, end_row = matching_band(current_hashes[:, col:end], previous_hashes[:, col:end], shift)
+            if end_row - start_row >= min_lines:
+                x = col * tile_size
+                rects.append((x, start_row - shift, x, start_row, (end - col) * tile_size, end_row - start_row))
+        col = end
+    return rects
+
+
+def detect_scroll(frame, previous, mask, tile_size, min_lines=32):
+    """
+    检测变化区域中的垂直或水平滚动
+    返回复制区域 (源x, 源y, 目标x, 目标y, 宽, 高) 的列表，各区域互不重叠；没有明显滚动时返回空列表
+    """
+    rects = vertical_shifts(frame, previous, np.flatnonzero(mask.any(axis=0)), tile_size, min_lines)
+    if rects:
+        return rects
+    # 水平滚动：转置后按垂直滚动检测，再把坐标换回来
+    rects = vertical_shifts(np.ascontiguousarray(frame.transpose(1, 0, 2)),
+                            np.ascontiguousarray(previous.transpose(1, 0, 2)),
+                            np.flatnonzero(mask.any(axis=1)), tile_size, min_lines)
+    return [(sy, sx, dy, dx, h, w) for sx, sy, dx, dy, w, h in rects]
+
+
+def apply_copy(canvas, rect):
+    """在画布上执行区域复制，源和目标可以重叠"""
+    src_x, src_y, dst_x, dst_y, width, height = rect
+    canvas[dst_y:dst_y + height, dst_x:dst_x + width] = canvas[src_y:src_y + height, src_x:src_x + width].copy()
+
+
+def content_id(payload):
+    """条目数据的64位内容ID，服务端和客户端用相同的方法计算"""
+    return hashlib.blake2b(payload, digest_size=8).digest()
+
+
+def entry_pixel_bytes(col, row, cols, rows, tile_size, width, height):
+    """条目在画面中覆盖的像素字节数，作为缓存占用，两端据此做相同的淘汰"""
+    w = min(cols * tile_size, width - col * tile_size)
+    h = min(rows * tile_size, height - row * tile_size)
+    return max(w, 0) * max(h, 0) * 3
+
+
+def parse_entries(data):
+    """解析瓦片消息，返回 (帧头字段, [(类型, 列, 行, 列数, 行数, 数据视图)])"""
+    header = FRAME_HEADER.unpack_from(data, 0)
+    view = memoryview(data)
+    offset = FRAME_HEADER.size
+    entries = []
+    for _ in range(header[5]):
+        kind, col, row, cols, rows, length = ENTRY_HEADER.unpack_from(data, offset)
+        offset += ENTRY_HEADER.size
+        entries.append((kind, col, row, cols, rows, view[offset:offset + length]))
+        offset += length
+    return header, entries
+
+
+def merge_tile_messages(older, newer):
+    """
+    把两条尚未发送的瓦片消息合并为一条，依次应用结果与分别应用相同
+    旧消息中被新消息完全覆盖的条目会被丢弃；画面尺寸不同时无法合并，返回None
+    """
+    old_header, old_entries = parse_entries(older)
+    new_header, new_entries = parse_entries(newer)
+    _, old_flags, width, height, tile_size, _ = old_header
+    if new_header[2:5] != (width, height, tile_size):
+        return None
+    # 复制条目读取的是应用旧消息之后的画布，不能与旧消息合并
+    if any(entry[0] == ENTRY_COPY for entry in new_entries):
+        return None
+
+    # 新消息覆盖的瓦片
+    rows = (height + tile_size - 1) // tile_size
+    cols = (width + tile_size - 1) // tile_size
+    covered = np.zeros((rows, cols), dtype=bool)
+    for _, col, row, ncols, nrows, _ in new_entries:
+        covered[row:row + nrows, col:col + ncols] = True
+
+    entries = [entry for entry in old_entries
+               if not covered[entry[2]:entry[2] + entry[4], entry[1]:entry[1] + entry[3]].all()]
+    entries.extend(new_entries)
+
+    parts = [FRAME_HEADER.pack(TILE_MAGIC, old_flags, width, height, tile_size, len(entries))]
+    for kind, col, row, ncols, nrows, payload in entries:
+        parts.append(ENTRY_HEADER.pack(kind, col, row, ncols, nrows, len(payload)))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+class TileLRU:
+    """
+    按字节数限制容量的LRU，服务端的镜像和客户端的缓存使用同一份逻辑
+    两端以相同的顺序插入和访问，淘汰结果也就相同
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()  # 内容ID -> (占用字节数, 瓦片)
+        self.size = 0
+
+    def get(self, key):
+        """查找并标记为最近使用，不存在时返回None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, size, tile=None):
+        """插入一项，超出容量时淘汰最久未使用的项"""
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[0]
+        self.entries[key] = (size, tile)
+        self.size += size
+        while self.size > self.capacity and self.entries:
+            self.size -= self.entries.popitem(last=False)[1][0]
+
+
+class TileCacheMirror:
+    """
+    服务端为单个客户端维护的瓦片缓存镜像，在发送前改写瓦片消息
+    客户端已缓存的条目改为引用，其余足够大的条目标记为需要缓存
+    消息可能没有送达客户端（UDP传输放弃了该帧）时，两端的缓存不再一致，调用reset()在下一个关键帧上重新同步
+    """
+    def __init__(self, capacity, min_payload=256):
+        self.lru = TileLRU(capacity)
+        self.min_payload = min_payload  # 小于该字节数的条目不值得缓存
+        self.hits = 0
+        self.saved_bytes = 0
+        self.reset_pending = False
+        self.resets = 0
+
+    def reset(self):
+        """下一个关键帧清空镜像并带上FLAG_CACHE_RESET，关键帧中不再有引用，客户端同时清空缓存"""
+        self.reset_pending = True
+
+    def rewrite(self, data):
+        """改写一条瓦片消息，返回发送给该客户端的数据"""
+        header, entries = parse_entries(data)
+        _, flags, width, height, tile_size, _ = header
+        if self.reset_pending and flags & FLAG_KEYFRAME:
+            self.lru = TileLRU(self.lru.capacity)
+            self.reset_pending = False
+            self.resets += 1
+            flags |= FLAG_CACHE_RESET
+        parts = [FRAME_HEADER.pack(TILE_MAGIC, flags, width, height, tile_size, len(entries))]
+        for kind, col, row, cols, rows, payload in entries:
+            if len(payload) >= self.min_payload:
+                key = content_id(payload)
+                if self.lru.get(key) is not None:
+                    self.hits += 1
+                    self.saved_bytes += len(payload) - len(key)
+                    kind, payload = ENTRY_CACHED, key
+                else:
+                    self.lru.put(key, entry_pixel_bytes(col, row, cols, rows, tile_size, width, height))
+                    kind |= ENTRY_STORE
+            parts.append(ENTRY_HEADER.pack(kind, col, row, cols, rows, len(payload)))
+            parts.append(payload)
+        return b"".join(parts)
+
+    def stats(self):
+        """返回缓存命中统计"""
+        return {'cache_hits': self.hits, 'cache_saved': self.saved_bytes, 'cache_size': self.lru.size,
+                'cache_resets': self.resets}
+
+
+class TileEncoder:
+    """
+    瓦片增量编码器（服务端）
+    content_aware为True时按瓦片内容选择无损调色板或JPEG，否则全部使用JPEG
+    """
+    def __init__(self, tile_size=64, quality=50, keyframe_interval=200, content_aware=True,
+                 flat_colors=32, min_edge_density=0.02, max_busy=0.7, detect_scroll=True, min_scroll_tiles=8,
+                 refine_after=0, refine_quality=90, draft_quality=30, draft_scale=0.5):
+        self.tile_size = tile_size
+        self.quality = quality
+        self.keyframe_interval = keyframe_interval  # 每隔多少帧强制发送关键帧
+        self.content_aware = content_aware
+        self.flat_colors = flat_colors  # 颜色数不超过该值的瓦片总是无损编码
+        self.min_edge_density = min_edge_density  # 颜色较多时，边缘比例达到该值才按文字/界面无损编码
+        self.max_busy = max_busy  # 与左邻颜色不同的像素超过该比例时视为照片/视频，直接用JPEG
+        self.detect_scroll = detect_scroll
+        self.min_scroll_tiles = min_scroll_tiles  # 变化瓦片达到该数量时才尝试检测滚动
+        self.copies = 0  # 发出的区域复制命令数
+        # 渐进模式：refine_after大于0时变化的瓦片先发送草稿，静止refine_after帧后以refine_quality补发
+        self.refine_after = refine_after
+        self.refine_quality = refine_quality
+        self.draft_quality = draft_quality
+        self.draft_scale = draft_scale
+        self.static_frames = None  # 每个瓦片连续未变化的帧数
+        self.pending = None  # 客户端上仍是草稿、等待补发的瓦片
+        self.refined = 0  # 补发的瓦片数
+        self.previous = None
+        self.frames_since_keyframe = 0
+        self.keyframe_requested = True
+
+    def request_keyframe(self):
+        """请求下一帧输出完整关键帧"""
+        self.keyframe_requested = True
+
+    def encode(self, frame):
+        """
+        编码一帧
+        返回 (消息数据, 是否关键帧)；画面无变化时返回 (None, False)
+        """
+        height, width = frame.shape[:2]
+        keyframe = (self.keyframe_requested or
+                    self.previous is None or
+                    self.previous.shape != frame.shape or
+                    self.frames_since_keyframe >= self.keyframe_interval)
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+
+        entries = []
+        rows = (height + self.tile_size - 1) // self.tile_size
+        cols = (width + self.tile_size - 1) // self.tile_size
+        if keyframe and not self.content_aware:
+            # 关键帧：整幅画面编码为一个条目
+            _, buffer = cv2.imencode('.jpg', frame, params)
+            entries.append((ENTRY_JPEG, 0, 0, cols, rows, buffer))
+        else:
+            # 按内容分类时关键帧也逐行按瓦片编码
+            if keyframe:
+                runs = [(row, 0, cols) for row in range(rows)]
+                if self.refine_after > 0:
+                    self.static_frames = np.zeros((rows, cols), dtype=np.int32)
+                    self.pending = np.zeros((rows, cols), dtype=bool)
+            else:
+                mask = dirty_tile_mask(frame, self.previous, self.tile_size)
+                # 大面积变化时检测滚动：先复制移动的区域，再只发送复制后仍不同的瓦片
+                if self.detect_scroll and np.count_nonzero(mask) >= self.min_scroll_tiles:
+                    rects = detect_scroll(frame, self.previous, mask, self.tile_size)
+                    for rect in rects:
+                        apply_copy(self.previous, rect)
+                        entries.append(self.copy_entry(rect))
+                        self.copies += 1
+                    if rects:
+                        mask = dirty_tile_mask(frame, self.previous, self.tile_size)
+                if self.refine_after > 0:
+                    entries.extend(self.encode_progressive(frame, mask, entries))
+                    runs = []
+                else:
+                    runs = dirty_runs(mask)
+            for row, col, length in runs:
+                entries.extend(self.encode_run(frame, row, col, length, params))
+
+        # 保存本帧用于下一次比较
+        if self.previous is None or self.previous.shape != frame.shape:
+            self.previous = frame.copy()
+        else:
+            np.copyto(self.previous, frame)
+
+        if keyframe:
+            self.keyframe_requested = False
+            self.frames_since_keyframe = 0
+        else:
+            self.frames_since_keyframe += 1
+            if not entries:
+                return None, False
+
+        return self.pack(width, height, keyframe, entries), keyframe
+
+    def copy_entry(self, rect):
+        """生成区域复制条目，覆盖范围为目标区域所在的瓦片"""
+        ts = self.tile_size
+        col0, row0 = rect[2] // ts, rect[3] // ts
+        return (ENTRY_COPY, col0, row0,
+                (rect[2] + rect[4] - 1) // ts - col0 + 1,
+                (rect[3] + rect[5] - 1) // ts - row0 + 1,
+                COPY_RECT.pack(*rect))
+
+    def encode_progressive(self, frame, mask, copies):
+        """
+        渐进模式的增量编码：变化的瓦片发送草稿，草稿瓦片静止refine_after帧后补发高质量版本
+        返回条目列表
+        """
+        # 复制命令把草稿像素带到目标位置，目标瓦片按变化处理
+        for _, col, row, cols, rows, payload in copies:
+            src_x, src_y, _, _, width, height = COPY_RECT.unpack(payload)
+            ts = self.tile_size
+            source = self.pending[src_y // ts:(src_y + height - 1) // ts + 1, src_x // ts:(src_x + width - 1) // ts + 1]
+            self.pending[row:row + rows, col:col + cols] |= bool(source.any())
+            self.static_frames[row:row + rows, col:col + cols] = 0
+
+        self.static_frames += 1
+        self.static_frames[mask] = 0
+        ready = self.pending & (self.static_frames >= self.refine_after)
+        self.pending |= mask
+        self.pending &= ~ready
+        self.refined += int(np.count_nonzero(ready))
+
+        entries = []
+        for row, col, length in dirty_runs(mask):
+            entries.append(self.encode_draft(frame, row, col, length))
+        refine_params = [cv2.IMWRITE_JPEG_QUALITY, self.refine_quality]
+        for row, col, length in dirty_runs(ready):
+            entries.extend(self.encode_run(frame, row, col, length, refine_params))
+        return entries
+
+    def encode_draft(self, frame, row, col, length):
+        """把一段瓦片缩小后以草稿质量编码为一个条目"""
+        size = self.tile_size
+        region = frame[row * size:(row + 1) * size, col * size:(col + length) * size]
+        height, width = region.shape[:2]
+        small = (max(1, int(width * self.draft_scale)), max(1, int(height * self.draft_scale)))
+        region = cv2.resize(region, small, interpolation=cv2.INTER_AREA)
+        _, buffer = cv2.imencode('.jpg', region, [cv2.IMWRITE_JPEG_QUALITY, min(self.quality, self.draft_quality)])
+        return ENTRY_DRAFT, col, row, length, 1, buffer
+
+    def classify(self, tile):
+        """
+        判断瓦片是否适合无损编码
+        颜色很少的界面区域，以及颜色不多但边缘密集的文字区域无损编码；颜色丰富或平滑过渡的区域交给JPEG
+        """
+        keys = color_keys(tile)
+        # 几乎每个像素都与左邻不同的是照片或视频，不必再统计颜色
+        if np.count_nonzero(keys[:, 1:] != keys[:, :-1]) > keys.size * self.max_busy:
+            return False
+        keys = np.sort(keys, axis=None)
+        colors = 1 + np.count_nonzero(keys[1:] != keys[:-1])
+        if colors > 256:
+            return False
+        return colors <= self.flat_colors or edge_density(tile) >= self.min_edge_density
+
+    def encode_run(self, frame, row, col, length, params):
+        """编码一行中连续的一段瓦片，相邻的同类瓦片合并为一个条目，返回条目列表"""
+        size = self.tile_size
+        y0 = row * size
+        if not self.content_aware:
+            region = frame[y0:y0 + size, col * size:(col + length) * size]
+            _, buffer = cv2.imencode('.jpg', region, params)
+            return [(ENTRY_JPEG, col, row, length, 1, buffer)]
+
+        # 逐个瓦片分类，再把相邻的同类瓦片合并
+        kinds = [self.classify(frame[y0:y0 + size, x * size:(x + 1) * size]) for x in range(col, col + length)]
+        entries = []
+        start = 0
+        for end in range(1, length + 1):
+            if end < length and kinds[end] == kinds[start]:
+                continue
+            x0 = (col + start) * size
+            region = frame[y0:y0 + size, x0:(col + end) * size]
+            if kinds[start]:
+                entries.extend(self.encode_lossless(region, col + start, row, end - start))
+            else:
+                _, buffer = cv2.imencode('.jpg', region, params)
+                entries.append((ENTRY_JPEG, col + start, row, end - start, 1, buffer))
+            start = end
+        return entries
+
+    def encode_lossless(self, region, col, row, length):
+        """无损编码一段瓦片，合并后颜色超过调色板容量时逐个瓦片编码"""
+        result = palettize(region)
+        if result is not None:
+            return [(ENTRY_PALETTE, col, row, length, 1, encode_palette(*result))]
+        size = self.tile_size
+        return [(ENTRY_PALETTE, col + i, row, 1, 1, encode_palette(*palettize(region[:, i * size:(i + 1) * size])))
+                for i in range(length)]
+
+    def pack(self, width, height, keyframe, entries):
+        """把条目序列化为一条消息"""
+        flags = FLAG_KEYFRAME if keyframe else 0
+        parts = [FRAME_HEADER.pack(TILE_MAGIC, flags, width, height, self.tile_size, len(entries))]
+        for kind, col, row, cols, rows, payload in entries:
+            parts.append(ENTRY_HEADER.pack(kind, col, row, cols, rows, len(payload)))
+            parts.append(payload)
+        return b"".join(parts)
+
+
+class TileCanvas:
+    """瓦片合成画布（客户端），cache_bytes大于0时缓存服务端标记的瓦片"""
+    def __init__(self, cache_bytes=0):
+        self.canvas = None
+        self.has_keyframe = False
+        self.cache = TileLRU(cache_bytes) if cache_bytes > 0 else None
+        self.cache_misses = 0
+
+    def apply(self, data):
+        """
+        把一条瓦片消息合成到画布上
+        返回合成后的画布；尚未收到关键帧时返回None
+        """
+        magic, flags, width, height, tile_size, count = FRAME_HEADER.unpack_from(data, 0)
+        keyframe = bool(flags & FLAG_KEYFRAME)
+        if flags & FLAG_CACHE_RESET and self.cache is not None:
+            self.cache = TileLRU(self.cache.capacity)
+
+        if keyframe:
+            if self.canvas is None or self.canvas.shape[:2] != (height, width):
+                self.canvas = np.zeros((height, width, 3), dtype=np.uint8)
+            self.has_keyframe = True
+        elif not self.has_keyframe and self.cache is None:
+            return None
+
+        # 等待关键帧期间也要处理缓存条目，保持与服务端镜像一致
+        draw = self.has_keyframe
+        for kind, col, row, cols, rows, payload in parse_entries(data)[1]:
+            # 复制命令在合成之后的瓦片之前执行
+            if kind == ENTRY_COPY:
+                if draw:
+                    apply_copy(self.canvas, COPY_RECT.unpack(payload))
+                continue
+            tile = self.decode_entry(kind, col, row, cols, rows, payload, tile_size, width, height)
+            if tile is None or not draw:
+                continue
+            y0 = row * tile_size
+            x0 = col * tile_size
+            h = min(tile.shape[0], height - y0)
+            w = min(tile.shape[1], width - x0)
+            self.canvas[y0:y0 + h, x0:x0 + w] = tile[:h, :w]
+
+        return self.canvas if draw else None
+
+    def decode_entry(self, kind, col, row, cols, rows, payload, tile_size, width, height):
+        """解码一个条目，按需读取或写入瓦片缓存，返回BGR图像"""
+        if kind == ENTRY_CACHED:
+            entry = self.cache.get(bytes(payload)) if self.cache is not None else None
+            if entry is None:
+                self.cache_misses += 1
+                return None
+            return entry[1]
+
+        base = kind & ~ENTRY_STORE
+        if base == ENTRY_JPEG:
+            tile = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        elif base == ENTRY_PALETTE:
+            tile = decode_palette(payload)
+        elif base == ENTRY_DRAFT:
+            tile = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+            size = (min(cols * tile_size, width - col * tile_size), min(rows * tile_size, height - row * tile_size))
+            tile = cv2.resize(tile, size, interpolation=cv2.INTER_LINEAR)
+        else:
+            return None
+
+        if kind & ENTRY_STORE and self.cache is not None:
+            size = entry_pixel_bytes(col, row, cols, rows, tile_size, width, height)
+            self.cache.put(content_id(payload), size, tile)
+        return tile
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UDP屏幕传输丢包恢复基准测试
+在本机UDP套接字上发送合成画面的JPEG帧，服务端发送经过LossySocket按指定概率丢包，
+统计不同丢包率下完整交付的帧数、纠错恢复的分片数、重传次数和从采集到交付的延迟
+无需显示环境
+
+用法: python udp_loss_benchmark.py --loss 0 0.01 0.05 0.1 --burst 2 --frames 200
+"""
+
+import argparse
+import socket
+import threading
+import time
+
+import cv2
+
+from capture_backends import SyntheticCapture
+from stream_protocol import pack_header, MSG_FRAME, FLAG_KEYFRAME
+from udp_transport import (UdpVideoServer, UdpVideoReceiver, LossySocket, pack_register, unpack_message,
+                           open_client_socket)
+
+
+def encode_frames(count, size, quality):
+    """预先编码合成画面，测试中不包含编码耗时"""
+    capture = SyntheticCapture(1920, 1080)
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    return [cv2.imencode('.jpg', cv2.resize(capture.grab(), size), params)[1].tobytes() for _ in range(count)]
+
+
+def run(frames, loss, burst, fps, fec_group, deadline):
+    """发送全部帧并返回 (各交付帧的延迟列表, 接收统计, 发送统计, 丢弃的数据报数)"""
+    server_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_sock.bind(('127.0.0.1', 0))
+    server_sock.settimeout(0.05)
+    lossy = LossySocket(server_sock, loss=loss, burst=burst, seed=1)
+    server = UdpVideoServer(server_sock.getsockname()[1], fec_group=fec_group, deadline=deadline)
+    server.sendto = lossy.sendto
+    sender = server.open(1)
+
+    client_sock = open_client_socket()
+    client_sock.bind(('127.0.0.1', 0))
+    client_sock.settimeout(0.005)
+    receiver = UdpVideoReceiver(1, deadline=deadline)
+    running = True
+    delivered = []
+
+    def serve():
+        while running:
+            try:
+                data, addr = server_sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            server.handle_datagram(data, addr)
+
+    def receive():
+        while running:
+            messages = []
+            try:
+                messages = receiver.feed(client_sock.recv(65536))
+            except socket.timeout:
+                pass
+            ready, nacks = receiver.poll()
+            for nack in nacks:
+                client_sock.sendto(nack, server_sock.getsockname())
+            now = time.monotonic()
+            for message in messages + ready:
+                delivered.append(now - unpack_message(message).captured)
+
+    threads = [threading.Thread(target=serve), threading.Thread(target=receive)]
+    for thread in threads:
+        thread.start()
+    client_sock.sendto(pack_register(1), server_sock.getsockname())
+    while not sender.ready():
+        time.sleep(0.01)
+
+    for index, data in enumerate(frames):
+        sender.send(pack_header(MSG_FRAME, len(data), index, flags=FLAG_KEYFRAME) + data)
+        time.sleep(1.0 / fps)
+    time.sleep(deadline * 2)
+    running = False
+    for thread in threads:
+        thread.join()
+    server_sock.close()
+    client_sock.close()
+    return delivered, receiver.stats, sender.stats, lossy.dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UDP屏幕传输丢包恢复基准测试')
+    parser.add_argument('--loss', type=float, nargs='+', default=[0, 0.01, 0.05, 0.1], help='丢包率')
+    parser.add_argument('--burst', type=float, default=1.0, help='平均连续丢包个数')
+    parser.add_argument('--frames', type=int, default=200, help='发送的帧数')
+    parser.add_argument('--fps', type=int, default=20, help='发送帧率')
+    parser.add_argument('--quality', type=int, default=50, help='JPEG质量')
+    parser.add_argument('--fec-group', type=int, default=8, help='每组数据分片数，0为不使用纠错')
+    parser.add_argument('--deadline', type=float, default=0.25, help='帧的截止时间（秒）')
+    args = parser.parse_args()
+
+    frames = encode_frames(args.frames, (1024, 576), args.quality)
+    average = sum(len(f) for f in frames) / len(frames)
+    print(f"{args.frames} 帧 1024x576 JPEG，平均 {average / 1024:.1f} KiB，{args.fps} fps，"
+          f"纠错分组 {args.fec_group}，截止时间 {args.deadline * 1000:.0f} ms，突发 {args.burst}")
+
+    for loss in args.loss:
+        delivered, rx, tx, dropped = run(frames, loss, args.burst, args.fps, args.fec_group, args.deadline)
+        delivered.sort()
+        median = delivered[len(delivered) // 2] * 1000 if delivered else 0
+        worst = delivered[-1] * 1000 if delivered else 0
+        print(f"丢包率 {loss * 100:.0f}%: 交付 {len(delivered)}/{args.frames} 帧，丢弃数据报 {dropped}，"
+              f"纠错恢复 {rx['recovered']}，NACK {rx['nacks']}，重传 {tx['retransmits']}，放弃 {rx['lost']}，"
+              f"延迟中位数 {median:.1f} ms，最大 {worst:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UDP屏幕传输
+把一条带帧头的消息切成不超过MTU的分片，每个分片带有帧编号和分片序号（类似RTP），通过UDP发送，
+丢包时只影响所在的一帧，不会像TCP那样在重传完成之前卡住后面所有的画面
+- 前向纠错：每组数据分片附加一个XOR校验分片，组内丢失一个分片时直接恢复
+- 选择性重传：接收端对纠错无法恢复的分片发送NACK，发送端在截止时间内只重传这些分片
+- 超过截止时间仍不完整的帧被放弃，迟到的分片直接丢弃；之后的增量帧在收到关键帧之前不显示
+握手、光标形状、客户端回报和关键帧请求仍走TCP屏幕连接，UDP不通时画面继续通过TCP发送
+LossySocket在进程内模拟丢包，用于测试丢包恢复
+"""
+
+import collections
+import random
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from stream_protocol import FRAME_HEADER, FLAG_KEYFRAME, Message, unpack_header
+
+PACKET_MAGIC = b'RV'
+REGISTER_MAGIC = b'RR'
+NACK_MAGIC = b'RN'
+
+# 分片头: 魔数, 类型, 每组数据分片数, 帧编号, 消息长度, 分片序号（校验分片为组号）, 数据分片数
+PACKET_HEADER = struct.Struct("!2sBBIIHH")
+# 注册数据报: 魔数, 会话令牌；客户端定期发送，服务端据此得知客户端的UDP地址
+REGISTER = struct.Struct("!2sI")
+# NACK数据报头: 魔数, 会话令牌, 帧编号, 分片数，后跟请求重传的分片序号（uint16），分片数为0表示整帧
+NACK_HEADER = struct.Struct("!2sIIH")
+NACK_INDEX = struct.Struct("!H")
+MAX_NACK_INDICES = 600  # 单个NACK数据报最多列出的分片数，更多时请求整帧
+
+KIND_DATA = 0
+KIND_PARITY = 1
+
+DEFAULT_FRAGMENT_SIZE = 1200  # 分片负载大小，加上IP/UDP头和分片头不超过常见路径的MTU
+DEFAULT_FEC_GROUP = 8  # 每组数据分片数，每组一个XOR校验分片（12.5%冗余），0为不使用纠错
+DEFAULT_DEADLINE = 0.25  # 一帧从第一次得知起最长等待的时间（秒），超过后放弃，发送端也不再重传
+
+
+def packetize(frame_no, message, fragment_size=DEFAULT_FRAGMENT_SIZE, fec_group=DEFAULT_FEC_GROUP):
+    """
+    把一条消息切成数据分片并为每组生成XOR校验分片
+    返回 (数据分片列表, 按发送顺序排列的全部分片)，每组的校验分片紧跟在该组的数据分片之后
+    """
+    view = memoryview(message).cast('B')
+    length = len(view)
+    count = max(1, -(-length // fragment_size))
+    frame_no &= 0xFFFFFFFF
+    data = [PACKET_HEADER.pack(PACKET_MAGIC, KIND_DATA, fec_group, frame_no, length, i, count)
+            + view[i * fragment_size:(i + 1) * fragment_size] for i in range(count)]
+    if fec_group <= 0:
+        return data, data
+
+    # 组内分片补零到相同长度后逐字节异或
+    groups = -(-count // fec_group)
+    padded = np.zeros(groups * fec_group * fragment_size, dtype=np.uint8)
+    padded[:length] = np.frombuffer(view, dtype=np.uint8)
+    parity = np.bitwise_xor.reduce(padded.reshape(groups, fec_group, fragment_size), axis=1)
+
+    packets = []
+    for group in range(groups):
+        packets.extend(data[group * fec_group:(group + 1) * fec_group])
+        packets.append(PACKET_HEADER.pack(PACKET_MAGIC, KIND_PARITY, fec_group, frame_no, length, group, count)
+                       + parity[group].tobytes())
+    return data, packets
+
+
+def pack_register(token):
+    """打包客户端的注册数据报"""
+    return REGISTER.pack(REGISTER_MAGIC, token)
+
+
+def pack_nack(token, frame_no, indices):
+    """打包NACK数据报，indices为空时请求整帧"""
+    if len(indices) > MAX_NACK_INDICES:
+        indices = ()
+    return NACK_HEADER.pack(NACK_MAGIC, token, frame_no & 0xFFFFFFFF, len(indices)) + \
+        b''.join(NACK_INDEX.pack(index) for index in indices)
+
+
+def unpack_nack(data):
+    """解析NACK数据报，返回 (令牌, 帧编号, 分片序号列表)，格式不对时返回None"""
+    if len(data) < NACK_HEADER.size or data[:2] != NACK_MAGIC:
+        return None
+    _, token, frame_no, count = NACK_HEADER.unpack_from(data)
+    if len(data) != NACK_HEADER.size + count * NACK_INDEX.size:
+        return None
+    indices = [NACK_INDEX.unpack_from(data, NACK_HEADER.size + i * NACK_INDEX.size)[0] for i in range(count)]
+    return token, frame_no, indices
+
+
+def unpack_message(data):
+    """把重组后的一条带帧头的消息解析为Message，负载为memoryview"""
+    msg_type, flags, seq, captured, length = unpack_header(data[:FRAME_HEADER.size])
+    return Message(msg_type, flags, seq, captured, memoryview(data)[FRAME_HEADER.size:FRAME_HEADER.size + length])
+
+
+class UdpVideoSender:
+    """服务端一个客户端的UDP发送状态，保存截止时间内已发送的分片以便重传"""
+    def __init__(self, sendto, token, fragment_size=DEFAULT_FRAGMENT_SIZE, fec_group=DEFAULT_FEC_GROUP,
+                 deadline=DEFAULT_DEADLINE):
+        self.sendto = sendto  # sendto(数据, 地址)
+        self.token = token
+        self.fragment_size = fragment_size
+        self.fec_group = fec_group
+        self.deadline = deadline
+        self.addr = None  # 客户端注册后得知的UDP地址
+        self.frame_no = 0
+        self.history = collections.OrderedDict()  # 帧编号 -> (发送时间, 数据分片)
+        self.lock = threading.Lock()  # 发送线程和处理NACK的线程共用history
+        self.stats = {'frames': 0, 'packets': 0, 'parity': 0, 'retransmits': 0, 'expired_nacks': 0,
+                      'send_errors': 0}
+
+    def ready(self):
+        """客户端的UDP地址是否已知"""
+        return self.addr is not None
+
+    def send(self, message, now=None):
+        """分片发送一条带帧头的消息"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.frame_no += 1
+            data, packets = packetize(self.frame_no, message, self.fragment_size, self.fec_group)
+            self.history[self.frame_no] = (now, data)
+            while now - next(iter(self.history.values()))[0] > self.deadline:
+                self.history.popitem(last=False)
+        for packet in packets:
+            self.transmit(packet)
+        self.stats['frames'] += 1
+        self.stats['packets'] += len(packets)
+        self.stats['parity'] += len(packets) - len(data)
+
+    def transmit(self, packet):
+        try:
+            self.sendto(packet, self.addr)
+        except OSError:
+            # 发送缓冲区满等错误与网络丢包相同，由接收端的NACK处理
+            self.stats['send_errors'] += 1
+
+    def on_nack(self, frame_no, indices, now=None):
+        """重传接收端请求的分片，超过截止时间的帧不再重传"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            entry = self.history.get(frame_no)
+            if entry is None or now - entry[0] > self.deadline:
+                self.stats['expired_nacks'] += 1
+                return
+            data = entry[1]
+        for index in indices or range(len(data)):
+            if index < len(data):
+                self.transmit(data[index])
+                self.stats['retransmits'] += 1
+
+
+class UdpVideoServer:
+    """
+    服务端的UDP屏幕端口：按令牌登记客户端的UDP地址，把NACK交给对应的发送状态
+    sendto由服务端核心设置（线程模式为套接字的sendto，asyncio模式为数据报传输的sendto）
+    """
+    def __init__(self, port, fragment_size=DEFAULT_FRAGMENT_SIZE, fec_group=DEFAULT_FEC_GROUP,
+                 deadline=DEFAULT_DEADLINE):
+        self.port = port
+        self.fragment_size = fragment_size
+        self.fec_group = fec_group
+        self.deadline = deadline
+        self.sendto = None
+        self.senders = {}  # 令牌 -> UdpVideoSender
+
+    def offer(self):
+        """握手回复中的UDP参数"""
+        return {'port': self.port, 'fragment': self.fragment_size, 'fec_group': self.fec_group,
+                'deadline': self.deadline}
+
+    def open(self, token):
+        """为一个客户端的令牌创建发送状态，客户端注册地址后开始使用"""
+        sender = UdpVideoSender(self.send_datagram, token, self.fragment_size, self.fec_group, self.deadline)
+        self.senders[token] = sender
+        return sender
+
+    def close(self, sender):
+        if self.senders.get(sender.token) is sender:
+            del self.senders[sender.token]
+
+    def send_datagram(self, data, addr):
+        self.sendto(data, addr)
+
+    def handle_datagram(self, data, addr, now=None):
+        """处理客户端发来的注册或NACK数据报"""
+        if len(data) == REGISTER.size and data[:2] == REGISTER_MAGIC:
+            sender = self.senders.get(REGISTER.unpack(data)[1])
+            if sender is not None and sender.addr != addr:
+                sender.addr = addr
+                print(f"UDP屏幕传输已注册: {addr}")
+            return
+        nack = unpack_nack(data)
+        if nack is not None:
+            sender = self.senders.get(nack[0])
+            if sender is not None and sender.addr == addr:
+                sender.on_nack(nack[1], nack[2], now)
+
+
+class FrameAssembly:
+    """接收端一帧的分片"""
+    def __init__(self, now):
+        self.first_seen = now
+        self.last_nack = 0
+        self.length = None
+        self.count = None  # 数据分片数，收到该帧的任一分片后得知
+        self.fec_group = 0
+        self.fragments = {}  # 分片序号 -> 负载
+        self.parity = {}  # 组号 -> 校验负载
+        self.message = None  # 重组完成的消息
+        self.keyframe = False
+
+    def add(self, kind, fec_group, length, index, count, payload):
+        """加入一个分片，返回是否通过纠错恢复了丢失的分片"""
+        self.length, self.count, self.fec_group = length, count, fec_group
+        if kind == KIND_PARITY:
+            if index in self.parity:
+                return False
+            self.parity[index] = payload
+            return self.recover(index)
+        if index >= count or index in self.fragments:
+            return False
+        self.fragments[index] = payload
+        return fec_group > 0 and self.recover(index // fec_group)
+
+    def group_missing(self, group):
+        start = group * self.fec_group
+        return [i for i in range(start, min(start + self.fec_group, self.count)) if i not in self.fragments]
+
+    def recover(self, group):
+        """组内只缺一个数据分片且校验分片已到时，异或恢复该分片"""
+        parity = self.parity.get(group)
+        if parity is None:
+            return False
+        missing = self.group_missing(group)
+        if len(missing) != 1:
+            return False
+        index = missing[0]
+        fragment_size = len(parity)
+        xor = np.frombuffer(parity, dtype=np.uint8).copy()
+        start = group * self.fec_group
+        for i in range(start, min(start + self.fec_group, self.count)):
+            if i != index:
+                fragment = np.frombuffer(self.fragments[i], dtype=np.uint8)
+                xor[:len(fragment)] ^= fragment
+        size = fragment_size if index < self.count - 1 else self.length - (self.count - 1) * fragment_size
+        self.fragments[index] = xor[:size].tobytes()
+        return True
+
+    def complete(self):
+        """所有数据分片都已到达时重组消息，返回是否完整"""
+        if self.message is None and self.count is not None and len(self.fragments) == self.count:
+            message = b''.join(self.fragments[i] for i in range(self.count))[:self.length]
+            self.message = message
+            self.keyframe = bool(unpack_header(message[:FRAME_HEADER.size])[1] & FLAG_KEYFRAME)
+            self.fragments = self.parity = None
+        return self.message is not None
+
+    def nack_indices(self):
+        """需要重传的分片：有校验分片的组少请求一个，收到后由纠错补齐"""
+        if self.count is None:
+            return []
+        if self.fec_group <= 0:
+            return [i for i in range(self.count) if i not in self.fragments]
+        indices = []
+        for group in range(-(-self.count // self.fec_group)):
+            missing = self.group_missing(group)
+            indices.extend(missing[1:] if group in self.parity else missing)
+        return indices
+
+
+class UdpVideoReceiver:
+    """
+    客户端的UDP分片重组：按帧编号顺序交付完整的消息，对丢失的分片发送NACK
+    完整的关键帧可以越过前面未完成的帧直接交付；放弃一帧之后丢弃增量帧，直到收到关键帧
+    """
+    def __init__(self, token, deadline=DEFAULT_DEADLINE, nack_interval=0.02, max_ahead=256):
+        self.token = token
+        self.deadline = deadline
+        self.nack_interval = nack_interval  # 同一帧两次NACK的间隔，也是发送第一次NACK前等待乱序分片的时间
+        self.max_ahead = max_ahead  # 超前太多的帧编号视为无效
+        self.frames = {}  # 帧编号 -> FrameAssembly
+        self.next_frame = 1  # 下一个应交付的帧编号
+        self.newest = 0
+        self.waiting_keyframe = True  # 从TCP切换到UDP后也从关键帧开始显示
+        self.keyframe_wanted = False
+        self.last_keyframe_request = 0
+        self.stats = {'frames': 0, 'packets': 0, 'recovered': 0, 'nacks': 0, 'lost': 0, 'late': 0,
+                      'discarded': 0}
+
+    def feed(self, datagram, now=None):
+        """处理一个分片数据报，返回按顺序可以显示的完整消息列表"""
+        now = time.monotonic() if now is None else now
+        if len(datagram) < PACKET_HEADER.size:
+            return []
+        magic, kind, fec_group, frame_no, length, index, count = PACKET_HEADER.unpack_from(datagram)
+        if magic != PACKET_MAGIC:
+            return []
+        self.stats['packets'] += 1
+        if frame_no < self.next_frame:
+            # 已交付帧多余的校验分片不算迟到
+            if kind == KIND_DATA:
+                self.stats['late'] += 1
+            return []
+        if frame_no - self.next_frame > self.max_ahead:
+            return []
+
+        # 中间完全没有收到分片的帧也登记下来，以便请求重传和按时放弃
+        for missing in range(max(self.newest + 1, self.next_frame), frame_no):
+            self.frames[missing] = FrameAssembly(now)
+        self.newest = max(self.newest, frame_no)
+
+        assembly = self.frames.get(frame_no)
+        if assembly is None:
+            assembly = self.frames[frame_no] = FrameAssembly(now)
+        if assembly.message is not None:
+            return []
+        if assembly.add(kind, fec_group, length, index, count, datagram[PACKET_HEADER.size:]):
+            self.stats['recovered'] += 1
+        if not assembly.complete():
+            return []
+        return self.deliver()
+
+    def deliver(self):
+        messages = []
+        while True:
+            assembly = self.frames.get(self.next_frame)
+            if assembly is not None and assembly.message is not None:
+                del self.frames[self.next_frame]
+                self.next_frame += 1
+                self.accept(assembly, messages)
+                continue
+            # 后面已经有完整的关键帧，前面未完成的帧不再需要
+            keyframes = [n for n, a in self.frames.items() if a.message is not None and a.keyframe]
+            if not keyframes:
+                return messages
+            for frame_no in range(self.next_frame, min(keyframes)):
+                if self.frames.pop(frame_no, None) is not None:
+                    self.stats['lost'] += 1
+            self.next_frame = min(keyframes)
+
+    def accept(self, assembly, messages):
+        if self.waiting_keyframe and not assembly.keyframe:
+            self.stats['discarded'] += 1
+            self.keyframe_wanted = True
+            return
+        self.waiting_keyframe = False
+        self.keyframe_wanted = False
+        self.stats['frames'] += 1
+        messages.append(assembly.message)
+
+    def poll(self, now=None):
+        """
+        处理计时：放弃超过截止时间的帧，为不完整的帧生成NACK
+        返回 (可以显示的消息列表, 需要发送的NACK数据报列表)
+        """
+        now = time.monotonic() if now is None else now
+        abandoned = False
+        while True:
+            assembly = self.frames.get(self.next_frame)
+            if assembly is None or assembly.message is not None or now - assembly.first_seen <= self.deadline:
+                break
+            del self.frames[self.next_frame]
+            self.next_frame += 1
+            self.stats['lost'] += 1
+            abandoned = True
+        if abandoned:
+            # 丢失的可能是增量帧，之后的增量帧在收到关键帧之前无法正确显示
+            self.waiting_keyframe = True
+            self.keyframe_wanted = True
+        messages = self.deliver() if abandoned else []
+
+        nacks = []
+        for frame_no, assembly in self.frames.items():
+            if assembly.message is not None or now - assembly.last_nack < self.nack_interval:
+                continue
+            if now - assembly.first_seen < self.nack_interval:
+                continue
+            assembly.last_nack = now
+            nacks.append(pack_nack(self.token, frame_no, assembly.nack_indices()))
+        self.stats['nacks'] += len(nacks)
+        return messages, nacks
+
+    def take_keyframe_request(self, now=None, interval=0.5):
+        """需要关键帧时返回True，由客户端通过TCP连接请求，同一请求至少间隔interval秒"""
+        now = time.monotonic() if now is None else now
+        if not self.keyframe_wanted or now - self.last_keyframe_request < interval:
+            return False
+        self.last_keyframe_request = now
+        return True
+
+
+class LossySocket:
+    """
+    在进程内模拟丢包的UDP套接字包装，用于测试和基准测试
+    loss为丢包概率；burst大于1时一次丢包连续丢弃平均burst个数据报，模拟无线网络的突发丢包
+    """
+    def __init__(self, sock, loss=0.05, burst=1.0, seed=None):
+        self.sock = sock
+        self.loss = loss
+        self.burst = max(1.0, burst)
+        self.random = random.Random(seed)
+        self.dropping = False
+        self.sent = 0
+        self.dropped = 0
+
+    def sendto(self, data, addr):
+        # 两状态模型：每个数据报以1/burst的概率离开丢包状态，进入的概率使长期平均丢包率为loss
+        if self.dropping:
+            self.dropping = self.random.random() >= 1.0 / self.burst
+        else:
+            self.dropping = self.random.random() < self.loss / (self.burst * (1.0 - self.loss))
+        if self.dropping:
+            self.dropped += 1
+            return len(data)
+        self.sent += 1
+        return self.sock.sendto(data, addr)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+def open_client_socket(receive_buffer=4 * 1024 * 1024):
+    """创建客户端接收UDP画面的套接字，加大接收缓冲区以容纳关键帧的分片突发"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    except OSError:
+        pass
+    return sock
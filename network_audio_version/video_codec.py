@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+帧间视频编码
+通过PyAV(libavcodec)在CPU上进行H.264/VP8编码，使用低延迟设置（无B帧、zerolatency）
+PyAV未安装时不可用，调用方应回退到JPEG
+"""
+
+import struct
+from fractions import Fraction
+
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    av = None
+    AV_AVAILABLE = False
+
+VIDEO_MAGIC = b'VIDE'
+FLAG_KEYFRAME = 0x01
+
+# 消息头: 魔数, 编码ID, 标志
+VIDEO_HEADER = struct.Struct("!4sBB")
+
+# 名称: (编码ID, 编码器, 解码器, 低延迟选项)
+VIDEO_CODECS = {
+    'h264': (1, 'libx264', 'h264', {'preset': 'ultrafast', 'tune': 'zerolatency'}),
+    'vp8': (2, 'libvpx', 'vp8', {'deadline': 'realtime', 'cpu-used': '8', 'lag-in-frames': '0'}),
+}
+CODEC_NAMES = {codec_id: name for name, (codec_id, _, _, _) in VIDEO_CODECS.items()}
+
+
+def is_video_message(data):
+    """判断收到的数据是否为视频消息"""
+    return data[:4] == VIDEO_MAGIC
+
+
+def available_video_codecs():
+    """返回本机PyAV可编解码的视频格式列表"""
+    if not AV_AVAILABLE:
+        return []
+    names = []
+    for name, (_, encoder, decoder, _) in VIDEO_CODECS.items():
+        try:
+            av.codec.Codec(encoder, 'w')
+            av.codec.Codec(decoder, 'r')
+            names.append(name)
+        except Exception:
+            pass
+    return names
+
+
+class VideoEncoder:
+    """低延迟帧间视频编码器（服务端）"""
+    def __init__(self, codec='h264', fps=20, bitrate=1000000, keyframe_interval=200):
+        self.codec = codec
+        self.fps = fps
+        self.bitrate = bitrate
+        self.keyframe_interval = keyframe_interval
+        self.codec_id = VIDEO_CODECS[codec][0]
+        self.context = None
+        self.size = None
+        self.pts = 0
+
+    def open(self, width, height):
+        """按画面尺寸创建编码器"""
+        _, encoder, _, options = VIDEO_CODECS[self.codec]
+        context = av.CodecContext.create(encoder, 'w')
+        context.width = width
+        context.height = height
+        context.pix_fmt = 'yuv420p'
+        context.time_base = Fraction(1, self.fps)
+        context.framerate = Fraction(self.fps, 1)
+        context.bit_rate = self.bitrate
+        context.gop_size = self.keyframe_interval
+        context.max_b_frames = 0
+        context.options = dict(options)
+        context.open()
+        self.context = context
+        self.size = (width, height)
+        self.pts = 0
+
+    def encode(self, frame, keyframe=False):
+        """
+        编码一帧BGR图像
+        返回 (消息数据, 是否关键帧)，编码器尚未输出数据时返回 (None, False)
+        """
+        # yuv420p要求宽高为偶数
+        height, width = frame.shape[:2]
+        if width % 2 or height % 2:
+            frame = frame[:height - height % 2, :width - width % 2]
+            height, width = frame.shape[:2]
+        if self.context is None or self.size != (width, height):
+            self.open(width, height)
+            keyframe = True
+
+        video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+        video_frame.pts = self.pts
+        self.pts += 1
+        if keyframe:
+            video_frame.pict_type = av.video.frame.PictureType.I
+
+        packets = self.context.encode(video_frame)
+        if not packets:
+            return None, False
+
+        is_keyframe = any(packet.is_keyframe for packet in packets)
+        flags = FLAG_KEYFRAME if is_keyframe else 0
+        data = VIDEO_HEADER.pack(VIDEO_MAGIC, self.codec_id, flags) + b"".join(packets)
+        return data, is_keyframe
+
+
+class VideoDecoder:
+    """帧间视频解码器（客户端）"""
+    def __init__(self):
+        self.context = None
+        self.codec_id = None
+
+    def decode(self, data):
+        """解码一条视频消息，返回BGR图像；数据不足以输出画面时返回None"""
+        magic, codec_id, flags = VIDEO_HEADER.unpack_from(data, 0)
+        if self.context is None or self.codec_id != codec_id:
+            decoder = VIDEO_CODECS[CODEC_NAMES[codec_id]][2]
+            self.context = av.CodecContext.create(decoder, 'r')
+            self.codec_id = codec_id
+
+        # 每条消息恰好是一个完整的访问单元，直接构造数据包解码，避免解析器多缓存一帧
+        image = None
+        for frame in self.context.decode(av.Packet(bytes(data[VIDEO_HEADER.size:]))):
+            image = frame.to_ndarray(format='bgr24')
+        return image
@@ -8,16 +8,18 @@
 import cv2
 import numpy as np
 import socket
-import struct
 import threading
 import time
 import logging
 import tkinter as tk
 from PIL import Image, ImageTk
 
+from video_codec import VideoDecoder, available_video_codecs, is_video_message
+from stream_protocol import client_hello, FrameReader, MSG_FRAME
+
 class RemoteViewerNode:
     """远程查看器节点"""
-    def __init__(self, server_ip='localhost', tcp_port=8485):
+    def __init__(self, server_ip='localhost', tcp_port=8485, tier='720p'):
         self.server_ip = server_ip
         self.tcp_port = tcp_port
         self.tcp_socket = None
@@ -25,6 +27,9 @@ class RemoteViewerNode:
         self.window = None
         self.canvas = None
         self.photo = None
+        self.video_decoder = VideoDecoder()
+        self.tier = tier  # 请求的分辨率档位
+        self.reader = None  # 按握手协商的协议版本读取消息
         
     def setup_gui(self):
         """设置GUI界面"""
@@ -43,29 +48,31 @@ class RemoteViewerNode:
         self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.tcp_socket.connect((self.server_ip, self.tcp_port))
         logging.info(f"已连接到服务器: {self.server_ip}:{self.tcp_port}")
+        reply = client_hello(self.tcp_socket, available_video_codecs() + ['jpeg'], self.tier)
+        logging.info(f"屏幕编码: {reply['codec']} 档位: {reply.get('tier', self.tier)} 协议版本: {reply['protocol']}")
+        self.reader = FrameReader(self.tcp_socket, reply['protocol'], pending=reply.get('pending', b''))
+        size = reply.get('tiers', {}).get(reply.get('tier'))
+        if size and self.canvas:
+            self.canvas.config(width=size[0], height=size[1])
         
     def receive_frame(self):
         """接收并显示视频帧"""
         try:
             while self.is_running:
-                # 接收图像大小（4字节）
-                size_data = self.tcp_socket.recv(4)
-                if not size_data:
+                # 接收一条消息（帧头或旧服务端的4字节长度，加图像数据）
+                message = self.reader.read()
+                if message is None:
                     break
-                    
-                size = struct.unpack(">L", size_data)[0]
-                
-                # 接收图像数据
-                data = b""
-                while len(data) < size:
-                    packet = self.tcp_socket.recv(size - len(data))
-                    if not packet:
-                        break
-                    data += packet
+                data = message.payload
                 
-                if len(data) == size:
+                if message.type == MSG_FRAME:
                     # 解码图像
-                    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                    if is_video_message(data):
+                        frame = self.video_decoder.decode(data)
+                    else:
+                        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                    if frame is None:
+                        continue
                     
                     # 转换为PIL图像
                     frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -6,22 +6,41 @@
 """
 
 import cv2
-import numpy as np
-import pyautogui
 import socket
 import threading
-import struct
 import time
 import logging
+import argparse
+
+from capture_backends import create_capture_backend, FrameBufferPool
+from frame_hub import FrameHub, FrameProducer
+from video_codec import VideoEncoder, VIDEO_CODECS, available_video_codecs
+from stream_protocol import server_accept_hello, apply_socket_profile, FrameWriter, FLAG_KEYFRAME
+from resolution_tiers import tier_sizes
 
 class ScreenCaptureNode:
     """屏幕捕获节点"""
-    def __init__(self, tcp_port=8485):
+    def __init__(self, tcp_port=8485, capture='auto', screen_codec='jpeg', notsent_lowat=0):
         self.tcp_port = tcp_port
+        self.notsent_lowat = notsent_lowat  # 内核中未发出字节数的上限，0为不限制
+        self.capture = create_capture_backend(capture)
+        logging.info(f"屏幕采集后端: {self.capture.name}")
         self.tcp_socket = None
         self.is_running = False
         self.fps = 30  # 目标帧率
         self.jpeg_quality = 50  # JPEG压缩质量
+        self.frame_hub = FrameHub()
+        self.frame_producer = FrameProducer(self.frame_hub, self.capture_screen, self.encode_frame, fps=self.fps,
+                                            release=self.release_encoder)
+        # 首选编码（'jpeg'/'h264'/'vp8'），连接时与客户端协商，不支持时回退到JPEG
+        self.available_codecs = available_video_codecs() + ['jpeg']
+        self.screen_codec = screen_codec if screen_codec in self.available_codecs else 'jpeg'
+        self.video_encoders = {}
+        # 分辨率档位在连接时由客户端选择，默认在1280x720以内保持宽高比
+        self.default_tier = '720p'
+        self.tiers = tier_sizes(self.capture.size())
+        self.tier_frames = {}
+        self.frame_buffers = FrameBufferPool()  # 缩放和颜色转换复用的缓冲区
         
     def setup_socket(self):
         """初始化TCP套接字"""
@@ -33,72 +52,70 @@ class ScreenCaptureNode:
         logging.info(f"TCP服务器监听端口: {self.tcp_port}")
         
     def capture_screen(self):
-        """捕获屏幕内容"""
+        """捕获一帧原始屏幕图像，缩放到各档位在编码时进行"""
         try:
-            # 截取屏幕
-            screenshot = pyautogui.screenshot()
-            # 转换为numpy数组
-            frame = np.array(screenshot)
-            # 转换颜色空间从RGB到BGR
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            
-            # 缩放图像以减少传输数据量
-            original_height, original_width = frame.shape[:2]
-            target_width = 1280  # 目标宽度
-            target_height = int(original_height * target_width / original_width)
-            
-            # 确保高度不超过720
-            if target_height > 720:
-                target_height = 720
-                target_width = int(original_width * target_height / original_height)
-            
-            frame = cv2.resize(frame, (target_width, target_height))
-            return frame
+            self.tier_frames = {}
+            return self.capture.grab()
         except Exception as e:
             logging.error(f"屏幕捕获失败: {e}")
             return None
             
+    def release_encoder(self, stream):
+        """释放已没有订阅者的编码流的视频编码器（由采集线程调用）"""
+        self.video_encoders.pop(stream, None)
+        
+    def encode_frame(self, stream, raw, keyframe):
+        """用协商的编码方式和档位压缩一帧（由采集线程调用）"""
+        tier, codec = stream
+        # 缩放图像以减少传输数据量，先缩放再转换颜色空间到BGR，每次采集每个档位只缩放一次
+        frame = self.tier_frames.get(tier)
+        if frame is None:
+            frame = self.capture.to_bgr(raw, self.tiers[tier], self.frame_buffers, tier)
+            self.tier_frames[tier] = frame
+        
+        # 帧间视频编码
+        if codec in VIDEO_CODECS:
+            if stream not in self.video_encoders:
+                self.video_encoders[stream] = VideoEncoder(codec, fps=self.fps)
+            return self.video_encoders[stream].encode(frame, keyframe)
+            
+        # 压缩图像
+        encode_param = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        success, buffer = cv2.imencode('.jpg', frame, encode_param)
+        
+        if not success:
+            return None, False
+        return buffer, True
+        
     def handle_client(self, client_socket, address):
-        """处理客户端连接"""
+        """处理客户端连接，只负责发送共享的编码帧"""
         logging.info(f"新的客户端连接: {address}")
+        subscriber = None
         
         try:
-            frame_interval = 1.0 / self.fps
-            last_frame_time = 0
+            # 协商编码方式和分辨率档位，订阅对应的编码流
+            codec, tier, hello = server_accept_hello(client_socket, self.screen_codec, self.available_codecs,
+                                                     tiers=self.tiers, default_tier=self.default_tier)
+            logging.info(f"客户端 {address} 使用编码: {codec} 档位: {tier} 协议版本: {hello['protocol']}")
+            subscriber = self.frame_hub.subscribe((tier, codec))
+            writer = FrameWriter(client_socket, hello['protocol'])
             
             while self.is_running:
-                current_time = time.time()
-                
-                # 控制帧率
-                if current_time - last_frame_time < frame_interval:
-                    time.sleep(0.001)
-                    continue
-                    
-                # 捕获屏幕
-                frame = self.capture_screen()
+                # 等待采集线程发布新帧
+                frame = subscriber.next_message()
                 if frame is None:
                     continue
-                    
-                # 压缩图像
-                encode_param = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
-                success, buffer = cv2.imencode('.jpg', frame, encode_param)
-                
-                if not success:
-                    continue
                 
-                # 发送图像大小（4字节）
-                size = len(buffer)
-                size_data = struct.pack(">L", size)
-                client_socket.sendall(size_data)
-                
-                # 发送图像数据
-                client_socket.sendall(buffer.tobytes())
-                
-                last_frame_time = current_time
+                # 发送帧头（旧客户端为4字节长度）和图像数据
+                data, keyframe, frame_id, captured = frame
+                writer.send(data, seq=frame_id, captured=captured, flags=FLAG_KEYFRAME if keyframe else 0)
                 
         except Exception as e:
             logging.error(f"客户端处理错误: {e}")
         finally:
+            if subscriber:
+                subscriber.close()
+                logging.info(f"客户端发送统计: {subscriber.stats()}")
             client_socket.close()
             logging.info(f"客户端断开连接: {address}")
             
@@ -107,10 +124,14 @@ class ScreenCaptureNode:
         self.is_running = True
         self.setup_socket()
         
+        # 启动屏幕采集编码线程，所有客户端共享同一份编码帧
+        self.frame_producer.start()
+        
         # 主循环：接受TCP连接
         while self.is_running:
             try:
                 client_socket, address = self.tcp_socket.accept()
+                logging.info(f"套接字设置: {apply_socket_profile(client_socket, 'video', self.notsent_lowat)}")
                 # 为每个客户端创建一个线程
                 client_thread = threading.Thread(
                     target=self.handle_client,
@@ -128,16 +149,23 @@ class ScreenCaptureNode:
     def stop(self):
         """停止节点"""
         self.is_running = False
+        self.frame_producer.stop()
+        self.capture.close()
         if self.tcp_socket:
             self.tcp_socket.close()
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='屏幕捕获节点')
+    parser.add_argument('--capture', choices=['auto', 'mss', 'pyautogui', 'synthetic'], default='auto',
+                        help='屏幕采集后端，synthetic为无显示环境下的合成画面')
+    args = parser.parse_args()
+    
     # 配置日志
     logging.basicConfig(level=logging.INFO)
     
     # 创建并启动节点
-    node = ScreenCaptureNode()
+    node = ScreenCaptureNode(capture=args.capture)
     
     try:
         node.start()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+屏幕流连接握手和消息帧格式
+客户端连接后发送支持的编码列表、希望的分辨率档位和协议版本，服务端选定后回复
+握手之后的消息带有版本化的帧头（消息类型、标志、帧序号、采集时间戳、负载长度）
+没有发送握手的旧客户端按JPEG处理，消息只有4字节长度前缀
+接收端用recv_into把数据读入复用的缓冲区，负载以memoryview返回，不逐包拼接
+发送端用sendmsg把帧头和负载在一次系统调用中发出，各通道按用途设置套接字选项
+"""
+
+import collections
+import json
+import select
+import socket
+import struct
+import sys
+import time
+
+SIZE_HEADER = struct.Struct("!L")
+HELLO_TIMEOUT = 1.0  # 服务端等待客户端握手的时间（秒）
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024  # 单条消息的上限，损坏的长度字段不会导致分配巨大的内存
+MAX_JSON_MESSAGE_SIZE = 1024 * 1024  # 握手和回报等JSON消息的上限
+
+# 协议版本：0为旧的4字节长度前缀，1起为带帧头的消息
+LEGACY_PROTOCOL = 0
+PROTOCOL_VERSION = 1
+
+# 帧头: 魔数, 版本, 消息类型, 标志, 帧序号, 采集时间戳（服务端单调时钟，微秒）, 负载长度
+FRAME_MAGIC = b'RD'
+FRAME_HEADER = struct.Struct("!2sBBHIQI")
+
+# 消息类型，握手时客户端在messages中列出能处理的类型，服务端不发送客户端不认识的类型
+MSG_FRAME = 1  # 屏幕画面
+MSG_CURSOR_SHAPE = 2  # 光标形状位图
+MESSAGE_TYPES = {'frame': MSG_FRAME, 'cursor_shape': MSG_CURSOR_SHAPE}
+
+FLAG_KEYFRAME = 0x0001  # 可以独立解码的画面
+
+# 各通道的套接字配置：nodelay关闭Nagle算法，sndbuf为发送缓冲区大小（字节）
+SOCKET_PROFILES = {
+    'video': {'nodelay': True, 'sndbuf': 1024 * 1024},
+    'audio': {'nodelay': True, 'sndbuf': 64 * 1024},
+    'control': {'nodelay': True},
+}
+# 旧版本Python的socket模块没有该常量，Linux下的取值为25
+TCP_NOTSENT_LOWAT = getattr(socket, 'TCP_NOTSENT_LOWAT', 25 if sys.platform.startswith('linux') else None)
+
+# 收到的消息: 类型, 标志, 帧序号, 采集时间戳（秒）, 负载
+Message = collections.namedtuple('Message', 'type flags seq captured payload')
+
+
+class ProtocolError(Exception):
+    """收到的帧头不符合协议"""
+    pass
+
+
+def pack_header(msg_type, length, seq=0, captured=None, flags=0):
+    """打包帧头，captured为服务端time.monotonic()的采集时间，缺省为当前时间"""
+    if captured is None:
+        captured = time.monotonic()
+    return FRAME_HEADER.pack(FRAME_MAGIC, PROTOCOL_VERSION, msg_type, flags,
+                             seq & 0xFFFFFFFF, int(captured * 1000000), length)
+
+
+def unpack_header(data):
+    """解析帧头，返回 (类型, 标志, 帧序号, 采集时间戳, 负载长度)"""
+    magic, version, msg_type, flags, seq, captured, length = FRAME_HEADER.unpack(data)
+    if magic != FRAME_MAGIC or version != PROTOCOL_VERSION:
+        raise ProtocolError(f"无效的帧头: {bytes(data[:4])!r} 版本 {version}")
+    return msg_type, flags, seq, captured / 1000000, length
+
+
+def negotiated_protocol(message):
+    """根据对方握手消息中的协议版本得到双方共同使用的版本，旧程序不带版本号"""
+    return min(int(message.get('protocol', LEGACY_PROTOCOL)), PROTOCOL_VERSION)
+
+
+def apply_socket_profile(sock, profile, notsent_lowat=0):
+    """
+    按通道用途设置TCP套接字选项，返回实际生效的设置，平台不支持的选项跳过
+    notsent_lowat大于0时限制内核中尚未发出的字节数：发送在队列变浅之前阻塞，
+    积压留在应用层的邮箱中被合并或丢弃，而不是在内核队列里排队增加延迟
+    """
+    options = SOCKET_PROFILES[profile]
+    applied = {}
+    try:
+        if options.get('nodelay'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            applied['nodelay'] = True
+        if options.get('sndbuf'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, options['sndbuf'])
+            applied['sndbuf'] = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+        if notsent_lowat and TCP_NOTSENT_LOWAT is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, TCP_NOTSENT_LOWAT, notsent_lowat)
+            applied['notsent_lowat'] = notsent_lowat
+    except OSError as e:
+        applied['error'] = str(e)
+    return applied
+
+
+def send_buffers(sock, buffers):
+    """
+    把多个缓冲区作为一段连续数据发出，不先拼接
+    支持sendmsg的平台用一次分散/聚集调用发送，只发出一部分时从断点继续；其他平台（Windows）逐个sendall
+    """
+    if not hasattr(sock, 'sendmsg'):
+        for buffer in buffers:
+            sock.sendall(buffer)
+        return
+    views = [memoryview(buffer).cast('B') for buffer in buffers]
+    remaining = sum(len(view) for view in views)
+    while True:
+        sent = sock.sendmsg(views)
+        remaining -= sent
+        if remaining <= 0:
+            return
+        # 跳过已经发出的部分
+        while sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        views[0] = views[0][sent:]
+
+
+def message_header(version, size, msg_type=MSG_FRAME, seq=0, captured=None, flags=0):
+    """按协议版本生成消息头，旧协议只有长度前缀，不携带类型和时间戳"""
+    if version == LEGACY_PROTOCOL:
+        return SIZE_HEADER.pack(size)
+    return pack_header(msg_type, size, seq, captured, flags)
+
+
+class FrameWriter:
+    """按协商的协议版本发送消息"""
+    def __init__(self, sock, version=PROTOCOL_VERSION):
+        self.sock = sock
+        self.version = version
+
+    def send(self, payload, msg_type=MSG_FRAME, seq=0, captured=None, flags=0):
+        """发送一条消息"""
+        header = message_header(self.version, memoryview(payload).nbytes, msg_type, seq, captured, flags)
+        send_buffers(self.sock, (header, payload))
+
+
+class ReceiveBuffer:
+    """
+    套接字接收缓冲区
+    用recv_into一次读入尽可能多的数据到预分配的bytearray，消息超过缓冲区时换用更大的缓冲区
+    read_exact返回指向缓冲区的memoryview，只在下一次读取之前有效，需要保留时由调用方复制
+    pending为已经从套接字读出、尚未处理的数据
+    """
+    def __init__(self, sock, size=256 * 1024, max_message=MAX_MESSAGE_SIZE, pending=b''):
+        self.sock = sock
+        self.buffer = bytearray(max(size, len(pending)))
+        self.view = memoryview(self.buffer)
+        self.view[:len(pending)] = pending
+        self.start = 0  # 尚未取走的数据的起点
+        self.end = len(pending)  # 已接收数据的终点
+        self.max_message = max_message
+
+    def read_exact(self, size):
+        """读取恰好size字节，返回memoryview，连接关闭时返回None；超过上限时抛出ProtocolError"""
+        if size > self.max_message:
+            raise ProtocolError(f"消息长度 {size} 超过上限 {self.max_message}")
+        if self.end - self.start < size and not self.fill(size):
+            return None
+        data = self.view[self.start:self.start + size]
+        self.start += size
+        return data
+
+    def fill(self, size):
+        """接收数据直到缓冲区中至少有size字节未取走，连接关闭时返回False"""
+        pending = self.end - self.start
+        if pending == 0 or self.start + size > len(self.buffer):
+            # 把未取走的数据移到开头，仍然放不下这条消息时换用更大的缓冲区
+            if size > len(self.buffer):
+                buffer = bytearray(max(size, len(self.buffer) * 2))
+                buffer[:pending] = self.view[self.start:self.end]
+                self.buffer = buffer
+                self.view = memoryview(buffer)
+            elif pending:
+                self.view[:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        while self.end - self.start < size:
+            received = self.sock.recv_into(self.view[self.end:])
+            if not received:
+                return False
+            self.end += received
+        return True
+
+
+class FrameReader:
+    """
+    按协商的协议版本接收消息
+    返回的负载是接收缓冲区的memoryview，下一次read()之后失效，需要保留时由调用方复制
+    pending为握手时已经读出的数据（client_hello回复中的pending）
+    """
+    def __init__(self, sock, version=PROTOCOL_VERSION, max_message=MAX_MESSAGE_SIZE, pending=b''):
+        self.buffer = ReceiveBuffer(sock, max_message=max_message, pending=pending)
+        self.version = version
+
+    def read(self):
+        """接收一条消息，返回Message，连接关闭时返回None；旧协议的消息都视为画面"""
+        if self.version == LEGACY_PROTOCOL:
+            header = self.buffer.read_exact(SIZE_HEADER.size)
+            if header is None:
+                return None
+            msg_type, flags, seq, captured = MSG_FRAME, 0, 0, 0.0
+            length = SIZE_HEADER.unpack(header)[0]
+        else:
+            header = self.buffer.read_exact(FRAME_HEADER.size)
+            if header is None:
+                return None
+            msg_type, flags, seq, captured, length = unpack_header(header)
+        payload = self.buffer.read_exact(length)
+        if payload is None:
+            return None
+        return Message(msg_type, flags, seq, captured, payload)
+
+
+def recv_exact(sock, size):
+    """从套接字读取恰好size字节，连接关闭时返回None"""
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            return None
+        received += count
+    return bytes(data)
+
+
+def encode_message(message):
+    """把JSON消息编码为带长度前缀的字节串"""
+    data = json.dumps(message).encode('utf-8')
+    return SIZE_HEADER.pack(len(data)) + data
+
+
+def send_message(sock, message):
+    """发送一条带长度前缀的JSON消息"""
+    sock.sendall(encode_message(message))
+
+
+def recv_message(sock):
+    """接收一条带长度前缀的JSON消息，连接关闭时返回None"""
+    header = recv_exact(sock, SIZE_HEADER.size)
+    if header is None:
+        return None
+    size = SIZE_HEADER.unpack(header)[0]
+    if size > MAX_JSON_MESSAGE_SIZE:
+        raise ProtocolError(f"JSON消息长度 {size} 超过上限 {MAX_JSON_MESSAGE_SIZE}")
+    data = recv_exact(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def client_hello(sock, codecs, tier=None, options=None, messages=('frame',)):
+    """
+    客户端握手：发送支持的编码列表（按偏好排序）、希望的分辨率档位、协议版本、能处理的消息类型以及其他客户端能力options
+    返回服务端的回复，包含选定的 codec、tier、各档位尺寸 tiers 和协议版本 protocol（旧服务端为0）
+    旧服务端不回复而直接发送画面，已读出的第一帧（含长度前缀）放在回复的pending中，交给FrameReader
+    """
+    hello = {'type': 'hello', 'codecs': list(codecs), 'protocol': PROTOCOL_VERSION, 'messages': list(messages)}
+    if tier:
+        hello['tier'] = tier
+    if options:
+        hello.update(options)
+    send_message(sock, hello)
+    header = recv_exact(sock, SIZE_HEADER.size)
+    if header is None:
+        return {'codec': 'jpeg', 'protocol': LEGACY_PROTOCOL}
+    size = SIZE_HEADER.unpack(header)[0]
+    if size > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"消息长度 {size} 超过上限 {MAX_MESSAGE_SIZE}")
+    data = recv_exact(sock, size)
+    if data is None:
+        return {'codec': 'jpeg', 'protocol': LEGACY_PROTOCOL}
+    reply = None
+    if size <= MAX_JSON_MESSAGE_SIZE and data[:1] == b'{':
+        try:
+            reply = json.loads(data.decode('utf-8'))
+        except ValueError:
+            pass
+    if not isinstance(reply, dict) or reply.get('type') != 'hello_ack':
+        return {'codec': 'jpeg', 'protocol': LEGACY_PROTOCOL, 'pending': header + data}
+    reply['protocol'] = negotiated_protocol(reply)
+    return reply
+
+
+def server_accept_hello(sock, preferred, available, tiers=None, default_tier=None, timeout=HELLO_TIMEOUT,
+                        reply_options=None):
+    """
+    服务端握手：等待客户端的编码列表并选定编码和分辨率档位，返回 (codec, tier, 客户端的握手消息)
+    客户端支持服务端首选编码时使用首选编码，否则回退到JPEG
+    tiers为各档位尺寸，客户端请求的档位不存在时使用default_tier
+    双方使用的协议版本写入握手消息的protocol字段，之后的消息按该版本发送
+    旧客户端不发送握手，超时后直接使用JPEG和默认档位且不回复，握手消息为 {'protocol': 0}
+    reply_options为附加在回复中的服务端参数
+    """
+    hello = None
+    readable, _, _ = select.select([sock], [], [], timeout)
+    if readable:
+        hello = recv_message(sock)
+    codec, tier, hello, reply = negotiate_hello(hello, preferred, available, tiers, default_tier, reply_options)
+    if reply:
+        send_message(sock, reply)
+    return codec, tier, hello
+
+
+def negotiate_hello(hello, preferred, available, tiers=None, default_tier=None, reply_options=None):
+    """
+    根据客户端的握手消息选定编码、分辨率档位和协议版本，返回 (codec, tier, 握手消息, 回复)
+    hello不是握手消息（旧客户端）时使用JPEG和默认档位，回复为None；reply_options附加在回复中
+    """
+    if not hello or hello.get('type') != 'hello':
+        return 'jpeg', default_tier, {'protocol': LEGACY_PROTOCOL}, None
+
+    offered = hello.get('codecs', [])
+    codec = preferred if preferred in offered and preferred in available else 'jpeg'
+    tier = hello.get('tier') if tiers and hello.get('tier') in tiers else default_tier
+    hello['protocol'] = negotiated_protocol(hello)
+    reply = {'type': 'hello_ack', 'codec': codec, 'protocol': hello['protocol']}
+    if tiers:
+        reply['tier'] = tier
+        reply['tiers'] = tiers
+    if reply_options:
+        reply.update(reply_options)
+    return codec, tier, hello, reply
+
+
+def accepts_message(hello, name):
+    """客户端是否在握手中声明能处理该类型的消息，旧客户端只能处理画面"""
+    return name == 'frame' or name in hello.get('messages', ())
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+帧广播中心
+由单个采集/编码线程生成屏幕帧，所有客户端发送线程共享同一份编码结果
+每种编码方式是一路独立的流，只有存在订阅者的流才会被编码
+每个客户端有自己的小邮箱：较新的帧替换尚未发送的旧帧，慢客户端不会拖住采集线程
+每帧带有所在流的帧序号和采集时间，客户端据此发现跳过的帧并测量延迟
+"""
+
+import threading
+import time
+
+
+class StreamState:
+    """单路编码流的订阅情况"""
+    def __init__(self):
+        self.keyframe_requested = False
+        self.subscribers = []  # 当前订阅的客户端
+        self.frame_id = 0  # 最近一帧的序号
+
+
+class FrameHub:
+    """
+    把每路流的新帧投递到各订阅者的邮箱
+    merge(stream, older, newer) 可以把两条未发送的增量帧合并为一条，无法合并时返回None
+    on_publish() 在每次投递之后由采集线程调用，供不在条件变量上等待的发送方（例如事件循环）得到通知
+    """
+    def __init__(self, merge=None, max_pending=3, on_publish=None):
+        self.condition = threading.Condition()
+        self.streams = {}
+        self.closed = False
+        self.merge = merge
+        self.on_publish = on_publish
+        self.max_pending = max_pending  # 无法合并的增量帧最多积压几条，超过后丢弃并等待关键帧
+
+    def subscribe(self, stream='jpeg'):
+        """登记一个客户端，返回其订阅对象"""
+        subscriber = FrameSubscriber(self, stream)
+        self.add_subscriber(subscriber, stream)
+        return subscriber
+
+    def add_subscriber(self, subscriber, stream):
+        """把订阅对象登记到指定的流，从关键帧开始接收"""
+        with self.condition:
+            self.streams.setdefault(stream, StreamState()).subscribers.append(subscriber)
+            subscriber.stream = stream
+            subscriber.pending = []
+            subscriber.need_keyframe = True
+            self.streams[stream].keyframe_requested = True
+            self.condition.notify_all()
+
+    def remove_subscriber(self, subscriber):
+        """注销一个客户端"""
+        with self.condition:
+            state = self.streams.get(subscriber.stream)
+            if state and subscriber in state.subscribers:
+                state.subscribers.remove(subscriber)
+
+    def active_streams(self):
+        """返回当前有订阅者的流"""
+        with self.condition:
+            return [stream for stream, state in self.streams.items() if state.subscribers]
+
+    def has_subscribers(self):
+        """是否有客户端正在接收"""
+        return bool(self.active_streams())
+
+    def wait_subscribers(self, timeout=None):
+        """等待至少一个客户端连接，返回是否有订阅者"""
+        with self.condition:
+            if not self.closed and not any(s.subscribers for s in self.streams.values()):
+                self.condition.wait(timeout)
+            return any(s.subscribers for s in self.streams.values())
+
+    def publish(self, stream, data, keyframe=True, captured=None):
+        """
+        把一帧新的编码数据投递给该流的所有订阅者，增量帧的keyframe为False
+        captured为该帧的采集时间（time.monotonic()），缺省为当前时间
+        """
+        if captured is None:
+            captured = time.monotonic()
+        with self.condition:
+            state = self.streams.setdefault(stream, StreamState())
+            state.frame_id += 1
+            frame = (data, keyframe, state.frame_id, captured)
+            for subscriber in state.subscribers:
+                self.deliver(state, subscriber, frame)
+            self.condition.notify_all()
+        if self.on_publish is not None:
+            self.on_publish()
+
+    def deliver(self, state, subscriber, frame):
+        """向单个订阅者的邮箱投递一帧 (数据, 是否关键帧, 帧序号, 采集时间)（调用时已持有锁）"""
+        pending = subscriber.pending
+
+        # 关键帧可以独立解码，直接替换所有未发送的帧
+        if frame[1]:
+            subscriber.dropped += len(pending)
+            subscriber.pending = [frame]
+            subscriber.need_keyframe = False
+            return
+
+        # 等待关键帧期间的增量帧没有意义
+        if subscriber.need_keyframe:
+            state.keyframe_requested = True
+            return
+
+        if not pending:
+            pending.append(frame)
+            return
+
+        # 增量帧尽量与未发送的上一条合并，保证客户端画面正确；合并结果使用新帧的序号和采集时间
+        if self.merge is not None:
+            older, older_keyframe = pending[-1][:2]
+            merged = self.merge(subscriber.stream, older, frame[0])
+            if merged is not None:
+                pending[-1] = (merged, older_keyframe) + frame[2:]
+                subscriber.merged += 1
+                return
+
+        if len(pending) < self.max_pending:
+            pending.append(frame)
+            return
+
+        # 积压过多，丢弃全部并从下一个关键帧重新同步
+        subscriber.dropped += len(pending) + 1
+        subscriber.resyncs += 1
+        subscriber.pending = []
+        subscriber.need_keyframe = True
+        state.keyframe_requested = True
+
+    def request_keyframe(self, stream):
+        """请求采集线程尽快为指定的流输出关键帧"""
+        with self.condition:
+            self.streams.setdefault(stream, StreamState()).keyframe_requested = True
+
+    def take_keyframe_request(self, stream):
+        """取出并清除关键帧请求（由采集线程调用）"""
+        with self.condition:
+            state = self.streams.get(stream)
+            if state is None:
+                return False
+            requested = state.keyframe_requested
+            state.keyframe_requested = False
+            return requested
+
+    def close(self):
+        """关闭广播中心，唤醒所有等待线程"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class FrameSubscriber:
+    """单个客户端的邮箱和丢帧统计"""
+    def __init__(self, hub, stream):
+        self.hub = hub
+        self.stream = stream
+        self.pending = []  # 尚未发送的 (数据, 是否关键帧, 帧序号, 采集时间)
+        self.need_keyframe = True
+        self.sent = 0  # 已取出发送的帧数
+        self.dropped = 0  # 被更新的帧替换而未发送的帧数
+        self.merged = 0  # 与未发送的增量帧合并的帧数
+        self.resyncs = 0  # 因积压过多而等待关键帧的次数
+
+    def next_frame(self, timeout=1.0):
+        """等待邮箱中的下一帧，超时或关闭时返回None"""
+        frame = self.next_message(timeout)
+        return frame[0] if frame else None
+
+    def next_message(self, timeout=1.0):
+        """等待邮箱中的下一帧，返回 (数据, 是否关键帧, 帧序号, 采集时间)，超时或关闭时返回None"""
+        with self.hub.condition:
+            self.hub.condition.wait_for(lambda: self.pending or self.hub.closed, timeout)
+            if not self.pending or self.hub.closed:
+                return None
+            self.sent += 1
+            return self.pending.pop(0)
+
+    def switch(self, stream):
+        """切换到另一路流（例如调整了编码参数），切换后从关键帧开始接收"""
+        if stream == self.stream:
+            return
+        self.hub.remove_subscriber(self)
+        self.hub.add_subscriber(self, stream)
+
+    def stats(self):
+        """返回该客户端的发送和丢帧统计"""
+        with self.hub.condition:
+            return {
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'merged': self.merged,
+                'resyncs': self.resyncs,
+                'pending': len(self.pending),
+            }
+
+    def close(self):
+        """注销订阅"""
+        self.hub.remove_subscriber(self)
+
+
+class FrameProducer:
+    """
+    按目标帧率采集一帧，再为每路有订阅者的流各编码一次并发布到FrameHub
+    无客户端时空闲等待；提供stream_fps时各路流按各自的帧率编码（不超过采集帧率）
+    一路流不再有订阅者时调用release(stream)，由调用方释放该路流的编码器
+    """
+    def __init__(self, hub, capture, encode, fps=20, stream_fps=None, release=None):
+        self.hub = hub
+        self.capture = capture  # 返回一帧图像（BGR或采集后端的原始格式，由encode处理），失败时返回None
+        self.encode = encode  # encode(stream, frame, keyframe) 返回 (编码数据, 是否关键帧)，无变化时数据为None
+        self.fps = fps
+        self.stream_fps = stream_fps  # stream_fps(stream) 返回该路流的目标帧率
+        self.release = release
+        self.next_due = {}  # 每路流下一次应编码的时间
+        self.encoded = set()  # 编码过、尚未释放的流
+        self.running = False
+        self.thread = None
+
+    def is_due(self, stream, now):
+        """判断该路流本次采集是否需要编码"""
+        if self.stream_fps is None:
+            return True
+        due = self.next_due.get(stream, 0)
+        if now < due - 0.005:
+            return False
+        self.next_due[stream] = max(due + 1.0 / self.stream_fps(stream), now)
+        return True
+
+    def release_idle(self, streams):
+        """释放不在streams中的已编码流"""
+        for stream in self.encoded.difference(streams):
+            self.encoded.discard(stream)
+            self.next_due.pop(stream, None)
+            if self.release:
+                self.release(stream)
+
+    def start(self):
+        """启动采集编码线程"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """停止采集编码线程"""
+        self.running = False
+        self.hub.close()
+
+    def run(self):
+        """采集编码主循环"""
+        last_frame_time = 0
+
+        while self.running:
+            # 没有客户端时不做任何采集
+            if not self.hub.wait_subscribers(timeout=0.5):
+                self.release_idle(())
+                continue
+
+            # 控制帧率
+            frame_interval = 1.0 / self.fps
+            wait_time = frame_interval - (time.time() - last_frame_time)
+            if wait_time > 0:
+                time.sleep(wait_time)
+            last_frame_time = time.time()
+
+            try:
+                captured = time.monotonic()
+                frame = self.capture()
+                if frame is None:
+                    continue
+
+                streams = self.hub.active_streams()
+                self.release_idle(streams)
+                for stream in streams:
+                    if not self.is_due(stream, last_frame_time):
+                        continue
+                    keyframe = self.hub.take_keyframe_request(stream)
+                    self.encoded.add(stream)
+                    data, keyframe = self.encode(stream, frame, keyframe)
+                    if data is not None:
+                        self.hub.publish(stream, data, keyframe, captured)
+            except Exception as e:
+                print(f"屏幕采集编码错误: {e}")
+                time.sleep(0.1)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鼠标注入后端
+- xtest: 通过X11的XTEST扩展直接合成事件（需要python-xlib），每条命令只做一次flush，不等待
+- uinput: 通过Linux的/dev/uinput创建绝对坐标指针设备（需要evdev和设备写权限），Wayland下同样可用
+- pyautogui: 其他平台的回退，关闭了每次调用后默认0.1秒的PAUSE
+- recording: 只记录调用和时间，用于在无显示环境下测试注入延迟和顺序
+所有后端都不在调用中sleep；命令经InputQueue在专用的注入线程中执行，接收数据报的线程不会被注入阻塞
+后端记录按住的按键：按下和松开分别作为独立的命令到达，按住期间的移动即为拖拽，选中文字和移动窗口不会被打断
+注入跟不上时，积压的连续移动只执行最新的一个，点击、双击和拖拽的端点按顺序保留
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BUTTON_CODES = {'left': 1, 'middle': 2, 'right': 3}  # X11的按键编号
+
+
+class InputBackend:
+    """注入后端基类，子类实现move/press/release，坐标为屏幕像素"""
+    name = 'base'
+
+    def __init__(self):
+        self.held = set()  # 当前按住的按键
+
+    def size(self):
+        """返回屏幕尺寸 (width, height)"""
+        raise NotImplementedError
+
+    def move(self, x, y):
+        raise NotImplementedError
+
+    def press(self, button='left'):
+        raise NotImplementedError
+
+    def release(self, button='left'):
+        raise NotImplementedError
+
+    def flush(self):
+        """把已合成的事件提交给显示服务器"""
+        pass
+
+    def click(self, x, y, button='left'):
+        self.move(x, y)
+        self.press(button)
+        self.release(button)
+        self.flush()
+
+    def double_click(self, x, y, button='left'):
+        self.move(x, y)
+        for _ in range(2):
+            self.press(button)
+            self.release(button)
+        self.flush()
+
+    def button_down(self, x, y, button='left'):
+        """移动到指定位置并按下按键，已经按住时只移动"""
+        self.move(x, y)
+        if button not in self.held:
+            self.press(button)
+            self.held.add(button)
+        self.flush()
+
+    def button_up(self, x, y, button='left'):
+        """移动到指定位置并松开按键，没有按住时只移动"""
+        self.move(x, y)
+        if button in self.held:
+            self.release(button)
+            self.held.discard(button)
+        self.flush()
+
+    def drag(self, x, y, end_x, end_y, button='left'):
+        """
+        旧客户端的拖拽段：按键已经按住（由button_down按下）时只移动到终点；
+        否则从起点按下拖到终点后松开，每一段都是独立的一次拖拽
+        """
+        if button in self.held:
+            self.move(end_x, end_y)
+            self.flush()
+            return
+        self.move(x, y)
+        self.press(button)
+        self.move(end_x, end_y)
+        self.release(button)
+        self.flush()
+
+    def release_all(self):
+        """松开所有按住的按键，关闭后端或客户端断开时调用，避免按键卡在按下状态"""
+        for button in list(self.held):
+            self.release(button)
+            self.held.discard(button)
+        self.flush()
+
+    def move_to(self, x, y):
+        """单独的移动命令"""
+        self.move(x, y)
+        self.flush()
+
+    def close(self):
+        """释放资源"""
+        pass
+
+
+class XTestInputBackend(InputBackend):
+    """通过XTEST扩展注入（需要python-xlib）"""
+    name = 'xtest'
+
+    def __init__(self):
+        super().__init__()
+        from Xlib import X, display
+        from Xlib.ext import xtest
+        self.X = X
+        self.xtest = xtest
+        self.display = display.Display()
+        if not self.display.has_extension('XTEST'):
+            raise RuntimeError("X服务器不支持XTEST扩展")
+        screen = self.display.screen()
+        self.screen_size = (screen.width_in_pixels, screen.height_in_pixels)
+
+    def size(self):
+        return self.screen_size
+
+    def move(self, x, y):
+        self.xtest.fake_input(self.display, self.X.MotionNotify, x=int(x), y=int(y))
+
+    def press(self, button='left'):
+        self.xtest.fake_input(self.display, self.X.ButtonPress, BUTTON_CODES.get(button, 1))
+
+    def release(self, button='left'):
+        self.xtest.fake_input(self.display, self.X.ButtonRelease, BUTTON_CODES.get(button, 1))
+
+    def flush(self):
+        self.display.flush()
+
+    def close(self):
+        self.release_all()
+        self.display.close()
+
+
+class UinputInputBackend(InputBackend):
+    """通过/dev/uinput注入（需要evdev），设备的坐标范围即屏幕尺寸"""
+    name = 'uinput'
+
+    def __init__(self, screen_size):
+        super().__init__()
+        from evdev import UInput, AbsInfo, ecodes
+        self.ecodes = ecodes
+        self.screen_size = tuple(screen_size)
+        self.buttons = {'left': ecodes.BTN_LEFT, 'middle': ecodes.BTN_MIDDLE, 'right': ecodes.BTN_RIGHT}
+        width, height = self.screen_size
+        capabilities = {
+            ecodes.EV_KEY: list(self.buttons.values()),
+            ecodes.EV_ABS: [(ecodes.ABS_X, AbsInfo(0, 0, width - 1, 0, 0, 0)),
+                            (ecodes.ABS_Y, AbsInfo(0, 0, height - 1, 0, 0, 0))],
+        }
+        self.device = UInput(capabilities, name='remote-desktop-pointer')
+
+    def size(self):
+        return self.screen_size
+
+    def move(self, x, y):
+        self.device.write(self.ecodes.EV_ABS, self.ecodes.ABS_X, int(x))
+        self.device.write(self.ecodes.EV_ABS, self.ecodes.ABS_Y, int(y))
+        self.device.syn()
+
+    def press(self, button='left'):
+        self.device.write(self.ecodes.EV_KEY, self.buttons.get(button, self.ecodes.BTN_LEFT), 1)
+        self.device.syn()
+
+    def release(self, button='left'):
+        self.device.write(self.ecodes.EV_KEY, self.buttons.get(button, self.ecodes.BTN_LEFT), 0)
+        self.device.syn()
+
+    def close(self):
+        self.release_all()
+        self.device.close()
+
+
+class PyAutoGUIInputBackend(InputBackend):
+    """通过pyautogui注入，关闭PAUSE和失控保护"""
+    name = 'pyautogui'
+
+    def __init__(self):
+        super().__init__()
+        import pyautogui
+        pyautogui.PAUSE = 0
+        pyautogui.FAILSAFE = False
+        self.pyautogui = pyautogui
+
+    def size(self):
+        return tuple(self.pyautogui.size())
+
+    def move(self, x, y):
+        self.pyautogui.moveTo(x, y, duration=0, _pause=False)
+
+    def press(self, button='left'):
+        self.pyautogui.mouseDown(button=button, _pause=False)
+
+    def release(self, button='left'):
+        self.pyautogui.mouseUp(button=button, _pause=False)
+
+    def close(self):
+        self.release_all()
+
+
+class RecordingInputBackend(InputBackend):
+    """
+    不注入，只记录 (单调时钟时间, 操作, 参数)，线程安全
+    delay模拟每次调用的注入耗时（秒），用于测试执行器是否阻塞接收
+    """
+    name = 'recording'
+
+    def __init__(self, screen_size=(1920, 1080), delay=0.0):
+        super().__init__()
+        self.screen_size = tuple(screen_size)
+        self.delay = delay
+        self.events = []
+        self.lock = threading.Lock()
+
+    def size(self):
+        return self.screen_size
+
+    def record(self, operation, *args):
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            self.events.append((time.monotonic(), operation) + args)
+
+    def move(self, x, y):
+        self.record('move', int(x), int(y))
+
+    def press(self, button='left'):
+        self.record('press', button)
+
+    def release(self, button='left'):
+        self.record('release', button)
+
+    def take(self):
+        """取出并清空已记录的事件"""
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+
+INPUT_BACKENDS = ['auto', 'xtest', 'uinput', 'pyautogui', 'recording']
+
+
+def create_input_backend(name='auto', screen_size=(1920, 1080)):
+    """
+    创建注入后端，screen_size用于uinput设备的坐标范围和recording后端
+    'auto' 依次尝试xtest和pyautogui，都不可用时返回None（鼠标控制禁用）
+    """
+    if name == 'auto':
+        for candidate in ('xtest', 'pyautogui'):
+            try:
+                return create_input_backend(candidate, screen_size)
+            except Exception as e:
+                print(f"注入后端 {candidate} 不可用: {e}")
+        return None
+
+    if name == 'xtest':
+        return XTestInputBackend()
+    if name == 'uinput':
+        return UinputInputBackend(screen_size)
+    if name == 'pyautogui':
+        return PyAutoGUIInputBackend()
+    if name == 'recording':
+        return RecordingInputBackend(screen_size)
+    raise ValueError(f"未知的注入后端: {name}")
+
+
+def coalesce_commands(commands):
+    """
+    合并积压的鼠标命令：连续的移动只保留最新的，画面尺寸相同的连续拖拽合并为从第一段起点到最后一段终点
+    点击、双击和拖拽端点的顺序不变；返回 (合并后的命令列表, 丢弃的移动数, 合并掉的拖拽段数)
+    """
+    result = []
+    moves = drags = 0
+    for command in commands:
+        previous = result[-1] if result else None
+        if previous is not None and previous['type'] == command['type'] == 'move':
+            result[-1] = command
+            moves += 1
+        elif (previous is not None and previous['type'] == command['type'] == 'drag' and
+              (previous.get('w'), previous.get('h')) == (command.get('w'), command.get('h'))):
+            merged = dict(previous)
+            merged['end_x'] = command.get('end_x', command.get('x', 0))
+            merged['end_y'] = command.get('end_y', command.get('y', 0))
+            result[-1] = merged
+            drags += 1
+        else:
+            result.append(command)
+    return result, moves, drags
+
+
+class InputQueue:
+    """
+    注入线程的命令队列：接收方调用submit()后立即返回，注入线程每次取走全部积压的命令，合并后按顺序执行
+    execute(command, received) 在注入线程中调用，received为本轮最早的命令到达时的单调时钟时间
+    """
+    def __init__(self, execute):
+        self.execute = execute
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='input')
+        self.lock = threading.Lock()
+        self.pending = []  # (命令, 收到时间)
+        self.scheduled = False  # 注入线程中是否已有待运行的run()
+        self.stats = {'commands': 0, 'batches': 0, 'max_batch': 0, 'coalesced_moves': 0, 'coalesced_drags': 0}
+
+    def submit(self, commands):
+        """把一批命令加入队列（任意线程）"""
+        if not commands:
+            return
+        received = time.monotonic()
+        with self.lock:
+            self.pending.extend((command, received) for command in commands)
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.executor.submit(self.run)
+
+    def run(self):
+        """在注入线程中执行积压的命令，执行期间新到的命令在下一轮合并"""
+        while True:
+            with self.lock:
+                batch, self.pending = self.pending, []
+                if not batch:
+                    self.scheduled = False
+                    return
+            received = batch[0][1]  # 本轮最早到达的命令的时间
+            commands, moves, drags = coalesce_commands([command for command, _ in batch])
+            stats = self.stats
+            stats['commands'] += len(batch)
+            stats['batches'] += 1
+            stats['max_batch'] = max(stats['max_batch'], len(batch))
+            stats['coalesced_moves'] += moves
+            stats['coalesced_drags'] += drags
+            for command in commands:
+                try:
+                    self.execute(command, received)
+                except Exception as e:
+                    print(f"执行控制命令错误: {e}")
+
+    def shutdown(self, finish=None):
+        """停止注入线程，finish在已提交的命令执行完之后于注入线程中调用（如关闭后端、松开按住的按键）"""
+        if finish is not None:
+            self.executor.submit(finish)
+        self.executor.shutdown(wait=False)
@@ -9,14 +9,17 @@ import socket
 import cv2
 import numpy as np
 import threading
-import struct
 import time
-import json
 import tkinter as tk
 from PIL import Image, ImageTk
 
+from video_codec import VideoDecoder, available_video_codecs, is_video_message
+from stream_protocol import client_hello, FrameReader, MSG_FRAME
+from control_protocol import ControlSender, InputSampler
+
 class SimpleScreenClient:
-    def __init__(self, host='localhost', tcp_port=8485, udp_port=8486, audio_port=8487):
+    def __init__(self, host='localhost', tcp_port=8485, udp_port=8486, audio_port=8487, tier='default',
+                 input_rate=120):
         self.host = host
         self.tcp_port = tcp_port
         self.udp_port = udp_port
@@ -27,12 +30,18 @@ class SimpleScreenClient:
         self.fps = 0
         self.frame_count = 0
         self.last_time = time.time()
+        self.video_decoder = VideoDecoder()
+        self.reader = None  # 按握手协商的协议版本读取消息
+        self.tier = tier  # 请求的分辨率档位
+        self.view_size = (1024, 576)  # 当前档位的画面尺寸，控制坐标以此为准
         
         # GUI相关
         self.root = None
         self.video_label = None
         self.status_label = None
         self.control_enabled = True  # 默认启用鼠标控制
+        self.control_sender = ControlSender(binary=False)  # 服务端支持时改用二进制批量格式
+        self.input_sampler = InputSampler(input_rate)  # 按固定频率发送指针位置，按键事件立即发送
         
     def start(self):
         """启动客户端"""
@@ -43,18 +52,35 @@ class SimpleScreenClient:
             # TCP连接（接收屏幕图像）
             self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.tcp_socket.connect((self.host, self.tcp_port))
+            reply = client_hello(self.tcp_socket, available_video_codecs() + ['jpeg'], self.tier)
+            self.control_sender = ControlSender(binary='binary' in reply.get('control', ()))
+            self.input_sampler.transitions = 'buttons' in reply.get('control', ())
+            print(f"屏幕编码: {reply['codec']} 协议版本: {reply['protocol']} "
+                  f"控制格式: {'binary' if self.control_sender.binary else 'json'}")
+            self.reader = FrameReader(self.tcp_socket, reply['protocol'], pending=reply.get('pending', b''))
+            tiers = reply.get('tiers', {})
+            if reply.get('tier') in tiers:
+                self.view_size = tuple(tiers[reply['tier']])
+                self.root.geometry(f"{self.view_size[0]}x{self.view_size[1]+70}")
+            print(f"分辨率档位: {reply.get('tier', 'default')} {self.view_size[0]}x{self.view_size[1]}")
             
             # UDP连接（发送控制命令）
             self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind(('', 0))  # 先绑定本地端口，接收确认的线程可以立即开始等待
             
             self.running = True
             self.update_status(f"已连接到 {self.host}:{self.tcp_port}")
+            self.sample_input()
             
             # 启动接收线程
             receive_thread = threading.Thread(target=self.receive_screen)
             receive_thread.daemon = True
             receive_thread.start()
             
+            ack_thread = threading.Thread(target=self.receive_acks)
+            ack_thread.daemon = True
+            ack_thread.start()
+            
         except Exception as e:
             self.update_status(f"连接失败: {e}")
         
@@ -86,10 +112,11 @@ class SimpleScreenClient:
         
         # 绑定鼠标事件
         self.video_label.bind('<Motion>', self.on_mouse_move)
-        self.video_label.bind('<Button-1>', self.on_mouse_click)
+        self.video_label.bind('<Button-1>', self.on_mouse_press)
         self.video_label.bind('<Double-Button-1>', self.on_mouse_double_click)
         self.video_label.bind('<Button-3>', lambda e: self.on_mouse_click(e, 'right'))
         self.video_label.bind('<B1-Motion>', self.on_mouse_drag)
+        self.video_label.bind('<ButtonRelease-1>', self.on_mouse_release)
         
         # 控制面板
         control_frame = tk.Frame(self.root)
@@ -139,91 +166,93 @@ class SimpleScreenClient:
         print(f"鼠标控制已{status}")
         
     def send_command(self, command):
-        """发送控制命令"""
-        if not self.control_enabled or not self.udp_socket:
+        """发送一条控制命令"""
+        self.send_commands([command])
+        
+    def send_commands(self, commands):
+        """发送一批控制命令，二进制格式下放在一个数据报中"""
+        if not commands or not self.control_enabled or not self.udp_socket:
             return
             
+        # 附带当前画面尺寸，服务端据此把坐标换算到屏幕
+        self.send_datagrams(self.control_sender.encode(commands, self.view_size))
+        
+    def send_datagrams(self, datagrams):
+        """发送已编码的控制数据报"""
         try:
-            data = json.dumps(command).encode('utf-8')
-            self.udp_socket.sendto(data, (self.host, self.udp_port))
+            for data in datagrams:
+                self.udp_socket.sendto(data, (self.host, self.udp_port))
         except Exception as e:
             print(f"发送控制命令错误: {e}")
             
+    def receive_acks(self):
+        """接收服务端对点击和拖拽的确认"""
+        self.udp_socket.settimeout(0.5)
+        while self.running:
+            try:
+                data, _ = self.udp_socket.recvfrom(2048)
+            except (socket.timeout, ConnectionResetError):
+                continue
+            except OSError:
+                break
+            self.control_sender.handle_ack(data)
+            
+    def sample_input(self):
+        """按采样频率发送指针位置的变化，并重传未确认的点击和拖拽"""
+        if not self.running:
+            return
+        self.send_commands(self.input_sampler.tick())
+        if self.control_enabled and self.udp_socket:
+            self.send_datagrams(self.control_sender.retransmit())
+        self.root.after(max(1, round(self.input_sampler.interval * 1000)), self.sample_input)
+        
     def on_mouse_move(self, event):
-        """处理鼠标移动事件"""
-        command = {
-            'type': 'move',
-            'x': event.x,
-            'y': event.y
-        }
-        self.send_command(command)
+        """处理鼠标移动事件，只记录位置，由sample_input定时发送"""
+        self.input_sampler.motion(event.x, event.y)
         
     def on_mouse_click(self, event, button='left'):
-        """处理鼠标点击事件"""
+        """处理鼠标点击事件，与尚未发送的位置一起立即发送"""
         command = {
             'type': 'click',
             'x': event.x,
             'y': event.y,
             'button': button
         }
-        self.send_command(command)
+        self.send_commands(self.input_sampler.button(command))
+        
+    def on_mouse_press(self, event):
+        """处理左键按下事件，与尚未发送的位置一起立即发送（旧服务端为点击）"""
+        self.send_commands(self.input_sampler.press(event.x, event.y))
         
     def on_mouse_double_click(self, event):
-        """处理鼠标双击事件"""
-        command = {
-            'type': 'double_click',
-            'x': event.x,
-            'y': event.y
-        }
-        self.send_command(command)
+        """处理鼠标双击事件，第二次按下；旧服务端发送双击命令"""
+        self.send_commands(self.input_sampler.press(event.x, event.y, double=True))
         
     def on_mouse_drag(self, event):
-        """处理鼠标拖动事件"""
-        command = {
-            'type': 'drag',
-            'x': event.x,
-            'y': event.y,
-            'end_x': event.x,
-            'end_y': event.y
-        }
-        self.send_command(command)
+        """处理鼠标拖动事件，由sample_input定时发送（旧服务端为拖拽命令）"""
+        self.input_sampler.motion(event.x, event.y, dragging=True)
+        
+    def on_mouse_release(self, event):
+        """处理鼠标释放事件，立即发送最后的位置和松开（旧服务端为拖拽的最后一段）"""
+        self.send_commands(self.input_sampler.release(event.x, event.y))
         
     def receive_screen(self):
         """接收屏幕图像"""
-        data = b""
-        payload_size = struct.calcsize("!L")
-        
         while self.running:
             try:
-                # 接收图像大小
-                while len(data) < payload_size:
-                    packet = self.tcp_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < payload_size:
+                # 接收一条消息，不认识的消息类型直接跳过
+                message = self.reader.read()
+                if message is None:
                     break
-                    
-                packed_msg_size = data[:payload_size]
-                data = data[payload_size:]
-                msg_size = struct.unpack("!L", packed_msg_size)[0]
-                
-                # 接收图像数据
-                while len(data) < msg_size:
-                    packet = self.tcp_socket.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-                    
-                if len(data) < msg_size:
-                    break
-                    
-                frame_data = data[:msg_size]
-                data = data[msg_size:]
+                if message.type != MSG_FRAME:
+                    continue
+                frame_data = message.payload
                 
                 # 解码图像
-                frame = cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if is_video_message(frame_data):
+                    frame = self.video_decoder.decode(frame_data)
+                else:
+                    frame = cv2.imdecode(np.frombuffer(frame_data, dtype=np.uint8), cv2.IMREAD_COLOR)
                 
                 # 更新显示
                 if frame is not None:
@@ -6,25 +6,54 @@
 """
 
 import socket
+import argparse
 import cv2
-import numpy as np
-import pyautogui
 import threading
-import struct
 import time
-import json
+import select
+
+from capture_backends import create_capture_backend, FrameBufferPool
+from frame_hub import FrameHub, FrameProducer
+from video_codec import VideoEncoder, VIDEO_CODECS, available_video_codecs
+from stream_protocol import server_accept_hello, apply_socket_profile, FrameWriter, FLAG_KEYFRAME
+from resolution_tiers import DEFAULT_TIER, tier_sizes, client_to_screen
+from control_protocol import ControlReceiver, CONTROL_FORMATS
+from input_backends import create_input_backend, InputQueue
 
 class SimpleScreenServer:
-    def __init__(self, host='0.0.0.0', tcp_port=8485, udp_port=8486):
+    def __init__(self, host='0.0.0.0', tcp_port=8485, udp_port=8486, capture='auto', screen_codec='jpeg',
+                 notsent_lowat=0, input_backend='auto'):
         self.host = host
         self.tcp_port = tcp_port
         self.udp_port = udp_port
         self.running = False
         self.clients = []
+        self.notsent_lowat = notsent_lowat  # 内核中未发出字节数的上限，0为不限制
         self.tcp_socket = None
         self.udp_socket = None
-        self.screen_size = pyautogui.size()
+        self.frame_hub = FrameHub()
+        self.frame_producer = FrameProducer(self.frame_hub, self.capture_screen, self.encode_frame, fps=20,
+                                            release=self.release_encoder)
+        # 首选编码（'jpeg'/'h264'/'vp8'），连接时与客户端协商，不支持时回退到JPEG
+        self.available_codecs = available_video_codecs() + ['jpeg']
+        self.screen_codec = screen_codec if screen_codec in self.available_codecs else 'jpeg'
+        self.video_encoders = {}
+        self.capture = create_capture_backend(capture)
+        print(f"屏幕采集后端: {self.capture.name}")
+        # 鼠标注入在专用线程中进行，接收控制数据报的线程不等待注入完成，积压的连续移动只执行最新的一个
+        self.input = create_input_backend(input_backend, self.capture.size())
+        self.input_queue = InputQueue(self.execute_command) if self.input else None
+        if self.input:
+            print(f"鼠标注入后端: {self.input.name}")
+        else:
+            print("没有可用的鼠标注入后端，鼠标控制已禁用")
+        self.screen_size = self.input.size() if self.input else self.capture.size()
         print(f"屏幕尺寸: {self.screen_size[0]}x{self.screen_size[1]}")
+        # 分辨率档位在连接时由客户端选择，每次采集每个档位只缩放一次
+        self.tiers = tier_sizes(self.capture.size())
+        self.tier_frames = {}
+        self.frame_buffers = FrameBufferPool()  # 缩放和颜色转换复用的缓冲区
+        self.control_receiver = ControlReceiver()  # 控制命令支持二进制批量格式和旧的JSON格式
         
     def start(self):
         """启动服务器"""
@@ -43,6 +72,9 @@ class SimpleScreenServer:
         print(f"TCP服务器已启动，监听 {self.host}:{self.tcp_port}")
         print(f"UDP服务器已启动，监听 {self.host}:{self.udp_port}")
         
+        # 启动屏幕采集编码线程，所有客户端共享同一份编码帧
+        self.frame_producer.start()
+        
         # 启动接受TCP客户端线程
         tcp_thread = threading.Thread(target=self.accept_clients)
         tcp_thread.daemon = True
@@ -62,6 +94,10 @@ class SimpleScreenServer:
     def stop(self):
         """停止服务器"""
         self.running = False
+        self.frame_producer.stop()
+        self.capture.close()
+        if self.input_queue:
+            self.input_queue.shutdown(finish=self.input.close if self.input else None)
         if self.tcp_socket:
             self.tcp_socket.close()
         
@@ -79,6 +115,7 @@ class SimpleScreenServer:
             try:
                 client_socket, addr = self.tcp_socket.accept()
                 print(f"新TCP客户端连接: {addr}")
+                print(f"套接字设置: {apply_socket_profile(client_socket, 'video', self.notsent_lowat)}")
                 
                 client_thread = threading.Thread(
                     target=self.handle_client,
@@ -95,80 +132,133 @@ class SimpleScreenServer:
     def handle_control_commands(self):
         """处理UDP控制命令"""
         self.udp_socket.settimeout(0.5)
-        buffer_size = 1024
+        buffer_size = 2048  # 二进制格式一个数据报最多约1KB
         
         print("开始监听鼠标控制命令...")
         
         while self.running:
             try:
-                data, addr = self.udp_socket.recvfrom(buffer_size)
-                command = json.loads(data.decode('utf-8'))
-                
-                command_type = command.get('type')
-                x = command.get('x', 0)
-                y = command.get('y', 0)
+                datagrams = [self.udp_socket.recvfrom(buffer_size)]
+                # 不等待地取出已经到达的全部数据报，命令一起交给注入线程合并
+                while len(datagrams) < 256 and select.select([self.udp_socket], [], [], 0)[0]:
+                    datagrams.append(self.udp_socket.recvfrom(buffer_size))
                 
-                # 从客户端坐标转换到实际屏幕坐标
-                screen_x = int(x * self.screen_size[0] / 1024)
-                screen_y = int(y * self.screen_size[1] / 576)
-                
-                print(f"收到控制命令: {command_type} 坐标: ({x}, {y}) -> 屏幕: ({screen_x}, {screen_y})")
-                
-                # 执行鼠标操作
-                if command_type == 'move':
-                    pyautogui.moveTo(screen_x, screen_y)
-                elif command_type == 'click':
-                    button = command.get('button', 'left')
-                    pyautogui.click(screen_x, screen_y, button=button)
-                elif command_type == 'double_click':
-                    pyautogui.doubleClick(screen_x, screen_y)
-                elif command_type == 'drag':
-                    end_x = command.get('end_x', x)
-                    end_y = command.get('end_y', y)
-                    screen_end_x = int(end_x * self.screen_size[0] / 1024)
-                    screen_end_y = int(end_y * self.screen_size[1] / 576)
-                    pyautogui.dragTo(screen_end_x, screen_end_y, duration=0.1)
+                # 二进制格式的数据报可能携带多条命令，乱序到达的旧移动已被丢弃
+                commands = []
+                for data, addr in datagrams:
+                    commands.extend(self.control_receiver.receive(data, addr))
+                # 确认收到的点击和拖拽，客户端据此停止重传
+                for ack, addr in self.control_receiver.take_acks():
+                    self.udp_socket.sendto(ack, addr)
+                if self.input_queue is not None:
+                    self.input_queue.submit(commands)
                 
             except socket.timeout:
+                # 前面的点击或拖拽迟迟不到时，暂存超时的事件在这里放行
+                if self.input_queue is not None:
+                    self.input_queue.submit(self.control_receiver.expire())
                 continue
             except Exception as e:
                 print(f"处理控制命令错误: {e}")
                 
+    def execute_command(self, command, received=None):
+        """在注入线程中执行一条鼠标命令"""
+        command_type = command.get('type')
+        x = command.get('x', 0)
+        y = command.get('y', 0)
+        
+        # 从客户端坐标转换到实际屏幕坐标，旧客户端不携带画面尺寸时按1024x576换算
+        view_size = (command.get('w', 1024), command.get('h', 576))
+        screen_x, screen_y = client_to_screen(x, y, view_size, self.screen_size)
+        
+        print(f"收到控制命令: {command_type} 坐标: ({x}, {y}) -> 屏幕: ({screen_x}, {screen_y})")
+        
+        # 执行鼠标操作，后端不在调用中等待
+        try:
+            if command_type == 'move':
+                self.input.move_to(screen_x, screen_y)
+            elif command_type == 'click':
+                button = command.get('button', 'left')
+                self.input.click(screen_x, screen_y, button)
+            elif command_type == 'double_click':
+                self.input.double_click(screen_x, screen_y)
+            elif command_type == 'press':
+                self.input.button_down(screen_x, screen_y, command.get('button', 'left'))
+            elif command_type == 'release':
+                self.input.button_up(screen_x, screen_y, command.get('button', 'left'))
+            elif command_type == 'drag':
+                end_x = command.get('end_x', x)
+                end_y = command.get('end_y', y)
+                screen_end_x, screen_end_y = client_to_screen(end_x, end_y, view_size, self.screen_size)
+                self.input.drag(screen_x, screen_y, screen_end_x, screen_end_y)
+        except Exception as e:
+            print(f"执行控制命令错误: {e}")
+            
+    def capture_screen(self):
+        """捕获一帧原始屏幕图像（由采集线程调用），缩放到各档位在编码时进行"""
+        self.tier_frames = {}
+        return self.capture.grab()
+        
+    def release_encoder(self, stream):
+        """释放已没有订阅者的编码流的视频编码器（由采集线程调用）"""
+        self.video_encoders.pop(stream, None)
+        
+    def encode_frame(self, stream, raw, keyframe):
+        """用协商的编码方式和档位编码一帧（由采集线程调用）"""
+        tier, codec = stream
+        frame = self.tier_frames.get(tier)
+        if frame is None:
+            frame = self.capture.to_bgr(raw, self.tiers[tier], self.frame_buffers, tier)
+            self.tier_frames[tier] = frame
+        
+        # 帧间视频编码
+        if codec in VIDEO_CODECS:
+            if stream not in self.video_encoders:
+                self.video_encoders[stream] = VideoEncoder(codec, fps=20)
+            return self.video_encoders[stream].encode(frame, keyframe)
+        
+        # 压缩质量
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 50])
+        return buffer, True
+        
     def handle_client(self, client_socket):
-        """处理客户端连接"""
+        """处理客户端连接，只负责发送共享的编码帧"""
+        subscriber = None
         try:
+            # 协商编码方式和分辨率档位，订阅对应的编码流
+            codec, tier, hello = server_accept_hello(client_socket, self.screen_codec, self.available_codecs,
+                                                     tiers=self.tiers, default_tier=DEFAULT_TIER,
+                                                     reply_options={'control': CONTROL_FORMATS})
+            print(f"客户端使用编码: {codec} 档位: {tier} 协议版本: {hello['protocol']}")
+            subscriber = self.frame_hub.subscribe((tier, codec))
+            writer = FrameWriter(client_socket, hello['protocol'])
+
             while self.running:
-                # 捕获屏幕
-                screen = pyautogui.screenshot()
-                frame = np.array(screen)
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                
-                # 缩放到较小尺寸
-                frame = cv2.resize(frame, (1024, 576))
-                
-                # 压缩质量
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 50])
-                data = buffer.tobytes()
-                
-                # 发送大小
-                size = len(data)
-                size_data = struct.pack("!L", size)
-                client_socket.sendall(size_data)
-                
-                # 发送数据
-                client_socket.sendall(data)
+                # 等待采集线程发布新帧（帧率由采集线程控制）
+                frame = subscriber.next_message()
+                if frame is None:
+                    continue
                 
-                # 控制帧率
-                time.sleep(0.05)  # 约20FPS
+                # 发送帧头和数据，旧客户端只有长度前缀
+                data, keyframe, frame_id, captured = frame
+                writer.send(data, seq=frame_id, captured=captured, flags=FLAG_KEYFRAME if keyframe else 0)
                 
         except Exception as e:
             print(f"客户端处理错误: {e}")
         finally:
+            if subscriber:
+                subscriber.close()
+                print(f"客户端发送统计: {subscriber.stats()}")
             if client_socket in self.clients:
                 self.clients.remove(client_socket)
             client_socket.close()
             print("客户端连接已关闭")
 
 if __name__ == "__main__":
-    server = SimpleScreenServer()
+    parser = argparse.ArgumentParser(description='简单的屏幕共享服务端')
+    parser.add_argument('--capture', choices=['auto', 'mss', 'pyautogui', 'synthetic'], default='auto',
+                        help='屏幕采集后端，synthetic为无显示环境下的合成画面')
+    args = parser.parse_args()
+    
+    server = SimpleScreenServer(capture=args.capture)
     server.start() 
\ No newline at end of file